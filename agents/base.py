@@ -6,6 +6,9 @@ import requests
 import logging
 import time
 import random
+import hashlib
+from utils.token_counter import count_tokens, token_histogram
+from utils.model_profiler import model_profiles
 
 class DialogueAgent:
     """
@@ -19,6 +22,10 @@ class DialogueAgent:
         self.agent_type = "base"  # 用于标识Agent类型
         self.description = "基础对话代理"  # 简要描述
         self.max_retries = 3  # 最大重试次数
+        self.context_length = None  # 模型上下文窗口大小（token），未知时不做检查
+        self.output_token_reserve = 4096  # 为模型输出预留的 token 数
+        self.last_call_failed = False  # 最近一次调用是否失败
+        self.rate_limiter = None  # 可选的共享限流器（utils.rate_limiter.RateLimiter），每次调用前获取令牌
         
     def get_agent_info(self):
         """获取Agent的基本信息"""
@@ -29,21 +36,94 @@ class DialogueAgent:
             "api_type": self.api_type
         }
     
+    def get_client_identity(self):
+        """
+        API 客户端的标识，用于区分不同账号的请求
+        OpenRouter 客户端使用 API 密钥的哈希（同一密钥的不同客户端视为相同），OpenAI 客户端使用对象标识
+        """
+        if isinstance(self.client, dict):
+            api_key = self.client.get("api_key") or ""
+            return hashlib.sha256(api_key.encode("utf-8")).hexdigest()[:16]
+        return id(self.client)
+    
+    def get_prompt_token_budget(self):
+        """获取提示可用的 token 上限，上下文窗口未知时返回 None"""
+        if not self.context_length:
+            return None
+        # 预留输出空间，但最多占用上下文窗口的四分之一
+        return self.context_length - min(self.output_token_reserve, self.context_length // 4)
+    
+    def fit_prompt_sections(self, render, fields, reducible_keys):
+        """
+        渲染提示，超出 token 上限时按优先级从低到高逐步截断可缩减的部分
+        
+        Args:
+            render (callable): 接收 fields 关键字参数并返回提示文本的函数
+            fields (dict): 模板字段
+            reducible_keys (list): 可缩减的字段名，按优先级从低到高排列，字段值为按行分隔的列表文本
+            
+        Returns:
+            str: 渲染后的提示
+        """
+        prompt = render(**fields)
+        budget = self.get_prompt_token_budget()
+        if budget is None:
+            return prompt
+        
+        fields = dict(fields)
+        for key in reducible_keys:
+            lines = fields[key].split('\n') if fields[key] else []
+            while lines and count_tokens(prompt) > budget:
+                # 每次保留前一半的条目，最后整段省略
+                lines = lines[:len(lines) // 2]
+                fields[key] = '\n'.join(lines) if lines else "- （因上下文长度限制省略）"
+                prompt = render(**fields)
+                logging.warning(f"提示超出模型上下文窗口，已截断 {key}（保留 {len(lines)} 条）")
+            if count_tokens(prompt) <= budget:
+                break
+        return prompt
+    
     def call_llm_api(self, prompt, tools=None):
         """使用 LLM API 调用模型，支持 OpenAI 和 OpenRouter"""
+        # 发送前在本地检查提示大小，避免超长请求在网络往返后才失败
+        prompt_tokens = count_tokens(prompt)
+        token_histogram.record(prompt_tokens)
+        budget = self.get_prompt_token_budget()
+        if budget is not None and prompt_tokens > budget:
+            error_msg = f"API 调用失败: 提示约 {prompt_tokens} tokens，超出模型 {self.model} 的上下文窗口 ({self.context_length} tokens)"
+            logging.error(error_msg)
+            # 与请求失败同样处理：调用方据此停止重试，性能档案也记为一次失败（失败调用不计入延迟）
+            self.last_call_failed = True
+            model_profiles.record(self.agent_type, self.model, 0.0, False)
+            return error_msg
+        
+        if self.rate_limiter is not None:
+            self.rate_limiter.acquire()
+        
+        # 记录本次调用的耗时和结果，供"最快可用"模式选择模型
+        self.last_call_failed = False
+        start_time = time.time()
+        result = None
         try:
             if self.api_type == "openai":
-                return self._call_openai_api(prompt, tools)
+                result = self._call_openai_api(prompt, tools)
             elif self.api_type == "openrouter":
-                return self._call_openrouter_api_with_retry(prompt, tools)
+                result = self._call_openrouter_api_with_retry(prompt, tools)
             else:
                 error_msg = f"不支持的 API 类型: {self.api_type}"
                 logging.error(error_msg)
+                self.last_call_failed = True
                 return None
         except Exception as e:
             error_msg = f"API 调用错误: {e}"
             logging.error(error_msg)
-            return None
+        
+        # 没有返回内容（如 OpenAI 调用出错）同样视为失败
+        if result is None:
+            self.last_call_failed = True
+        success = not self.last_call_failed
+        model_profiles.record(self.agent_type, self.model, time.time() - start_time, success)
+        return result
     
     def _call_openai_api(self, prompt, tools=None):
         """调用 OpenAI API"""
@@ -90,12 +170,14 @@ class DialogueAgent:
                     retries += 1
                 else:
                     # 其他类型的错误，直接返回错误信息
+                    self.last_call_failed = True
                     return result.get("message", "OpenRouter API 调用失败")
             else:
                 # 正常结果或其他非速率限制错误
                 return result
         
         # 达到最大重试次数后仍失败
+        self.last_call_failed = True
         return "OpenRouter API 调用失败: 达到速率限制，请稍后再试或考虑升级账户计划"
     
     def _call_openrouter_api(self, prompt, tools=None):
@@ -114,8 +196,11 @@ class DialogueAgent:
         if tools:
             data["tools"] = tools
         
+        # 客户端配置中带有 requests.Session 时复用其连接池
+        http = self.client.get("session") or requests
+        
         try:
-            response = requests.post(
+            response = http.post(
                 "https://openrouter.ai/api/v1/chat/completions",
                 headers=headers,
                 json=data,
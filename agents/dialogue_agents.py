@@ -4,6 +4,27 @@ import json
 import re
 import logging
 from .base import DialogueAgent
+from utils.single_flight import generation_flights, normalize_text
+from utils.vocabulary_coverage import CoverageChecker, split_items
+from utils.dialogue_parser import SPEAKER_PREFIX, speaker_sequence, strip_speaker
+from .dialogue_state import DialogueProgressState
+from .prompt_templates import (
+    get_generation_template, get_adaptation_template, build_turns_example, bullet_list,
+    DEFAULT_DRAMATIC_INSTRUCTIONS, CUSTOM_DRAMATIC_HEADER, CUSTOM_DRAMATIC_FOOTER
+)
+
+# 后备对话的标记，后备对话不做词汇覆盖补齐
+FALLBACK_KEY_POINT = "对话生成失败，使用了后备方案"
+# API 调用失败但没有返回错误信息时使用的错误信息
+EMPTY_RESPONSE_ERROR = "API 调用失败: 模型没有返回内容"
+
+
+def _as_list(value):
+    """把模型返回的字段统一为列表（缺失时为空列表，单个值包装为列表）"""
+    if value is None:
+        return []
+    return value if isinstance(value, list) else [str(value)]
+
 
 class InitialDialogueAgent(DialogueAgent):
     """
@@ -14,6 +35,7 @@ class InitialDialogueAgent(DialogueAgent):
         super().__init__(client, model, api_type)
         self.agent_type = "initial_dialogue"
         self.description = "初始对话生成代理"
+        self.enforce_coverage = True  # 生成后检查自定义词汇和句型，缺失时只改写少数几行
     
     def process(self, context, dialogue_mode, goal, language, difficulty, num_turns, custom_vocabulary="", custom_sentence="", dramatic_elements=""):
         """
@@ -33,7 +55,152 @@ class InitialDialogueAgent(DialogueAgent):
         Returns:
             dict: 包含原始文本、关键点、意图、关键情节词汇和关键情节句型的结构化对话数据
         """
-        return self.generate_dialogue(context, dialogue_mode, goal, language, difficulty, num_turns, custom_vocabulary, custom_sentence, dramatic_elements)
+        # 多个会话或重复提交以相同输入同时生成时，只调用一次模型并共享结果
+        # 不同账号的客户端和不同上下文窗口设置的请求各自生成，避免互相影响计费、限额和提示截断
+        key = (
+            self.agent_type, self.api_type, self.get_client_identity(), self.model, self.context_length,
+            *(normalize_text(value) for value in (context, dialogue_mode, goal, language, difficulty)),
+            int(num_turns),
+            *(normalize_text(value) for value in (custom_vocabulary, custom_sentence, dramatic_elements))
+        )
+        return generation_flights.do(
+            key, self._generate_with_coverage,
+            context, dialogue_mode, goal, language, difficulty, num_turns, custom_vocabulary, custom_sentence, dramatic_elements
+        )
+    
+    def _generate_with_coverage(self, context, dialogue_mode, goal, language, difficulty, num_turns, custom_vocabulary="", custom_sentence="", dramatic_elements=""):
+        """生成初始对话，再补齐没有出现的自定义词汇和句型"""
+        dialogue_data = self.generate_dialogue(context, dialogue_mode, goal, language, difficulty, num_turns, custom_vocabulary, custom_sentence, dramatic_elements)
+        if self.enforce_coverage and isinstance(dialogue_data, dict):
+            dialogue_data = self._ensure_coverage(dialogue_data, custom_vocabulary, custom_sentence, language, difficulty)
+        return dialogue_data
+    
+    def _ensure_coverage(self, dialogue_data, custom_vocabulary, custom_sentence, language, difficulty):
+        """
+        在本地检查自定义词汇和句型是否出现在对话中；有缺失时只把缺失条目分配给少数几行，
+        用一次小上下文的改写调用替换这些行，不重新生成整段对话
+        
+        Returns:
+            dict: 对话数据（改写后覆盖的条目更多、且没有丢失原本覆盖的条目时才替换原文）
+        """
+        checker = CoverageChecker(split_items(custom_vocabulary), split_items(custom_sentence))
+        original_text = dialogue_data.get("original_text") or ""
+        if not checker or not original_text or FALLBACK_KEY_POINT in dialogue_data.get("key_points", []):
+            return dialogue_data
+        
+        lines = original_text.split('\n')
+        coverage = checker.check(lines)
+        if not coverage["missing"]:
+            return dialogue_data
+        
+        assignments = self._assign_coverage_lines(lines, coverage)
+        if not assignments:
+            logging.warning(f"对话中缺少自定义词汇或句型，且没有可改写的对话行: {coverage['missing']}")
+            return dialogue_data
+        
+        prompt = self._build_coverage_prompt(lines, assignments, checker, language, difficulty)
+        response = self.call_llm_api(prompt)
+        if self.last_call_failed:
+            # 补齐只是尽力而为，改写调用失败时保留已生成的对话，不把它当作生成失败
+            logging.warning(f"词汇覆盖改写调用失败，保留原对话: {response}")
+            self.last_call_failed = False
+            return dialogue_data
+        rewrites = self._parse_coverage_response(response)
+        new_lines = list(lines)
+        for index, text in rewrites.items():
+            if index not in assignments:
+                continue
+            # 改写后的行必须仍是一行，并保持原来的说话者，轮数和说话顺序不变
+            speaker = SPEAKER_PREFIX.match(lines[index]).group(1)
+            body = strip_speaker(" ".join(text.split()))
+            if body:
+                new_lines[index] = f"{speaker}: {body}"
+        
+        new_coverage = checker.check(new_lines)
+        lost = set(coverage["covered"]) - set(new_coverage["covered"])
+        if len(new_coverage["missing"]) < len(coverage["missing"]) and not lost:
+            dialogue_data["original_text"] = '\n'.join(new_lines)
+            coverage = new_coverage
+        if coverage["missing"]:
+            logging.warning(f"改写后仍缺少自定义词汇或句型: {coverage['missing']}")
+        return dialogue_data
+    
+    @staticmethod
+    def _assign_coverage_lines(lines, coverage):
+        """
+        为缺失的条目选择要改写的对话行：只选不包含已覆盖条目的行，并在对话中均匀分布
+        
+        Returns:
+            dict: 行号 -> 需要融入该行的条目列表
+        """
+        candidates = [index for index, line in enumerate(lines)
+                      if SPEAKER_PREFIX.match(line) and index not in coverage["line_items"]]
+        if not candidates:
+            return {}
+        missing = coverage["missing"]
+        assignments = {}
+        for position, item in enumerate(missing):
+            index = candidates[int((position + 0.5) * len(candidates) / len(missing))]
+            assignments.setdefault(index, []).append(item)
+        return assignments
+    
+    def _build_coverage_prompt(self, lines, assignments, checker, language, difficulty):
+        """构建只改写指定行的提示，每行只附带前后各一句对话作为上下文"""
+        dialogue_indices = [index for index, line in enumerate(lines) if SPEAKER_PREFIX.match(line)]
+        sections = []
+        for index in sorted(assignments):
+            items = "、".join(
+                f"{'句型' if checker.kind_of(item) == 'sentence' else '词汇'} \"{item}\"" for item in assignments[index]
+            )
+            position = dialogue_indices.index(index)
+            section = [f"第 {index + 1} 行需要融入: {items}"]
+            if position > 0:
+                section.append(f"上一句: {lines[dialogue_indices[position - 1]].strip()}")
+            section.append(f"原文: {lines[index].strip()}")
+            if position + 1 < len(dialogue_indices):
+                section.append(f"下一句: {lines[dialogue_indices[position + 1]].strip()}")
+            sections.append("\n".join(section))
+        sections_text = "\n\n".join(sections)
+        
+        return f"""请只改写下面对话中指定的几行，把给定的词汇或句型自然地融入这些行。
+
+语言要求: {language}
+内容难度: {difficulty}
+
+{sections_text}
+
+要求:
+1. 只改写指定的行，保持说话者（A 或 B）不变，改写后仍是一行
+2. 保持原句的意思、语气和难度，与上一句和下一句自然衔接
+3. 词汇需要原样出现（允许正常的词形变化）；句型中的 ...、sb、sth 等部分替换为合适的内容
+
+请以 JSON 格式返回:
+{{
+    "lines": [{{"line": 行号, "text": "改写后的整行（包含说话者前缀）"}}]
+}}"""
+    
+    @staticmethod
+    def _parse_coverage_response(response):
+        """
+        解析改写响应
+        
+        Returns:
+            dict: 行号（从 0 开始）-> 改写后的文本；无法解析时为空
+        """
+        if not response or '{' not in response or '}' not in response:
+            return {}
+        try:
+            data = json.loads(response[response.find('{'):response.rfind('}') + 1], strict=False)
+        except json.JSONDecodeError:
+            logging.warning("词汇覆盖改写响应不是有效的 JSON")
+            return {}
+        rewrites = {}
+        for entry in data.get("lines", []) if isinstance(data, dict) else []:
+            try:
+                rewrites[int(entry["line"]) - 1] = str(entry["text"])
+            except (KeyError, TypeError, ValueError):
+                continue
+        return rewrites
     
     def generate_dialogue(self, context, dialogue_mode, goal, language, difficulty, num_turns, custom_vocabulary="", custom_sentence="", dramatic_elements=""):
         """生成初始对话内容，采用优化策略"""
@@ -49,6 +216,9 @@ class InitialDialogueAgent(DialogueAgent):
             attempt += 1
             prompt = self._build_generation_prompt(context, dialogue_mode, goal, language, difficulty, num_turns, custom_vocabulary, custom_sentence, dramatic_elements)
             response = self.call_llm_api(prompt)
+            if self.last_call_failed:
+                # API 调用失败（包括提示超出上下文窗口）时重试没有意义，直接返回错误信息
+                return response or EMPTY_RESPONSE_ERROR
             
             try:
                 # 尝试解析响应为 JSON 格式
@@ -128,48 +298,30 @@ class InitialDialogueAgent(DialogueAgent):
         
     def _validate_dialogue(self, dialogue_text, dialogue_mode, required_turns):
         """验证对话格式和轮数，并确定是否可以修复"""
-        lines = dialogue_text.split('\n')
-        # 过滤空行和非对话行
-        dialogue_lines = [line.strip() for line in lines if line.strip() and 
-                         (line.strip().startswith("A:") or line.strip().startswith("A ") or 
-                          line.strip().startswith("B:") or line.strip().startswith("B "))]
+        # 对话行的说话者序列（对话行规则见 utils.dialogue_parser）
+        sequence = speaker_sequence(dialogue_text)
         
         # 检查第一个说话者
-        first_speaker = None
-        for line in dialogue_lines:
-            if line.startswith("A:") or line.startswith("A "):
-                first_speaker = "A"
-                break
-            elif line.startswith("B:") or line.startswith("B "):
-                first_speaker = "B"
-                break
+        first_speaker = sequence[0] if sequence else None
                 
         correct_first_speaker = "B" if dialogue_mode == "AI先说" else "A"
         first_speaker_correct = (first_speaker == correct_first_speaker)
         
-        # 计算轮数
-        speaker_sequence = []
-        for line in dialogue_lines:
-            if line.startswith("A:") or line.strip().startswith("A "):
-                speaker_sequence.append("A")
-            elif line.startswith("B:") or line.startswith("B "):
-                speaker_sequence.append("B")
-        
         # 计算完整的轮数
         turns = 0
         i = 0
-        while i < len(speaker_sequence) - 1:
+        while i < len(sequence) - 1:
             # 考虑两种对话模式
             if dialogue_mode == "AI先说":
                 # B说完A说算一轮
-                if speaker_sequence[i] == "B" and speaker_sequence[i+1] == "A":
+                if sequence[i] == "B" and sequence[i+1] == "A":
                     turns += 1
                     i += 2  # 跳过已计算的两个说话者
                 else:
                     i += 1  # 继续检查下一个
             else:  # 用户先说
                 # A说完B说算一轮
-                if speaker_sequence[i] == "A" and speaker_sequence[i+1] == "B":
+                if sequence[i] == "A" and sequence[i+1] == "B":
                     turns += 1
                     i += 2
                 else:
@@ -185,7 +337,7 @@ class InitialDialogueAgent(DialogueAgent):
             "actual_turns": turns,
             "expected_turns": required_turns,
             "first_speaker_correct": first_speaker_correct,
-            "speaker_sequence": speaker_sequence,
+            "speaker_sequence": sequence,
             "can_fix": can_fix
         }
         
@@ -208,42 +360,33 @@ class InitialDialogueAgent(DialogueAgent):
     def _extend_dialogue(self, dialogue_data, dialogue_mode, additional_turns, context, goal):
         """扩展对话，增加指定的轮数"""
         original_text = dialogue_data.get("original_text", "")
-        key_points = dialogue_data.get("key_points", [])
-        intentions = dialogue_data.get("intentions", [])
-        
-        # 构建提示，要求继续对话
-        prompt = f"""
-        请基于现有对话继续生成额外的 {additional_turns} 轮对话。
-        
-        原始对话背景: {context}
-        对话目标: {goal}
-        
-        已有对话:
-        {original_text}
-        
-        关键点:
-        {', '.join(key_points)}
-        
-        对话意图:
-        {', '.join(intentions)}
-        
-        请生成额外的 {additional_turns} 轮对话，保持与原有对话风格和目标一致。
-        在对话中，请使用A代表用户，B代表AI/助手。
-        一轮对话指的是用户和AI各说一次话。
-        
-        请只返回额外的对话内容，不需要重复已有对话。
-        """
         
+        # 用滚动摘要代替整段原文，提示大小不随已有轮数增长
+        state = DialogueProgressState(
+            context, goal,
+            target_vocabulary=dialogue_data.get("key_vocabulary", []),
+            dramatic_targets=dialogue_data.get("dramatic_elements", [])
+        )
+        state.add_beats(dialogue_data.get("key_points", []) + dialogue_data.get("intentions", []))
+        existing_turns = self._validate_dialogue(original_text, dialogue_mode, 0)["actual_turns"]
+        state.update(original_text, existing_turns)
+        
+        prompt = self._build_continuation_prompt(state, dialogue_mode, additional_turns)
         extension_response = self.call_llm_api(prompt)
+        # 调用失败时返回的是错误信息，不能拼接到对话中
+        if self.last_call_failed:
+            logging.warning(f"扩展对话失败: {extension_response}")
+            return None
+        extension_text, _, _ = DialogueProgressState.parse_continuation_response(extension_response)
         
         # 合并原始对话和扩展部分
-        if extension_response:
+        if extension_text:
             # 确保原始对话结尾有换行
             if not original_text.endswith('\n'):
                 original_text += '\n'
                 
             # 合并对话
-            new_text = original_text + extension_response
+            new_text = original_text + extension_text
             
             # 更新对话数据
             dialogue_data["original_text"] = new_text
@@ -257,9 +400,7 @@ class InitialDialogueAgent(DialogueAgent):
         lines = original_text.split('\n')
         
         # 提取对话行
-        dialogue_lines = [line for line in lines if line.strip() and 
-                         (line.strip().startswith("A:") or line.strip().startswith("A ") or 
-                          line.strip().startswith("B:") or line.strip().startswith("B "))]
+        dialogue_lines = [line for line in lines if SPEAKER_PREFIX.match(line)]
         
         # 根据对话模式确定如何计算轮数终点
         total_lines = 2 * required_turns  # 每轮两行：A和B各一行
@@ -294,7 +435,7 @@ class InitialDialogueAgent(DialogueAgent):
         
         return {
             "original_text": dialogue_text,
-            "key_points": ["对话生成失败，使用了后备方案"],
+            "key_points": [FALLBACK_KEY_POINT],
             "intentions": ["完成指定轮数的对话基本框架"],
             "key_vocabulary": [],
             "key_sentences": [],
@@ -323,6 +464,8 @@ class InitialDialogueAgent(DialogueAgent):
         first_batch_turns = min(batch_size, num_turns)
         prompt = self._build_generation_prompt(context, dialogue_mode, goal, language, difficulty, first_batch_turns, custom_vocabulary, custom_sentence, dramatic_elements)
         response = self.call_llm_api(prompt)
+        if self.last_call_failed:
+            return response or EMPTY_RESPONSE_ERROR
         
         try:
             # 解析第一批次响应
@@ -359,6 +502,19 @@ class InitialDialogueAgent(DialogueAgent):
             if generated_turns >= num_turns:
                 return complete_dialogue
                 
+            # 初始化滚动上下文状态，后续批次只携带摘要和最近几行
+            state = DialogueProgressState(
+                context, goal,
+                target_vocabulary=DialogueProgressState.split_items(custom_vocabulary) + complete_dialogue["key_vocabulary"],
+                dramatic_targets=DialogueProgressState.split_items(dramatic_elements) or complete_dialogue["dramatic_elements"],
+                language=language, difficulty=difficulty
+            )
+            state.update(
+                complete_dialogue["original_text"], generated_turns,
+                beats=complete_dialogue["key_points"],
+                dramatic_hits=complete_dialogue["dramatic_elements"] if dramatic_elements else []
+            )
+            
             # 继续生成剩余的对话
             remaining_turns = num_turns - generated_turns
             
@@ -366,47 +522,37 @@ class InitialDialogueAgent(DialogueAgent):
                 # 确定本批次需要生成的轮数
                 current_batch_turns = min(batch_size, remaining_turns)
                 
-                # 获取对话的最后部分作为上下文
-                dialogue_lines = complete_dialogue["original_text"].split('\n')
-                context_lines = dialogue_lines[-min(4, len(dialogue_lines)):]  # 取最后4行或更少
-                continuation_context = '\n'.join(context_lines)
-                
                 # 构建继续生成的提示
-                extension_prompt = f"""
-                请继续以下对话，生成额外的 {current_batch_turns} 轮对话。
-                
-                对话背景: {context}
-                对话目标: {goal}
-                
-                对话的前面部分已经生成，以下是最近的对话内容:
-                {continuation_context}
-                
-                请继续生成 {current_batch_turns} 轮对话，保持与前面对话的一致性和连贯性。
-                在对话中，请使用A代表用户，B代表AI/助手。
-                一轮对话指的是用户和AI各说一次话。
-                
-                请只返回新生成的对话部分，不需要重复前面的对话。
-                """
-                
+                extension_prompt = self._build_continuation_prompt(state, dialogue_mode, current_batch_turns)
                 extension_response = self.call_llm_api(extension_prompt)
+                if self.last_call_failed:
+                    # 续写失败时不返回只生成了一部分的对话
+                    return extension_response or EMPTY_RESPONSE_ERROR
+                extension_text, batch_beats, batch_dramatic = DialogueProgressState.parse_continuation_response(extension_response)
                 
                 # 解析和验证扩展部分
-                if extension_response:
+                if extension_text:
                     # 确保原始对话结尾有换行
                     if not complete_dialogue["original_text"].endswith('\n'):
                         complete_dialogue["original_text"] += '\n'
                         
                     # 合并对话
-                    complete_dialogue["original_text"] += extension_response
+                    complete_dialogue["original_text"] += extension_text
                     
                     # 验证新增部分
-                    validate_result = self._validate_dialogue(extension_response, dialogue_mode, current_batch_turns)
+                    validate_result = self._validate_dialogue(extension_text, dialogue_mode, current_batch_turns)
                     actual_batch_turns = validate_result["actual_turns"]
                     
                     # 更新已生成的轮数和剩余轮数
                     generated_turns += actual_batch_turns
                     remaining_turns = num_turns - generated_turns
                     
+                    # 更新滚动状态，并把新的情节节点并入结构化数据
+                    state.update(extension_text, actual_batch_turns, beats=batch_beats, dramatic_hits=batch_dramatic)
+                    for beat in batch_beats:
+                        if beat not in complete_dialogue["key_points"]:
+                            complete_dialogue["key_points"].append(beat)
+                    
                     # 如果生成的轮数有显著偏差，退出循环避免无限生成
                     if actual_batch_turns < current_batch_turns / 2:
                         break
@@ -428,23 +574,120 @@ class InitialDialogueAgent(DialogueAgent):
             # 出错时退回到常规方法
             return self.generate_dialogue(context, dialogue_mode, goal, language, difficulty, num_turns, custom_vocabulary, custom_sentence, dramatic_elements)
 
-    def _build_generation_prompt(self, context, dialogue_mode, goal, language, difficulty, num_turns, custom_vocabulary="", custom_sentence="", dramatic_elements=""):
-        """构建用于生成对话的提示"""
-        # 确定谁先说话的说明
-        first_speaker_instruction = ""
-        if dialogue_mode == "AI先说":
-            first_speaker_instruction = "请确保对话是由AI/助手先开始说话，而不是用户先说话。"
-        elif dialogue_mode == "用户先说":
-            first_speaker_instruction = "请确保对话是由用户先开始说话，而不是AI/助手先说话。"
+    def generate_long_dialogue(self, context, dialogue_mode, goal, language, difficulty, num_turns,
+                               custom_vocabulary="", custom_sentence="", dramatic_elements="",
+                               chapter_turns=10, batch_size=5):
+        """
+        长篇模式：按章节逐步生成对话（生成器）
+        每生成完一章就产出一次，调用方可以立即保存并丢弃该章文本，
+        代理内部只保留滚动上下文状态，内存和提示大小与总轮数无关
+        
+        Yields:
+            dict: 章节数据，包含 chapter、start_turn、end_turn、text、plot_beats 和 vocabulary_used
+        """
+        state = DialogueProgressState(
+            context, goal,
+            target_vocabulary=DialogueProgressState.split_items(custom_vocabulary),
+            dramatic_targets=DialogueProgressState.split_items(dramatic_elements),
+            language=language, difficulty=difficulty
+        )
+        chapter_index = 0
+        failures = 0
+        
+        while state.turns_generated < num_turns and failures < self.max_retries:
+            chapter_index += 1
+            chapter_start = state.turns_generated + 1
+            chapter_target = min(chapter_turns, num_turns - state.turns_generated)
+            chapter_lines = []
+            chapter_beats = []
+            chapter_generated = 0
             
-        # 构建轮数示例
-        turns_example = ""
-        for i in range(1, num_turns + 1):
-            if dialogue_mode == "AI先说":
-                turns_example += f"轮次 {i}:\nB: [AI的对话]\nA: [用户的对话]\n\n"
-            else:
-                turns_example += f"轮次 {i}:\nA: [用户的对话]\nB: [AI的对话]\n\n"
+            while chapter_generated < chapter_target and failures < self.max_retries:
+                current_batch_turns = min(batch_size, chapter_target - chapter_generated)
+                
+                if state.turns_generated == 0:
+                    # 第一批次使用完整的生成提示，获取结构化的关键词汇和戏剧性元素
+                    prompt = self._build_generation_prompt(context, dialogue_mode, goal, language, difficulty, current_batch_turns, custom_vocabulary, custom_sentence, dramatic_elements)
+                    response = self.call_llm_api(prompt)
+                    batch_text, batch_beats, batch_dramatic = "", [], []
+                    first_batch = None
+                    if not self.last_call_failed and response and '{' in response and '}' in response:
+                        try:
+                            first_batch = json.loads(response[response.find('{'):response.rfind('}') + 1])
+                        except json.JSONDecodeError:
+                            logging.warning("长篇模式首批次响应不是有效的 JSON，按纯文本处理")
+                    if self.last_call_failed:
+                        logging.warning(f"长篇模式首批次调用失败: {response}")
+                    elif isinstance(first_batch, dict):
+                        batch_text = str(first_batch.get("original_text") or "")
+                        batch_beats = _as_list(first_batch.get("key_points"))
+                        batch_dramatic = _as_list(first_batch.get("dramatic_elements"))
+                        state.target_vocabulary = DialogueProgressState._dedupe(
+                            state.target_vocabulary + _as_list(first_batch.get("key_vocabulary"))
+                        )
+                        if not state.dramatic_targets:
+                            state.dramatic_targets = DialogueProgressState._dedupe(batch_dramatic)
+                    else:
+                        # 不是 JSON 对象时与续写批次一样按纯文本对话处理
+                        batch_text, batch_beats, batch_dramatic = DialogueProgressState.parse_continuation_response(response)
+                else:
+                    prompt = self._build_continuation_prompt(state, dialogue_mode, current_batch_turns)
+                    response = self.call_llm_api(prompt)
+                    if self.last_call_failed:
+                        logging.warning(f"长篇模式续写调用失败: {response}")
+                        batch_text, batch_beats, batch_dramatic = "", [], []
+                    else:
+                        batch_text, batch_beats, batch_dramatic = DialogueProgressState.parse_continuation_response(response)
+                
+                batch_turns = self._validate_dialogue(batch_text, dialogue_mode, current_batch_turns)["actual_turns"] if batch_text else 0
+                if batch_turns == 0:
+                    # 本批次没有产生有效轮次，累计失败次数后重试
+                    failures += 1
+                    logging.warning(f"长篇模式第{chapter_index}章批次生成失败 (尝试 {failures}/{self.max_retries})")
+                    continue
+                
+                failures = 0
+                state.update(batch_text, batch_turns, beats=batch_beats, dramatic_hits=batch_dramatic)
+                chapter_lines.append(batch_text.strip())
+                chapter_beats.extend(batch_beats)
+                chapter_generated += batch_turns
+            
+            if chapter_lines:
+                yield {
+                    "chapter": chapter_index,
+                    "start_turn": chapter_start,
+                    "end_turn": state.turns_generated,
+                    "text": "\n".join(chapter_lines),
+                    "plot_beats": chapter_beats,
+                    "vocabulary_used": list(state.vocabulary_used)
+                }
+        
+        if state.turns_generated < num_turns:
+            logging.warning(f"长篇模式提前结束：要求{num_turns}轮，实际{state.turns_generated}轮。")
+
+    def _build_continuation_prompt(self, state, dialogue_mode, batch_turns):
+        """根据滚动上下文状态构建续写提示"""
+        next_speaker = "B（AI/助手）" if dialogue_mode == "AI先说" else "A（用户）"
         
+        return f"""请继续下面的对话，生成额外的 {batch_turns} 轮对话。
+
+{state.to_prompt_section()}
+
+要求:
+1. 紧接最近的对话内容继续，保持人物、语气和情节连贯，逐步推进对话目标
+2. 在对话中，请使用A代表用户，B代表AI/助手；一轮对话指用户和AI各说一次话，每轮由{next_speaker}先说
+3. 优先自然融入尚未使用的词汇和尚未体现的戏剧性元素
+4. 不要重复前面的对话
+
+请以 JSON 格式返回:
+{{
+    "new_dialogue": "新生成的对话文本",
+    "plot_beats": ["本批次的情节进展（简短）"],
+    "dramatic_elements_hit": ["本批次体现的戏剧性元素"]
+}}"""
+
+    def _build_generation_prompt(self, context, dialogue_mode, goal, language, difficulty, num_turns, custom_vocabulary="", custom_sentence="", dramatic_elements=""):
+        """构建用于生成对话的提示"""
         # 添加自定义单词和句型的说明
         custom_content = ""
         if custom_vocabulary:
@@ -452,85 +695,27 @@ class InitialDialogueAgent(DialogueAgent):
         if custom_sentence:
             custom_content += f"\n请在对话中自然地使用以下句型: {custom_sentence}"
         
-        # 戏剧性元素指令
-        dramatic_elements_instructions = """
----戏剧性对话要求---
-为了使对话更加引人入胜，请加入以下戏剧性元素：
-1. 设计一个令人惊讶的转折点或误解（近似剧情"反转"）
-2. 在对话中植入一个有趣的"秘密"或背景故事
-3. 加入一个情感转变点，如恍然大悟的瞬间或认知变化
-4. 确保对话有起伏节奏，不要平铺直叙
-5. 暗示角色之间可能存在的复杂关系或背景联系
-"""
-        
-        # 如果有自定义戏剧性元素，替换默认指令
+        # 戏剧性元素指令，有自定义戏剧性元素时替换默认指令
+        dramatic_elements_instructions = DEFAULT_DRAMATIC_INSTRUCTIONS
         if dramatic_elements and dramatic_elements.strip():
-            dramatic_elements_instructions = """
----戏剧性对话要求---
-为了使对话更加引人入胜，请特别融入以下戏剧性元素：
-"""
             # 将传入的戏剧性元素添加为列表项
-            elements_list = []
-            for i, element in enumerate(dramatic_elements.split(','), 1):
-                if element.strip():
-                    elements_list.append(f"{i}. {element.strip()}")
-            
-            if elements_list:
-                dramatic_elements_instructions += "\n" + "\n".join(elements_list) + "\n"
-                dramatic_elements_instructions += """
-请确保这些特定的戏剧性元素自然地融入对话，创造令人惊喜的转折和情感共鸣。避免过度戏剧化，保持对话的真实感和自然流动。
-"""
-        
-        prompt = f"""
-        作为一个专业的对话生成 AI，请根据以下要求创建一段引人入胜、富有戏剧性的对话：
-
-        对话背景: {context}
-        对话模式: {dialogue_mode}
-        对话目标: {goal}
-        语言要求: {language}
-        内容难度: {difficulty}
-        对话轮数: {num_turns}轮
-        {custom_content}
-
-        {first_speaker_instruction}
-        
-        在对话中，请使用A代表用户，B代表AI/助手。
-        如果对话模式是"AI先说"，请确保B（AI/助手）是第一个说话的人。
-        如果对话模式是"用户先说"，请确保A（用户）是第一个说话的人。
-        
-{dramatic_elements_instructions}
-        
-        请确保这些戏剧性元素自然融入对话，服务于整体目标，而非生硬添加。
-        
-        请严格生成 {num_turns} 轮对话，其中一轮定义为用户和AI各说一次。
-        对话结构应该遵循以下格式:
-        
-{turns_example}
-        请注意:
-        1. 生成的对话必须严格包含 {num_turns} 轮
-        2. 每轮必须包含用户(A)和AI(B)各说一次
-        3. 请确保按照{dialogue_mode}的设置确定第一个说话的角色
-        4. 确保在达成{goal}的同时，加入戏剧性和吸引力元素
-
-        请生成一段自然流畅、引人入胜的对话，包含以下内容并以 JSON 格式返回:
-        1. 对话原始文本
-        2. 情节关键节点
-        3. 关键情节词汇（重要词汇，如专业术语或特定单词）
-        4. 关键情节句型（重要句型，如特定的语法结构或表达方式）
-        5. 对话中隐含的意图与目标
-        6. 戏剧性转折点描述（简要描述对话中的戏剧性转折点）
-
-        返回格式示例:
-        {{
-            "original_text": "对话原始文本",
-            "key_points": ["关键点1", "关键点2"],
-            "key_vocabulary": ["关键词1", "关键词2"],
-            "key_sentences": ["关键句型1", "关键句型2"],
-            "intentions": ["意图1", "意图2"],
-            "dramatic_elements": ["戏剧性转折点1", "情感变化点2"]
-        }}
-        """
-        return prompt
+            elements = [element.strip() for element in dramatic_elements.split(',') if element.strip()]
+            dramatic_elements_instructions = CUSTOM_DRAMATIC_HEADER
+            if elements:
+                elements_list = "\n".join(f"{i}. {element}" for i, element in enumerate(elements, 1))
+                dramatic_elements_instructions += f"\n{elements_list}\n{CUSTOM_DRAMATIC_FOOTER}"
+        
+        return get_generation_template(dialogue_mode).render(
+            context=context,
+            dialogue_mode=dialogue_mode,
+            goal=goal,
+            language=language,
+            difficulty=difficulty,
+            num_turns=num_turns,
+            custom_content=custom_content.strip(),
+            dramatic_elements_instructions=dramatic_elements_instructions,
+            turns_example=build_turns_example(dialogue_mode, num_turns)
+        )
 
 
 class StyleAdaptationAgent(DialogueAgent):
@@ -617,6 +802,8 @@ class StyleAdaptationAgent(DialogueAgent):
                 ai_traits_chara, ai_traits_mantra, ai_traits_tone, ai_emo, ai_emo_mode
             )
             response = self.call_llm_api(prompt)
+            if self.last_call_failed:
+                return response or EMPTY_RESPONSE_ERROR
             
             # 验证响应长度
             if len(response) < 10:  # 简单有效性检查
@@ -625,41 +812,16 @@ class StyleAdaptationAgent(DialogueAgent):
             return response
             
         except Exception as e:
-            logging.error(f"对话风格改编失败: {str(e)}")
-            return dialogue_data.get("original_text", "")
+            # 不把原文当作改编结果返回，调用方根据 last_call_failed 判断失败
+            error_msg = f"对话风格改编失败: {str(e)}"
+            logging.error(error_msg)
+            self.last_call_failed = True
+            return error_msg
 
-    def _build_adaptation_prompt(self, dialogue_data, user_traits="", ai_traits="", language=None,
-                               user_traits_chara="", user_traits_address="", user_traits_custom="",
-                               ai_traits_chara="", ai_traits_mantra="", ai_traits_tone="", 
-                               ai_emo="", ai_emo_mode="自动模式"):
-        """构建用于风格改编的提示"""
-        # 提取对话数据的关键元素
-        original_text = dialogue_data.get("original_text", "")
-        key_points = dialogue_data.get("key_points", [])
-        intentions = dialogue_data.get("intentions", [])
-        key_vocabulary = dialogue_data.get("key_vocabulary", [])
-        key_sentences = dialogue_data.get("key_sentences", [])
-        dramatic_elements = dialogue_data.get("dramatic_elements", [])
-        
-        # 将列表转换为文本表示
-        key_points_text = "\n".join([f"- {point}" for point in key_points])
-        intentions_text = "\n".join([f"- {intent}" for intent in intentions])
-        key_vocabulary_text = "\n".join([f"- {word}" for word in key_vocabulary])
-        key_sentences_text = "\n".join([f"- {sentence}" for sentence in key_sentences])
-        dramatic_elements_text = "\n".join([f"- {element}" for element in dramatic_elements])
-        
-        # 检测输出语言
-        if not language:
-            # 检测原始对话是否包含中文
-            has_chinese = bool(re.search(r'[\u4e00-\u9fff]', original_text))
-            if has_chinese:
-                language = "中文"
-            else:
-                # 默认使用英文
-                language = "英文"
-        
-        # 构建特质描述
-        # 优先使用V2的详细特质，如果没有则使用V1的综合特质
+    def _describe_traits(self, user_traits="", ai_traits="", user_traits_chara="", user_traits_address="",
+                         user_traits_custom="", ai_traits_chara="", ai_traits_mantra="", ai_traits_tone="",
+                         ai_emo="", ai_emo_mode="自动模式"):
+        """构建用户和AI的特质描述，优先使用V2的详细特质，如果没有则使用V1的综合特质"""
         user_traits_description = ""
         ai_traits_description = ""
         
@@ -687,116 +849,128 @@ class StyleAdaptationAgent(DialogueAgent):
         elif ai_traits:
             ai_traits_description = f"AI角色特质: {ai_traits}\n"
         
-        # 根据语言构造提示
-        if language == "英文":
-            # 根据表情模式构建特定指令
-            emotion_instructions = ""
-            if ai_emo_mode == "自动模式":
-                emotion_instructions = """
-                5. IMPORTANT: For each line spoken by the AI character, automatically generate and include appropriate emotional expressions and physical actions based on the AI's personality and the content of the message
-                """
-            elif ai_emo_mode == "自定义模式" and ai_emo:
-                emotion_instructions = f"""
-                5. IMPORTANT: For each line spoken by the AI character, include emotional expressions and physical actions from this list: {ai_emo}
-                """
-            else:
-                emotion_instructions = """
-                5. Include appropriate emotional expressions and physical actions for the AI character when needed
-                """
-                
-            prompt = f"""
-            As a professional dialogue stylist AI, your task is to rewrite the original dialogue based on the given character traits while maintaining the same plot points, intentions, and dramatic elements of the original dialogue. Please keep the output in English.
+        return user_traits_description.strip(), ai_traits_description.strip()
 
-            ## Original Dialogue Information
-            Original dialogue text:
-            {original_text}
-
-            Key points:
-            {key_points_text}
-
-            Dialogue intentions:
-            {intentions_text}
-
-            Key vocabulary (must be preserved):
-            {key_vocabulary_text}
-
-            Key sentence structures (must be preserved):
-            {key_sentences_text}
+    def restyle_lines(self, targets, language=None, user_traits="", ai_traits="",
+                      user_traits_chara="", user_traits_address="", user_traits_custom="",
+                      ai_traits_chara="", ai_traits_mantra="", ai_traits_tone="",
+                      ai_emo="", ai_emo_mode="自动模式"):
+        """
+        只改编编辑过的几行对话（增量改编），每行附带前后已改编的几句作为上下文
 
-            Dramatic elements (must be enhanced):
-            {dramatic_elements_text}
+        Args:
+            targets (list): utils.dialogue_diff.changed_targets 的结果
+            其余参数同 adapt_dialogue
 
-            ## Character Traits
-            # User Character Details
-            {user_traits_description}
-            
-            # AI Character Details
-            {ai_traits_description}
+        Returns:
+            dict: id -> 改编后的整行（保持原说话者）；响应无法解析时为空
+        """
+        user_traits_description, ai_traits_description = self._describe_traits(
+            user_traits, ai_traits, user_traits_chara, user_traits_address, user_traits_custom,
+            ai_traits_chara, ai_traits_mantra, ai_traits_tone, ai_emo, ai_emo_mode
+        )
+        sections = []
+        for target in targets:
+            section = [f"[{target['id']}] 原句: {target['original']}"]
+            if target["before"]:
+                section.append("前文: " + " / ".join(target["before"]))
+            if target["after"]:
+                section.append("后文: " + " / ".join(target["after"]))
+            sections.append("\n".join(section))
+        sections_text = "\n\n".join(sections)
 
-            Please follow these requirements:
-            1. Maintain all key points, intentions, and dramatic elements from the original dialogue
-            2. Include ALL key vocabulary and sentence structures from the original dialogue
-            3. Adjust the dialogue style, tone, and descriptions according to the character traits
-            4. Keep the format of the dialogue with clear speaker distinctions
-            {emotion_instructions}
-            6. IMPORTANT: Emphasize and enhance the dramatic elements - make the plot twists, secrets, and emotional turns even more engaging and compelling while staying true to the original storyline
-            7. Keep the output in the SAME LANGUAGE as the original dialogue (English)
-            8. Only return the rewritten dialogue text without additional explanations
-            """
-        else:
-            # 根据表情模式构建特定指令
-            emotion_instructions = ""
-            if ai_emo_mode == "自动模式":
-                emotion_instructions = """
-                5. 重要提示：对于AI的每一句话，根据AI的性格特点和话语内容，自动生成并添加合适的情感表达和肢体动作描述
-                """
-            elif ai_emo_mode == "自定义模式" and ai_emo:
-                emotion_instructions = f"""
-                5. 重要提示：对于AI的每一句话，从以下列表中选择并添加情感表达和肢体动作描述：{ai_emo}
-                """
-            else:
-                emotion_instructions = """
-                5. 在需要时为AI角色添加适当的情感表达和肢体动作描述
-                """
-                
-            prompt = f"""
-            作为一个专业的对话风格改编 AI，你的任务是将原始对话根据给定的角色特质进行改编，同时保持原始对话的情节、意图和戏剧性元素不变。
+        prompt = f"""下面是一段已经按角色特质改编过的对话中被作者修改过的几句原句（A 代表用户，B 代表AI）。
+请按相同的角色特质改编这几句，前文和后文是已改编好的相邻对话，只用于保持风格和衔接，不要改写它们。
 
-            ## 原始对话信息
-            对话原文：
-            {original_text}
+用户角色特质:
+{user_traits_description or "无"}
 
-            关键节点：
-            {key_points_text}
+AI角色特质:
+{ai_traits_description or "无"}
 
-            对话意图：
-            {intentions_text}
+输出语言: {language or "与原句相同"}
 
-            关键词汇（必须保留）：
-            {key_vocabulary_text}
+{sections_text}
 
-            关键句型（必须保留）：
-            {key_sentences_text}
+要求:
+1. 每句保持原说话者和原意，改编后仍是一行
+2. 风格、语气和动作/表情描述的写法与前后文保持一致
+3. 原句中的词汇和句型尽量保留
 
-            戏剧性元素（必须强化）：
-            {dramatic_elements_text}
+请以 JSON 格式返回:
+{{
+    "lines": [{{"id": 编号, "text": "改编后的整行（包含说话者前缀）"}}]
+}}"""
+        response = self.call_llm_api(prompt)
+        if not response or '{' not in response or '}' not in response:
+            return {}
+        try:
+            data = json.loads(response[response.find('{'):response.rfind('}') + 1], strict=False)
+        except json.JSONDecodeError:
+            logging.warning("增量改编响应不是有效的 JSON")
+            return {}
 
-            ## 角色特质
-            # 用户角色详情
-            {user_traits_description}
-            
-            # AI角色详情
-            {ai_traits_description}
+        speakers = {target["id"]: target["speaker"] for target in targets}
+        restyled = {}
+        for entry in data.get("lines", []) if isinstance(data, dict) else []:
+            try:
+                target_id = int(entry["id"])
+                body = strip_speaker(" ".join(str(entry["text"]).split()))
+            except (KeyError, TypeError, ValueError):
+                continue
+            if target_id in speakers and body:
+                restyled[target_id] = f"{speakers[target_id]}: {body}"
+        return restyled
 
-            请按照以下要求进行改编：
-            1. 保持原始对话的全部关键节点、意图和戏剧性元素
-            2. 包含原始对话中的所有关键词汇和句型
-            3. 根据用户和 AI 的角色特质调整对话风格、语调和描述方式
-            4. 请保持对话的格式，包括清晰的说话人区分
-            {emotion_instructions}
-            6. 重要提示：强化并突出戏剧性元素 - 让情节转折、秘密和情感变化更加引人入胜，同时保持原有故事线的真实性
-            7. 重要提示：请保持输出语言与原始对话相同（中文）
-            8. 请只返回改编后的对话文本，不需要额外的解释
-            """
-            
-        return prompt
+    def _build_adaptation_prompt(self, dialogue_data, user_traits="", ai_traits="", language=None,
+                               user_traits_chara="", user_traits_address="", user_traits_custom="",
+                               ai_traits_chara="", ai_traits_mantra="", ai_traits_tone="", 
+                               ai_emo="", ai_emo_mode="自动模式"):
+        """构建用于风格改编的提示"""
+        # 提取对话数据的关键元素
+        original_text = dialogue_data.get("original_text", "")
+        key_points = dialogue_data.get("key_points", [])
+        intentions = dialogue_data.get("intentions", [])
+        key_vocabulary = dialogue_data.get("key_vocabulary", [])
+        key_sentences = dialogue_data.get("key_sentences", [])
+        dramatic_elements = dialogue_data.get("dramatic_elements", [])
+        
+        # 检测输出语言
+        if not language:
+            # 检测原始对话是否包含中文
+            has_chinese = bool(re.search(r'[\u4e00-\u9fff]', original_text))
+            if has_chinese:
+                language = "中文"
+            else:
+                # 默认使用英文
+                language = "英文"
+        
+        user_traits_description, ai_traits_description = self._describe_traits(
+            user_traits, ai_traits, user_traits_chara, user_traits_address, user_traits_custom,
+            ai_traits_chara, ai_traits_mantra, ai_traits_tone, ai_emo, ai_emo_mode
+        )
+        
+        # 根据语言和表情模式选择预编译模板
+        if ai_emo_mode == "自动模式" or (ai_emo_mode == "自定义模式" and ai_emo):
+            template_emo_mode = ai_emo_mode
+        else:
+            template_emo_mode = None
+        
+        fields = {
+            "original_text": original_text,
+            "key_points_text": bullet_list(key_points),
+            "intentions_text": bullet_list(intentions),
+            "key_vocabulary_text": bullet_list(key_vocabulary),
+            "key_sentences_text": bullet_list(key_sentences),
+            "dramatic_elements_text": bullet_list(dramatic_elements),
+            "user_traits_description": user_traits_description,
+            "ai_traits_description": ai_traits_description,
+            "ai_emo": ai_emo
+        }
+        
+        # 超出模型上下文窗口时，依次缩减意图、关键节点和戏剧性元素；原文和必须保留的词汇句型不缩减
+        return self.fit_prompt_sections(
+            get_adaptation_template(language, template_emo_mode).render,
+            fields,
+            ["intentions_text", "key_points_text", "dramatic_elements_text"]
+        )
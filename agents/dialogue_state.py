@@ -0,0 +1,174 @@
+# -*- coding: utf-8 -*- # Ensure UTF-8 encoding for wider character support
+
+import json
+import re
+import logging
+
+
+class DialogueProgressState:
+    """
+    渐进式生成的滚动上下文状态
+    每个批次生成后更新情节节点、已使用词汇和已完成的戏剧性元素，
+    续写提示只携带这份固定大小的摘要和最近几行对话，而不是整段已生成文本
+    """
+    def __init__(self, context, goal, target_vocabulary=None, dramatic_targets=None,
+                 max_beats=6, window_lines=4, max_item_chars=80, language=None, difficulty=None):
+        self.context = context
+        self.goal = goal
+        self.language = language
+        self.difficulty = difficulty
+        self.max_beats = max_beats  # 最多保留的情节节点数
+        self.window_lines = window_lines  # 续写时附带的最近对话行数
+        self.max_item_chars = max_item_chars  # 单个条目的最大字符数
+        self.turns_generated = 0
+        self.plot_beats = []  # 最近的情节节点
+        self.earlier_summary = ""  # 超出上限后被合并的早期情节
+        self.target_vocabulary = self._dedupe(target_vocabulary or [])
+        self.vocabulary_used = []
+        self.dramatic_targets = self._dedupe(dramatic_targets or [])
+        self.dramatic_hit = []
+        self.recent_lines = []
+
+    @staticmethod
+    def _dedupe(items):
+        """去除空白项和重复项，保持原有顺序"""
+        seen = set()
+        result = []
+        for item in items:
+            item = str(item).strip()
+            if item and item.lower() not in seen:
+                seen.add(item.lower())
+                result.append(item)
+        return result
+
+    @staticmethod
+    def split_items(text):
+        """将逗号分隔的输入（支持中英文逗号）拆分为列表"""
+        if not text:
+            return []
+        return [item.strip() for item in re.split(r'[,，]', text) if item.strip()]
+
+    def _clip(self, text):
+        """截断过长的条目，保证摘要大小有上限"""
+        text = " ".join(str(text).split())
+        if len(text) > self.max_item_chars:
+            return text[:self.max_item_chars - 1] + "…"
+        return text
+
+    def add_beats(self, beats):
+        """添加情节节点，超过上限时把最旧的节点合并进早期情节摘要"""
+        for beat in beats:
+            beat = self._clip(beat)
+            if beat and beat not in self.plot_beats:
+                self.plot_beats.append(beat)
+        while len(self.plot_beats) > self.max_beats:
+            oldest = self.plot_beats.pop(0)
+            merged = f"{self.earlier_summary}；{oldest}" if self.earlier_summary else oldest
+            # 早期摘要只保留尾部，长度与节点上限成正比
+            limit = self.max_item_chars * 2
+            self.earlier_summary = merged if len(merged) <= limit else "…" + merged[-(limit - 1):]
+
+    def mark_dramatic_hit(self, elements):
+        """记录已经在对话中出现的戏剧性元素"""
+        for element in elements:
+            element = self._clip(element)
+            if element and element not in self.dramatic_hit:
+                self.dramatic_hit.append(element)
+
+    def update(self, batch_text, batch_turns, beats=None, dramatic_hits=None):
+        """
+        用新生成的批次更新状态
+
+        Args:
+            batch_text (str): 本批次对话文本
+            batch_turns (int): 本批次实际轮数
+            beats (list, optional): 本批次的情节节点摘要
+            dramatic_hits (list, optional): 本批次中出现的戏剧性元素
+        """
+        self.turns_generated += batch_turns
+        if beats:
+            self.add_beats(beats)
+        if dramatic_hits:
+            self.mark_dramatic_hit(dramatic_hits)
+
+        # 本地检测目标词汇的使用情况，无需额外的 API 调用
+        lowered = batch_text.lower()
+        for word in self.target_vocabulary:
+            if word not in self.vocabulary_used and word.lower() in lowered:
+                self.vocabulary_used.append(word)
+
+        lines = [line.strip() for line in batch_text.split('\n') if line.strip()]
+        self.recent_lines = (self.recent_lines + lines)[-self.window_lines:]
+
+    def pending_vocabulary(self):
+        """尚未在对话中出现的目标词汇"""
+        return [word for word in self.target_vocabulary if word not in self.vocabulary_used]
+
+    def pending_dramatic_elements(self):
+        """尚未完成的戏剧性元素"""
+        hit_text = " ".join(self.dramatic_hit).lower()
+        return [element for element in self.dramatic_targets
+                if element.split(' - ')[0].strip().lower() not in hit_text]
+
+    def to_prompt_section(self, max_list_items=12):
+        """将状态渲染为续写提示中的上下文部分，大小与已生成轮数无关"""
+        def render_list(items):
+            items = items[:max_list_items]
+            return "\n".join(f"- {self._clip(item)}" for item in items) if items else "- 无"
+
+        beats = ([f"（早期）{self.earlier_summary}"] if self.earlier_summary else []) + self.plot_beats
+        pending_vocab = self.pending_vocabulary()
+        pending_dramatic = self.pending_dramatic_elements()
+
+        header = [f"对话背景: {self.context}", f"对话目标: {self.goal}"]
+        if self.language:
+            header.append(f"语言要求: {self.language}")
+        if self.difficulty:
+            header.append(f"内容难度: {self.difficulty}")
+
+        return "\n".join(header + [
+            f"已生成轮数: {self.turns_generated}",
+            "",
+            "已发生的情节:",
+            render_list(beats),
+            "",
+            "已使用的关键词汇:",
+            render_list(self.vocabulary_used),
+            "",
+            "尚未使用、需要自然融入的词汇:",
+            render_list(pending_vocab),
+            "",
+            "已完成的戏剧性元素:",
+            render_list(self.dramatic_hit),
+            "",
+            "尚未体现的戏剧性元素:",
+            render_list(pending_dramatic),
+            "",
+            "最近的对话内容:",
+            "\n".join(self.recent_lines),
+        ])
+
+    @staticmethod
+    def parse_continuation_response(response):
+        """
+        解析续写响应
+
+        Returns:
+            tuple: (对话文本, 情节节点列表, 戏剧性元素列表)；响应不是 JSON 时按纯文本处理
+        """
+        if not response:
+            return "", [], []
+        if '{' in response and '}' in response:
+            try:
+                data = json.loads(response[response.find('{'):response.rfind('}') + 1], strict=False)
+                if isinstance(data, dict) and data.get("new_dialogue"):
+                    beats = data.get("plot_beats", [])
+                    hits = data.get("dramatic_elements_hit", [])
+                    return (
+                        str(data["new_dialogue"]),
+                        beats if isinstance(beats, list) else [str(beats)],
+                        hits if isinstance(hits, list) else [str(hits)],
+                    )
+            except json.JSONDecodeError:
+                logging.warning("续写响应不是有效的 JSON，按纯文本处理")
+        return response, [], []
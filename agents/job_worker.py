@@ -0,0 +1,266 @@
+# -*- coding: utf-8 -*- # Ensure UTF-8 encoding for wider character support
+
+"""
+后台任务的工作线程池
+界面只负责提交任务和轮询状态，LLM 调用和保存在工作线程中完成，页面重新运行不会中断或重复执行生成；
+同一进程内的所有会话共用一个有上限的线程池
+"""
+
+import os
+import time
+import logging
+import threading
+
+from .pipeline import (
+    create_api_client, create_agent, generate_initial_dialogue, adapt_dialogue, adapt_dialogue_incremental, build_traits,
+    generation_metadata, initial_cache_key, adaptation_cache_key, check_initial_dialogue, check_final_dialogue,
+    get_cached_result
+)
+from utils.job_queue import FINISHED_STATUSES
+
+
+# 任务类型
+JOB_INITIAL_DIALOGUE = "initial_dialogue"
+JOB_STYLE_ADAPTATION = "style_adaptation"
+
+
+def _save_final(file_manager, final_text, dialogue_data, traits, model):
+    """保存改编后的最终对话，返回 (json_path, md_path)"""
+    user_traits, ai_traits, user_traits_data, ai_traits_data = build_traits(traits)
+    final_paths = file_manager.save_final_dialogue(
+        final_text, dialogue_data, user_traits, ai_traits, user_traits_data, ai_traits_data,
+        extra_metadata={"model": model}
+    )
+    if not final_paths[0]:
+        raise RuntimeError("保存最终对话失败")
+    return list(final_paths)
+
+
+def _cached(response_cache, payload, key, check):
+    """payload 允许使用缓存时读取预生成的结果，无效的缓存条目删除后按未命中处理"""
+    if response_cache is None or not payload.get("use_cache"):
+        return None
+    return get_cached_result(response_cache, key, check)
+
+
+def run_initial_dialogue_job(payload, client, file_manager, response_cache=None):
+    """
+    执行初始对话任务：生成并保存初始对话；payload 带有 adaptation 时（自动模式）接着改编并保存最终对话
+
+    Args:
+        payload (dict): params、api_provider、model、context_length，可选 use_cache 和 adaptation
+            （traits、language、model、context_length）
+        client: API 客户端
+        file_manager (FileManager): 文件管理器
+        response_cache (ResponseCache, optional): 预生成结果的缓存，payload 的 use_cache 为真时优先使用
+
+    Returns:
+        dict: dialogue_data、saved_path、cached；自动模式下还有 final_dialogue、final_saved_path 和 final_cached，
+            改编失败时为 adaptation_error
+    """
+    params = payload["params"]
+    dialogue_data = _cached(response_cache, payload, initial_cache_key(params, payload["model"]),
+                           check_initial_dialogue)
+    cached = dialogue_data is not None
+    if not cached:
+        agent = create_agent(JOB_INITIAL_DIALOGUE, client, payload["api_provider"], payload["model"],
+                             payload.get("context_length"))
+        dialogue_data = generate_initial_dialogue(agent, params)
+    saved_path = file_manager.save_initial_dialogue(
+        dialogue_data, params["context"], params["goal"],
+        extra_metadata=generation_metadata(params, payload["model"])
+    )
+    if not saved_path[0]:
+        raise RuntimeError("保存初始对话失败")
+    result = {"dialogue_data": dialogue_data, "saved_path": list(saved_path), "cached": cached}
+
+    adaptation = payload.get("adaptation")
+    if adaptation:
+        # 初始对话已保存，改编失败时仍返回初始对话
+        try:
+            result.update(run_style_adaptation_job(
+                dict(adaptation, dialogue_data=dialogue_data, api_provider=payload["api_provider"],
+                     use_cache=payload.get("use_cache")),
+                client, file_manager, response_cache
+            ))
+        except Exception as e:
+            logging.warning(f"自动模式改编失败: {str(e)}")
+            result["adaptation_error"] = str(e)
+    return result
+
+
+def run_style_adaptation_job(payload, client, file_manager, response_cache=None):
+    """
+    执行风格改编任务：改编并保存最终对话
+
+    Args:
+        payload (dict): dialogue_data、traits、language、api_provider、model、context_length，可选 use_cache
+            和 previous（上次改编的 original_text 和 final_text，有时只改编修改过的行）
+        client: API 客户端
+        file_manager (FileManager): 文件管理器
+        response_cache (ResponseCache, optional): 预生成结果的缓存
+
+    Returns:
+        dict: final_dialogue、final_saved_path、final_cached 和 restyled_lines（增量改编的行数，完整改编时为 None）
+    """
+    final_text = _cached(response_cache, payload, adaptation_cache_key(
+        payload["dialogue_data"], payload["traits"], payload.get("language"), payload["model"]
+    ), check_final_dialogue)
+    cached = final_text is not None
+    restyled_lines = None
+    if not cached:
+        agent = create_agent(JOB_STYLE_ADAPTATION, client, payload["api_provider"], payload["model"],
+                             payload.get("context_length"))
+        if payload.get("previous"):
+            final_text, restyled_lines = adapt_dialogue_incremental(
+                agent, payload["dialogue_data"], payload["traits"], payload.get("language"), payload["previous"]
+            )
+        else:
+            final_text = adapt_dialogue(agent, payload["dialogue_data"], payload["traits"], payload.get("language"))
+    final_saved_path = _save_final(file_manager, final_text, payload["dialogue_data"], payload["traits"],
+                                   payload["model"])
+    return {"final_dialogue": final_text, "final_saved_path": final_saved_path, "final_cached": cached,
+            "restyled_lines": restyled_lines}
+
+
+JOB_HANDLERS = {
+    JOB_INITIAL_DIALOGUE: run_initial_dialogue_job,
+    JOB_STYLE_ADAPTATION: run_style_adaptation_job,
+}
+
+
+class WorkerPool:
+    """
+    从 JobQueue 领取任务并执行的工作线程池
+    API 密钥只保存在内存中，不写入任务数据库；进程重启后恢复的任务使用环境变量中的密钥
+    """
+    def __init__(self, queue, file_manager, workers=4, poll_interval=1.0, stale_timeout=900,
+                 max_attempts=2, retention=7 * 24 * 3600, response_cache=None):
+        """
+        Args:
+            queue (JobQueue): 任务队列
+            file_manager (FileManager): 保存结果使用的文件管理器
+            response_cache (ResponseCache, optional): 预生成结果的缓存
+            workers (int): 工作线程数
+            poll_interval (float): 没有任务时的轮询间隔（秒）
+            stale_timeout (float): 执行超过该时间仍未结束的任务视为中断，重新排队（启动时和空闲时检查）；
+                本机上已退出的进程领取的任务在启动时立即重新排队
+            max_attempts (int): 中断任务的最大尝试次数
+            retention (float): 已结束任务的保留时间（秒）
+        """
+        self.queue = queue
+        self.file_manager = file_manager
+        self.workers = workers
+        self.poll_interval = poll_interval
+        self.stale_timeout = stale_timeout
+        self.max_attempts = max_attempts
+        self.retention = retention
+        self.response_cache = response_cache
+        self._api_keys = {}  # job_id -> API 密钥
+        self._finished = threading.Condition()
+        self._wakeup = threading.Event()
+        self._stop = threading.Event()
+        self._threads = []
+        self._recover_lock = threading.Lock()
+        self._last_recover = 0.0
+
+    def start(self):
+        """恢复中断的任务并启动工作线程"""
+        recovered = self.queue.recover_orphaned(self.max_attempts)
+        recovered += self.queue.recover_stale(self.stale_timeout, self.max_attempts)
+        if recovered:
+            logging.info(f"已恢复 {recovered} 个中断的任务")
+        self._last_recover = time.monotonic()
+        self.queue.purge_finished(self.retention)
+        for index in range(self.workers):
+            thread = threading.Thread(target=self._run, name=f"job-worker-{index}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def stop(self, timeout=None):
+        """停止工作线程（等待正在执行的任务结束）"""
+        self._stop.set()
+        self._wakeup.set()
+        for thread in self._threads:
+            thread.join(timeout)
+        self._threads = []
+
+    def submit(self, kind, payload, api_key=None):
+        """
+        提交任务并唤醒空闲的工作线程
+
+        Args:
+            kind (str): 任务类型，见 JOB_HANDLERS
+            payload (dict): 任务参数
+            api_key (str, optional): OpenRouter API 密钥（不写入数据库）
+
+        Returns:
+            str: 任务 ID
+        """
+        if kind not in JOB_HANDLERS:
+            raise ValueError(f"不支持的任务类型: {kind}")
+        job_id = self.queue.submit(kind, payload)
+        if api_key:
+            self._api_keys[job_id] = api_key
+        self._wakeup.set()
+        return job_id
+
+    def wait(self, job_id, timeout):
+        """
+        等待本进程执行的任务结束（用于缓存命中等很快结束的任务）
+
+        Returns:
+            bool: 任务是否已结束
+        """
+        deadline = time.monotonic() + timeout
+        with self._finished:
+            while True:
+                job = self.queue.get(job_id)
+                if job is None or job["status"] in FINISHED_STATUSES:
+                    return True
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return False
+                self._finished.wait(remaining)
+
+    def _run(self):
+        """工作线程主循环"""
+        while not self._stop.is_set():
+            job = self.queue.claim()
+            if job is None:
+                self._recover_if_due()
+                self._wakeup.wait(self.poll_interval)
+                self._wakeup.clear()
+                continue
+            self._execute(job)
+
+    def _recover_if_due(self):
+        """空闲时定期处理超时的任务（其他进程中断的任务），每个检查周期只由一个线程执行"""
+        interval = min(self.stale_timeout / 10, 60)
+        if time.monotonic() - self._last_recover < interval or not self._recover_lock.acquire(blocking=False):
+            return
+        try:
+            self._last_recover = time.monotonic()
+            recovered = self.queue.recover_stale(self.stale_timeout, self.max_attempts)
+            if recovered:
+                logging.info(f"已恢复 {recovered} 个超时的任务")
+                self._wakeup.set()
+        except Exception as e:
+            logging.warning(f"恢复超时任务失败: {str(e)}")
+        finally:
+            self._recover_lock.release()
+
+    def _execute(self, job):
+        """执行一个任务并记录结果"""
+        api_key = self._api_keys.pop(job["id"], None) or os.getenv("OPENROUTER_API_KEY", "")
+        try:
+            client = create_api_client(job["payload"]["api_provider"], api_key)
+            if client is None:
+                raise RuntimeError("创建API客户端失败，请检查API设置")
+            result = JOB_HANDLERS[job["kind"]](job["payload"], client, self.file_manager, self.response_cache)
+            self.queue.complete(job["id"], result)
+        except Exception as e:
+            logging.error(f"任务 {job['id']} ({job['kind']}) 失败: {str(e)}", exc_info=not isinstance(e, (RuntimeError, ValueError)))
+            self.queue.fail(job["id"], str(e))
+        with self._finished:
+            self._finished.notify_all()
@@ -0,0 +1,428 @@
+# -*- coding: utf-8 -*- # Ensure UTF-8 encoding for wider character support
+
+"""
+不依赖 Streamlit 的对话生成流程（Agent 1 生成 + Agent 2 改编 + 保存）
+供批量任务、HTTP 服务和后台任务队列共用
+"""
+
+import time
+import logging
+import threading
+from .registry import agent_registry
+from .dialogue_agents import FALLBACK_KEY_POINT
+from utils.response_cache import make_cache_key
+from utils.dialogue_diff import plan_incremental_update, changed_targets, splice_adaptation
+
+
+# Agent 1 的生成参数及默认值
+GENERATION_DEFAULTS = {
+    "context": "",
+    "dialogue_mode": "AI先说",
+    "goal": "",
+    "language": "英文",
+    "difficulty": "B1",
+    "num_turns": 6,
+    "custom_vocabulary": "",
+    "custom_sentence": "",
+    "dramatic_elements": "",
+}
+
+# Agent 2 的角色特质字段
+USER_TRAIT_FIELDS = ["user_traits_chara", "user_traits_address", "user_traits_custom"]
+AI_TRAIT_FIELDS = ["ai_traits_chara", "ai_traits_mantra", "ai_traits_tone", "ai_emo", "ai_emo_mode"]
+
+# OpenAI 模型的上下文窗口大小（OpenRouter 模型使用目录中的 context_length）
+OPENAI_CONTEXT_LENGTHS = {
+    "o3-mini": 200000,
+    "gpt-4o-mini": 128000,
+    "gpt-4o": 128000,
+}
+OPENROUTER_MODELS_URL = "https://openrouter.ai/api/v1/models"
+# 获取 OpenRouter 模型目录失败后，间隔多久（秒）再重新获取
+CATALOG_RETRY_INTERVAL = 300
+
+_openrouter_context_lengths = None  # 模型ID -> 上下文窗口大小，每个进程获取一次
+_catalog_failed_at = 0.0
+_catalog_lock = threading.Lock()
+
+
+def create_api_client(api_provider, openrouter_api_key=None, pool_size=None):
+    """
+    创建 API 客户端（与 AppConfig.create_api_client 相同，但不读取 Streamlit 会话状态）
+
+    Args:
+        api_provider (str): "openai" 或 "openrouter"
+        openrouter_api_key (str, optional): OpenRouter API 密钥
+        pool_size (int, optional): 指定时为 OpenRouter 创建带连接池的 requests.Session，供多个请求共享
+            （OpenAI 客户端自带连接池）
+
+    Returns:
+        OpenAI 客户端或 OpenRouter 配置字典；创建失败时返回 None
+    """
+    if api_provider == "openai":
+        try:
+            from openai import OpenAI
+            return OpenAI()
+        except Exception as e:
+            logging.error(f"创建OpenAI客户端失败: {str(e)}")
+            return None
+    if api_provider == "openrouter":
+        client = {
+            "api_key": openrouter_api_key or "",
+            "api_base": "https://openrouter.ai/api/v1"
+        }
+        if pool_size:
+            import requests
+            session = requests.Session()
+            adapter = requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+            session.mount("https://", adapter)
+            client["session"] = session
+        return client
+    return None
+
+
+def check_initial_dialogue(dialogue_data):
+    """
+    检查初始对话是否为可以保存和缓存的生成结果
+
+    Returns:
+        dict: 原样返回 dialogue_data
+
+    Raises:
+        RuntimeError: 不是结构化数据、没有对话文本或是生成失败时的后备对话
+    """
+    if not isinstance(dialogue_data, dict):
+        raise RuntimeError(dialogue_data if isinstance(dialogue_data, str) and dialogue_data else "生成对话失败")
+    original_text = dialogue_data.get("original_text")
+    if not isinstance(original_text, str) or not original_text.strip():
+        raise RuntimeError("生成对话失败: 没有得到对话内容")
+    if FALLBACK_KEY_POINT in (dialogue_data.get("key_points") or []):
+        raise RuntimeError(f"生成对话失败: {FALLBACK_KEY_POINT}")
+    return dialogue_data
+
+
+def check_final_dialogue(final_text):
+    """
+    检查改编结果是否为可以保存和缓存的对话文本
+
+    Returns:
+        str: 原样返回 final_text
+
+    Raises:
+        RuntimeError: 不是非空字符串
+    """
+    if not isinstance(final_text, str) or not final_text.strip():
+        raise RuntimeError("生成最终对话失败: 没有得到对话内容")
+    return final_text
+
+
+def _raise_if_failed(agent, result, message):
+    """Agent 的模型调用失败时抛出 RuntimeError（Agent 以字符串形式返回错误信息）"""
+    if agent.last_call_failed:
+        raise RuntimeError(result if isinstance(result, str) and result else message)
+
+
+def get_generation_params(params):
+    """用默认值补全 Agent 1 的生成参数"""
+    merged = dict(GENERATION_DEFAULTS)
+    merged.update({key: params[key] for key in GENERATION_DEFAULTS if params.get(key) is not None})
+    merged["num_turns"] = int(merged["num_turns"])
+    return merged
+
+
+def generation_metadata(params, model):
+    """保存初始对话时记录的生成参数（用于筛选和近似重复输入的复用）"""
+    metadata = {key: params.get(key) for key in GENERATION_DEFAULTS if key not in ("context", "goal")}
+    metadata["model"] = model
+    return metadata
+
+
+def build_traits(traits):
+    """
+    根据详细特质构建 V1 综合特质和 V2 详细特质数据（与界面中保存最终对话时的格式一致）
+
+    Args:
+        traits (dict): 包含 USER_TRAIT_FIELDS 和 AI_TRAIT_FIELDS 的特质数据，可选 user_traits / ai_traits
+
+    Returns:
+        tuple: (user_traits, ai_traits, user_traits_data, ai_traits_data)
+    """
+    user_traits_data = {key: traits.get(key, "") for key in USER_TRAIT_FIELDS}
+    ai_traits_data = {key: traits.get(key, "") for key in AI_TRAIT_FIELDS}
+    ai_traits_data["ai_emo_mode"] = ai_traits_data["ai_emo_mode"] or "自动模式"
+
+    user_traits = traits.get("user_traits") or ""
+    ai_traits = traits.get("ai_traits") or ""
+    if not user_traits and any(user_traits_data.values()):
+        user_traits = (f"性格:{user_traits_data['user_traits_chara']}; 称呼:{user_traits_data['user_traits_address']}; "
+                       f"自定义:{user_traits_data['user_traits_custom']}")
+    if not ai_traits and (ai_traits_data["ai_traits_chara"] or ai_traits_data["ai_traits_mantra"] or ai_traits_data["ai_traits_tone"]):
+        ai_traits = (f"性格:{ai_traits_data['ai_traits_chara']}; 口头禅:{ai_traits_data['ai_traits_mantra']}; "
+                     f"语气:{ai_traits_data['ai_traits_tone']}")
+        if ai_traits_data["ai_emo_mode"] == "自定义模式" and ai_traits_data["ai_emo"]:
+            ai_traits += f"; 表情/动作:{ai_traits_data['ai_emo']}"
+        elif ai_traits_data["ai_emo_mode"] == "自动模式":
+            ai_traits += "; 表情/动作:自动生成"
+
+    user_traits_data["user_traits"] = user_traits
+    ai_traits_data["ai_traits"] = ai_traits
+    return user_traits, ai_traits, user_traits_data, ai_traits_data
+
+
+def initial_cache_key(params, model):
+    """初始对话的响应缓存键（补全默认值后的生成参数和模型）"""
+    return make_cache_key("initial_dialogue", {"model": model, **get_generation_params(params)})
+
+
+def adaptation_cache_key(dialogue_data, traits, language, model):
+    """
+    改编结果的响应缓存键
+    特质先经过 build_traits 统一格式，对话数据忽略保存时附加的 metadata 和 turns
+    """
+    return make_cache_key("style_adaptation", {
+        "model": model,
+        "language": language,
+        "dialogue": {key: value for key, value in dialogue_data.items() if key not in ("metadata", "turns")},
+        "traits": build_traits(traits),
+    })
+
+
+def adaptation_signature(traits, language):
+    """改编使用的角色特质和语言的摘要，相同时才能在已有改编结果上做增量更新"""
+    return make_cache_key("adaptation_traits", {"language": language, "traits": build_traits(traits)})
+
+
+def get_cached_result(cache, key, check):
+    """
+    读取响应缓存中的结果并检查；检查不通过的条目（例如旧版本写入的失败结果）会被删除，按未命中处理
+
+    Args:
+        cache (ResponseCache): 响应缓存
+        key (str): 缓存键
+        check (callable): check_initial_dialogue 或 check_final_dialogue
+
+    Returns:
+        检查通过的缓存数据，未命中或无效时返回 None
+    """
+    value = cache.get(key)
+    if value is None:
+        return None
+    try:
+        return check(value)
+    except RuntimeError as e:
+        logging.warning(f"删除无效的缓存结果 {key}: {str(e)}")
+        cache.delete(key)
+        return None
+
+
+def _fetch_openrouter_context_lengths(client):
+    """从 OpenRouter 模型目录读取各模型的上下文窗口大小"""
+    import requests
+    http = client.get("session") or requests
+    response = http.get(
+        OPENROUTER_MODELS_URL,
+        headers={"Authorization": f"Bearer {client.get('api_key')}"},
+        timeout=10
+    )
+    response.raise_for_status()
+    lengths = {}
+    for model in response.json().get("data", []):
+        try:
+            lengths[model["id"]] = int(model["context_length"])
+        except (KeyError, TypeError, ValueError):
+            continue
+    return lengths
+
+
+def get_model_context_length(api_provider, model, client=None):
+    """
+    获取模型的上下文窗口大小（与 AppConfig.get_model_context_length 相同，但不读取 Streamlit 会话状态）
+    OpenRouter 模型目录在每个进程中只获取一次，获取失败时间隔 CATALOG_RETRY_INTERVAL 秒后再试
+
+    Args:
+        api_provider (str): "openai" 或 "openrouter"
+        model (str): 模型ID
+        client (dict, optional): OpenRouter 客户端配置，用于获取模型目录
+
+    Returns:
+        int: 上下文窗口大小（token）；未知时返回 None
+    """
+    global _openrouter_context_lengths, _catalog_failed_at
+    if api_provider != "openrouter":
+        return OPENAI_CONTEXT_LENGTHS.get(model)
+    if not isinstance(client, dict):
+        return None
+    with _catalog_lock:
+        if _openrouter_context_lengths is None and time.time() - _catalog_failed_at >= CATALOG_RETRY_INTERVAL:
+            try:
+                _openrouter_context_lengths = _fetch_openrouter_context_lengths(client)
+            except Exception as e:
+                _catalog_failed_at = time.time()
+                logging.warning(f"获取OpenRouter模型目录失败，暂不检查提示大小: {str(e)}")
+        return (_openrouter_context_lengths or {}).get(model)
+
+
+def create_agent(agent_type, client, api_provider, model, context_length=None, rate_limiter=None):
+    """
+    创建 Agent 并设置上下文窗口大小和共享限流器
+    未指定 context_length 时按模型查找，所有入口都会在发送前检查提示大小
+    """
+    agent = agent_registry.create_agent(agent_type, client, model=model, api_type=api_provider)
+    if not agent:
+        raise RuntimeError(f"创建Agent失败: {agent_type}")
+    if context_length is None:
+        context_length = get_model_context_length(api_provider, model, client)
+    agent.context_length = context_length
+    agent.rate_limiter = rate_limiter
+    return agent
+
+
+def generate_initial_dialogue(agent, params):
+    """
+    使用 Agent 1 生成初始对话
+
+    Args:
+        agent (InitialDialogueAgent): Agent 1 实例
+        params (dict): 生成参数，缺省字段使用 GENERATION_DEFAULTS
+
+    Returns:
+        dict: 结构化对话数据
+
+    Raises:
+        RuntimeError: 生成失败
+    """
+    params = get_generation_params(params)
+    if not params["context"] or not params["goal"]:
+        raise ValueError("请至少填写对话背景和对话目标")
+    agent.last_call_failed = False
+    result = agent.process(**params)
+    _raise_if_failed(agent, result, "生成对话失败")
+    return check_initial_dialogue(result)
+
+
+def adapt_dialogue(agent, dialogue_data, traits, language=None):
+    """
+    使用 Agent 2 改编对话风格
+
+    Args:
+        agent (StyleAdaptationAgent): Agent 2 实例
+        dialogue_data (dict): 初始对话数据
+        traits (dict): 角色特质，字段见 USER_TRAIT_FIELDS 和 AI_TRAIT_FIELDS
+        language (str, optional): 输出语言
+
+    Returns:
+        str: 改编后的对话文本
+
+    Raises:
+        RuntimeError: 改编失败
+    """
+    user_traits, ai_traits, user_traits_data, ai_traits_data = build_traits(traits)
+    agent.last_call_failed = False
+    result = agent.process(
+        dialogue_data,
+        language=language,
+        user_traits=user_traits or None,
+        ai_traits=ai_traits or None,
+        **{key: value for key, value in user_traits_data.items() if key != "user_traits"},
+        **{key: value for key, value in ai_traits_data.items() if key != "ai_traits"}
+    )
+    _raise_if_failed(agent, result, "生成最终对话失败")
+    return check_final_dialogue(result)
+
+
+def adapt_dialogue_incremental(agent, dialogue_data, traits, language=None, previous=None, max_changed_ratio=0.5):
+    """
+    编辑初始对话后增量更新最终对话：只改编新增或修改过的行，其余行沿用 previous 中的改编结果；
+    无法逐行对应、修改过多或增量改编失败时改为完整改编
+
+    Args:
+        agent (StyleAdaptationAgent): Agent 2 实例
+        dialogue_data (dict): 编辑后的初始对话数据
+        traits (dict): 角色特质（须与上次改编相同）
+        language (str, optional): 输出语言
+        previous (dict, optional): 上次改编的 original_text（使用的初始对话文本）和 final_text（最终对话）
+        max_changed_ratio (float): 修改行数超过该比例时改为完整改编
+
+    Returns:
+        tuple: (最终对话文本, 改编的行数；完整改编时为 None)
+
+    Raises:
+        RuntimeError: 改编失败
+    """
+    plan = None
+    if previous and previous.get("final_text"):
+        plan = plan_incremental_update(previous.get("original_text"), dialogue_data.get("original_text"),
+                                       previous["final_text"], max_changed_ratio)
+    if plan is None:
+        return adapt_dialogue(agent, dialogue_data, traits, language), None
+
+    targets = changed_targets(plan)
+    restyled = {}
+    if targets:
+        agent.last_call_failed = False
+        user_traits, ai_traits, user_traits_data, ai_traits_data = build_traits(traits)
+        restyled = agent.restyle_lines(
+            targets, language=language, user_traits=user_traits, ai_traits=ai_traits,
+            **{key: value for key, value in user_traits_data.items() if key != "user_traits"},
+            **{key: value for key, value in ai_traits_data.items() if key != "ai_traits"}
+        )
+        if agent.last_call_failed or len(restyled) < len(targets):
+            logging.warning(f"增量改编只返回了 {len(restyled)}/{len(targets)} 行，改为完整改编")
+            return adapt_dialogue(agent, dialogue_data, traits, language), None
+    return check_final_dialogue(splice_adaptation(plan, restyled)), len(targets)
+
+
+def run_dialogue_pair(item, client, api_provider, models, file_manager, context_lengths=None, rate_limiter=None):
+    """
+    完整执行一条任务：生成初始对话、改编风格，并通过 FileManager 保存两份结果
+
+    Args:
+        item (dict): 生成参数和角色特质
+        client: API 客户端
+        api_provider (str): "openai" 或 "openrouter"
+        models (dict): 各 Agent 类型使用的模型，键为 "initial_dialogue" 和 "style_adaptation"
+        file_manager (FileManager): 文件管理器
+        context_lengths (dict, optional): 各模型的上下文窗口大小
+        rate_limiter (RateLimiter, optional): 共享限流器
+
+    Returns:
+        dict: initial_path、final_path、initial_dialogue 和 final_dialogue
+    """
+    context_lengths = context_lengths or {}
+    params = get_generation_params(item)
+
+    initial_model = models["initial_dialogue"]
+    agent1 = create_agent("initial_dialogue", client, api_provider, initial_model,
+                          context_lengths.get(initial_model), rate_limiter)
+    dialogue_data = generate_initial_dialogue(agent1, params)
+    initial_paths = file_manager.save_initial_dialogue(
+        dialogue_data, params["context"], params["goal"],
+        extra_metadata=generation_metadata(params, initial_model)
+    )
+    if not initial_paths[0]:
+        raise RuntimeError("保存初始对话失败")
+
+    # 保存最终对话时沿用初始对话的元数据
+    metadata = file_manager.get_initial_metadata(initial_paths[0])
+    if metadata is None:
+        raise RuntimeError(f"初始对话已保存，但无法读取其元数据: {initial_paths[0]}")
+    saved_initial = dict(dialogue_data, metadata=metadata)
+
+    adaptation_model = models["style_adaptation"]
+    agent2 = create_agent("style_adaptation", client, api_provider, adaptation_model,
+                          context_lengths.get(adaptation_model), rate_limiter)
+    final_text = adapt_dialogue(agent2, saved_initial, item, params["language"])
+    user_traits, ai_traits, user_traits_data, ai_traits_data = build_traits(item)
+    final_paths = file_manager.save_final_dialogue(
+        final_text, saved_initial, user_traits, ai_traits, user_traits_data, ai_traits_data,
+        extra_metadata={"model": adaptation_model}
+    )
+    if not final_paths[0]:
+        raise RuntimeError("保存最终对话失败")
+
+    return {
+        "initial_path": initial_paths[0],
+        "final_path": final_paths[0],
+        "initial_dialogue": dialogue_data,
+        "final_dialogue": final_text,
+    }
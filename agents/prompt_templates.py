@@ -0,0 +1,263 @@
+# -*- coding: utf-8 -*- # Ensure UTF-8 encoding for wider character support
+
+import re
+import textwrap
+from functools import lru_cache
+from string import Template
+
+from utils.token_counter import estimate_tokens
+
+
+def normalize_whitespace(text):
+    """去掉模板中的缩进和行尾空白，并把连续空行压缩为一行"""
+    text = textwrap.dedent(text)
+    lines = [line.strip() for line in text.strip().split('\n')]
+    return re.sub(r'\n{3,}', '\n\n', '\n'.join(lines))
+
+
+def bullet_list(items):
+    """将列表渲染为 Markdown 风格的条目"""
+    return "\n".join(f"- {item}" for item in items)
+
+
+class PromptTemplate:
+    """
+    预编译的提示模板
+    模板文本在编译时完成空白规整，渲染时只做一次变量替换
+    """
+    def __init__(self, name, key, text):
+        self.name = name
+        self.key = key
+        self.template = Template(normalize_whitespace(text))
+        # 模板固定部分（不含变量）的大小，用于衡量模板改动的影响
+        static_text = re.sub(r'\$\{?\w+\}?', '', self.template.template)
+        self.static_chars = len(static_text)
+        self.static_tokens = estimate_tokens(static_text)
+
+    def render(self, **fields):
+        """用给定字段渲染模板，可选字段为空时产生的多余空行一并压缩"""
+        return re.sub(r'\n{3,}', '\n\n', self.template.substitute(**fields))
+
+    def get_info(self):
+        """获取模板的统计信息"""
+        return {
+            "name": self.name,
+            "key": self.key,
+            "chars": self.static_chars,
+            "tokens": self.static_tokens
+        }
+
+
+_GENERATION_TEXT = """
+    作为一个专业的对话生成 AI，请根据以下要求创建一段引人入胜、富有戏剧性的对话：
+
+    对话背景: $context
+    对话模式: $dialogue_mode
+    对话目标: $goal
+    语言要求: $language
+    内容难度: $difficulty
+    对话轮数: ${num_turns}轮
+    $custom_content
+
+    $first_speaker_instruction
+
+    在对话中，请使用A代表用户，B代表AI/助手。
+    如果对话模式是"AI先说"，请确保B（AI/助手）是第一个说话的人。
+    如果对话模式是"用户先说"，请确保A（用户）是第一个说话的人。
+
+    $dramatic_elements_instructions
+
+    请确保这些戏剧性元素自然融入对话，服务于整体目标，而非生硬添加。
+
+    请严格生成 $num_turns 轮对话，其中一轮定义为用户和AI各说一次。
+    对话结构应该遵循以下格式:
+
+    $turns_example
+    请注意:
+    1. 生成的对话必须严格包含 $num_turns 轮
+    2. 每轮必须包含用户(A)和AI(B)各说一次
+    3. 请确保按照${dialogue_mode}的设置确定第一个说话的角色
+    4. 确保在达成${goal}的同时，加入戏剧性和吸引力元素
+
+    请生成一段自然流畅、引人入胜的对话，包含以下内容并以 JSON 格式返回:
+    1. 对话原始文本
+    2. 情节关键节点
+    3. 关键情节词汇（重要词汇，如专业术语或特定单词）
+    4. 关键情节句型（重要句型，如特定的语法结构或表达方式）
+    5. 对话中隐含的意图与目标
+    6. 戏剧性转折点描述（简要描述对话中的戏剧性转折点）
+
+    返回格式示例:
+    {
+    "original_text": "对话原始文本",
+    "key_points": ["关键点1", "关键点2"],
+    "key_vocabulary": ["关键词1", "关键词2"],
+    "key_sentences": ["关键句型1", "关键句型2"],
+    "intentions": ["意图1", "意图2"],
+    "dramatic_elements": ["戏剧性转折点1", "情感变化点2"]
+    }
+"""
+
+_FIRST_SPEAKER_INSTRUCTIONS = {
+    "AI先说": "请确保对话是由AI/助手先开始说话，而不是用户先说话。",
+    "用户先说": "请确保对话是由用户先开始说话，而不是AI/助手先说话。",
+}
+
+_TURN_TEMPLATES = {
+    "AI先说": "轮次 {}:\nB: [AI的对话]\nA: [用户的对话]\n\n",
+    "用户先说": "轮次 {}:\nA: [用户的对话]\nB: [AI的对话]\n\n",
+}
+
+DEFAULT_DRAMATIC_INSTRUCTIONS = normalize_whitespace("""
+    ---戏剧性对话要求---
+    为了使对话更加引人入胜，请加入以下戏剧性元素：
+    1. 设计一个令人惊讶的转折点或误解（近似剧情"反转"）
+    2. 在对话中植入一个有趣的"秘密"或背景故事
+    3. 加入一个情感转变点，如恍然大悟的瞬间或认知变化
+    4. 确保对话有起伏节奏，不要平铺直叙
+    5. 暗示角色之间可能存在的复杂关系或背景联系
+""")
+
+CUSTOM_DRAMATIC_HEADER = normalize_whitespace("""
+    ---戏剧性对话要求---
+    为了使对话更加引人入胜，请特别融入以下戏剧性元素：
+""")
+
+CUSTOM_DRAMATIC_FOOTER = "请确保这些特定的戏剧性元素自然地融入对话，创造令人惊喜的转折和情感共鸣。避免过度戏剧化，保持对话的真实感和自然流动。"
+
+_ADAPTATION_TEXTS = {
+    "英文": """
+        As a professional dialogue stylist AI, your task is to rewrite the original dialogue based on the given character traits while maintaining the same plot points, intentions, and dramatic elements of the original dialogue. Please keep the output in English.
+
+        ## Original Dialogue Information
+        Original dialogue text:
+        $original_text
+
+        Key points:
+        $key_points_text
+
+        Dialogue intentions:
+        $intentions_text
+
+        Key vocabulary (must be preserved):
+        $key_vocabulary_text
+
+        Key sentence structures (must be preserved):
+        $key_sentences_text
+
+        Dramatic elements (must be enhanced):
+        $dramatic_elements_text
+
+        ## Character Traits
+        # User Character Details
+        $user_traits_description
+
+        # AI Character Details
+        $ai_traits_description
+
+        Please follow these requirements:
+        1. Maintain all key points, intentions, and dramatic elements from the original dialogue
+        2. Include ALL key vocabulary and sentence structures from the original dialogue
+        3. Adjust the dialogue style, tone, and descriptions according to the character traits
+        4. Keep the format of the dialogue with clear speaker distinctions
+        {emotion_instruction}
+        6. IMPORTANT: Emphasize and enhance the dramatic elements - make the plot twists, secrets, and emotional turns even more engaging and compelling while staying true to the original storyline
+        7. Keep the output in the SAME LANGUAGE as the original dialogue (English)
+        8. Only return the rewritten dialogue text without additional explanations
+    """,
+    "中文": """
+        作为一个专业的对话风格改编 AI，你的任务是将原始对话根据给定的角色特质进行改编，同时保持原始对话的情节、意图和戏剧性元素不变。
+
+        ## 原始对话信息
+        对话原文：
+        $original_text
+
+        关键节点：
+        $key_points_text
+
+        对话意图：
+        $intentions_text
+
+        关键词汇（必须保留）：
+        $key_vocabulary_text
+
+        关键句型（必须保留）：
+        $key_sentences_text
+
+        戏剧性元素（必须强化）：
+        $dramatic_elements_text
+
+        ## 角色特质
+        # 用户角色详情
+        $user_traits_description
+
+        # AI角色详情
+        $ai_traits_description
+
+        请按照以下要求进行改编：
+        1. 保持原始对话的全部关键节点、意图和戏剧性元素
+        2. 包含原始对话中的所有关键词汇和句型
+        3. 根据用户和 AI 的角色特质调整对话风格、语调和描述方式
+        4. 请保持对话的格式，包括清晰的说话人区分
+        {emotion_instruction}
+        6. 重要提示：强化并突出戏剧性元素 - 让情节转折、秘密和情感变化更加引人入胜，同时保持原有故事线的真实性
+        7. 重要提示：请保持输出语言与原始对话相同（中文）
+        8. 请只返回改编后的对话文本，不需要额外的解释
+    """,
+}
+
+_EMOTION_INSTRUCTIONS = {
+    ("英文", "自动模式"): "5. IMPORTANT: For each line spoken by the AI character, automatically generate and include appropriate emotional expressions and physical actions based on the AI's personality and the content of the message",
+    ("英文", "自定义模式"): "5. IMPORTANT: For each line spoken by the AI character, include emotional expressions and physical actions from this list: $ai_emo",
+    ("英文", None): "5. Include appropriate emotional expressions and physical actions for the AI character when needed",
+    ("中文", "自动模式"): "5. 重要提示：对于AI的每一句话，根据AI的性格特点和话语内容，自动生成并添加合适的情感表达和肢体动作描述",
+    ("中文", "自定义模式"): "5. 重要提示：对于AI的每一句话，从以下列表中选择并添加情感表达和肢体动作描述：$ai_emo",
+    ("中文", None): "5. 在需要时为AI角色添加适当的情感表达和肢体动作描述",
+}
+
+
+@lru_cache(maxsize=None)
+def get_generation_template(dialogue_mode):
+    """获取对话生成模板（按对话模式缓存，第一个说话者的说明在编译时写入）"""
+    text = _GENERATION_TEXT.replace("$first_speaker_instruction", _FIRST_SPEAKER_INSTRUCTIONS.get(dialogue_mode, ""))
+    return PromptTemplate("generation", dialogue_mode, text)
+
+
+def get_adaptation_template(language, ai_emo_mode):
+    """
+    获取风格改编模板
+
+    Args:
+        language (str): 输出语言，"英文"使用英文模板，其他语言使用中文模板
+        ai_emo_mode (str): "自动模式"、"自定义模式"，或 None 表示通用指令
+    """
+    prompt_language = "英文" if language == "英文" else "中文"
+    return _compile_adaptation_template(prompt_language, ai_emo_mode)
+
+
+@lru_cache(maxsize=None)
+def _compile_adaptation_template(prompt_language, ai_emo_mode):
+    """编译风格改编模板（按提示语言和表情模式缓存）"""
+    emotion_instruction = _EMOTION_INSTRUCTIONS[(prompt_language, ai_emo_mode)]
+    text = _ADAPTATION_TEXTS[prompt_language].replace("{emotion_instruction}", emotion_instruction)
+    return PromptTemplate("adaptation", (prompt_language, ai_emo_mode), text)
+
+
+def build_turns_example(dialogue_mode, num_turns):
+    """构建轮数示例（只展示开头两轮和最后一轮，避免示例随轮数线性增长）"""
+    turn_template = _TURN_TEMPLATES.get(dialogue_mode, _TURN_TEMPLATES["用户先说"])
+    if num_turns <= 3:
+        return "".join(turn_template.format(i) for i in range(1, num_turns + 1))
+    return turn_template.format(1) + turn_template.format(2) + "……（按相同格式继续）\n\n" + turn_template.format(num_turns)
+
+
+def get_template_report():
+    """
+    获取所有已编译模板的大小统计
+
+    Returns:
+        list: 每个模板的 name、key、chars 和 tokens（仅模板固定部分）
+    """
+    reports = [get_generation_template(mode).get_info() for mode in _FIRST_SPEAKER_INSTRUCTIONS]
+    reports += [get_adaptation_template(language, mode).get_info() for (language, mode) in _EMOTION_INSTRUCTIONS]
+    return reports
@@ -10,6 +10,8 @@ import re
 import random
 from typing import Dict, List, Any, Optional
 from dotenv import load_dotenv
+from utils.model_profiler import model_profiles, select_fastest_acceptable_model
+from agents.pipeline import OPENAI_CONTEXT_LENGTHS
 
 class AppConfig:
     """
@@ -24,6 +26,11 @@ class AppConfig:
         "difficulty_options": ["A1", "A2", "B1", "B2", "C1", "C2"],
         "dialogue_mode_options": ["AI先说", "用户先说"],
         "default_num_turns": 6,
+        # 长篇模式（用于听力材料的超长对话）
+        "long_form_min_turns": 50,
+        "long_form_max_turns": 200,
+        "default_long_form_turns": 60,
+        "long_form_chapter_turns": 10,  # 每章轮数，每章生成后立即保存
         "default_difficulty": "B1",
         # 添加默认输入值
         "context": "在一家温馨热闹的咖啡店里，A正站起身去取咖啡时，不小心与B发生了轻微碰撞......",
@@ -55,8 +62,25 @@ class AppConfig:
         "openrouter_full_models_data": [],  # 存储完整的模型数据
         "openrouter_cache_timestamp": 0,
         "openrouter_model_search_query": "",  # 存储模型搜索关键词
+        # 模型选择方式："手动选择" 或 "最快可用"（按历史延迟、成功率和价格自动选择）
+        "model_selection_mode": "手动选择",
+        "model_selection_mode_options": ["手动选择", "最快可用"],
+        # 各 Agent 的延迟 SLO（秒）
+        "latency_slo_initial_dialogue": 30.0,
+        "latency_slo_style_adaptation": 20.0,
+        # 优先使用预热任务（warmup_cache.py）生成的缓存结果
+        "use_response_cache": True,
+        # 近似重复输入的复用："关闭"、"提示"（询问是否使用已保存的对话）或"直接复用"
+        "similarity_mode": "关闭",
+        "similarity_mode_options": ["关闭", "提示", "直接复用"],
+        "similarity_threshold": 0.9,
+        # 编辑初始对话后再次改编时，只改编修改过的行并拼回已有的最终对话
+        "incremental_adaptation": True,
     }
     
+    # OpenAI 模型的上下文窗口大小（OpenRouter 模型使用目录中的 context_length）
+    OPENAI_CONTEXT_LENGTHS = OPENAI_CONTEXT_LENGTHS
+    
     def __init__(self):
         # 尝试从环境变量中加载 API 密钥
         try:
@@ -104,6 +128,18 @@ class AppConfig:
         if 'final_saved_path' not in st.session_state:
             st.session_state.final_saved_path = None
             
+        # 当前最终对话改编自的初始对话文本和特质摘要 {"original_text", "signature"}，用于增量改编
+        if 'last_adaptation' not in st.session_state:
+            st.session_state.last_adaptation = None
+            
+        # 已提交、尚未载入结果的后台任务（任务类型 -> 任务 ID）
+        if 'pending_jobs' not in st.session_state:
+            st.session_state.pending_jobs = {}
+            
+        # 后台任务结束后待显示的提示 [(级别, 内容)]
+        if 'job_notices' not in st.session_state:
+            st.session_state.job_notices = []
+            
         # 初始化设置变量
         if 'settings' not in st.session_state:
             st.session_state.settings = self.DEFAULT_SETTINGS.copy()
@@ -124,6 +160,7 @@ class AppConfig:
         st.session_state.final_dialogue = None
         st.session_state.final_dialogue_edited = False
         st.session_state.final_saved_path = None
+        st.session_state.last_adaptation = None
         
     def get_available_models(self) -> List[str]:
         """根据当前API提供商获取可用模型列表"""
@@ -281,6 +318,46 @@ class AppConfig:
                 
         return filtered_models
     
+    def resolve_model_for_agent(self, agent_type: str) -> str:
+        """
+        获取指定 Agent 使用的模型
+        手动模式下返回侧边栏选择的模型；"最快可用"模式下在有调用记录的模型中
+        选择满足该 Agent 延迟 SLO 的最便宜模型，数据不足时退回到手动选择的模型
+        """
+        model = self.get_setting("model")
+        if self.get_setting("model_selection_mode") != "最快可用":
+            return model
+        
+        # 只考虑当前API提供商可用的模型
+        if self.get_setting("api_provider") == "openrouter":
+            available = set(self.get_setting("openrouter_models_cache", []))
+        else:
+            available = set(self.get_available_models())
+        candidates = [m for m in model_profiles.get_profiled_models(agent_type) if m in available]
+        if model not in candidates:
+            candidates.append(model)
+        
+        selected = select_fastest_acceptable_model(
+            model_profiles,
+            agent_type,
+            candidates,
+            self.get_setting(f"latency_slo_{agent_type}", 30.0),
+            get_model_details=self.get_model_details_by_id
+        )
+        return selected or model
+    
+    def get_model_context_length(self, model_id: str) -> Optional[int]:
+        """获取模型的上下文窗口大小（token），未知时返回 None"""
+        if self.get_setting("api_provider") == "openrouter":
+            model_details = self.get_model_details_by_id(model_id)
+            if model_details and model_details.get("context_length"):
+                try:
+                    return int(model_details["context_length"])
+                except (TypeError, ValueError):
+                    return None
+            return None
+        return self.OPENAI_CONTEXT_LENGTHS.get(model_id)
+    
     def get_model_details_by_id(self, model_id: str) -> Optional[Dict[str, Any]]:
         """根据模型ID获取详细信息"""
         full_models_data = self.get_setting("openrouter_full_models_data", [])
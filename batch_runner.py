@@ -0,0 +1,204 @@
+# -*- coding: utf-8 -*- # Ensure UTF-8 encoding for wider character support
+
+"""
+批量生成对话（无界面）
+
+任务文件为 JSONL，每行一条任务，包含 Agent 1 的生成参数（context、goal、language、difficulty、num_turns 等）
+和 Agent 2 的角色特质（user_traits_chara、ai_traits_chara 等），可选 id 字段作为任务标识。
+
+每条任务的结果追加写入检查点日志；重新运行时跳过已完成的任务，失败的任务在本轮其余任务完成后重试。
+
+用法:
+    python batch_runner.py jobs.jsonl --workers 8 --journal batch_journal.jsonl
+"""
+
+import os
+import sys
+import json
+import time
+import hashlib
+import logging
+import argparse
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from dotenv import load_dotenv
+
+from agents.pipeline import create_api_client, run_dialogue_pair
+from utils.file_manager import FileManager
+
+
+def get_item_id(item):
+    """任务标识：优先使用 id 字段，否则使用任务内容的哈希"""
+    if item.get("id"):
+        return str(item["id"])
+    canonical = json.dumps(item, ensure_ascii=False, sort_keys=True)
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()[:16]
+
+
+def load_items(path):
+    """读取任务文件"""
+    items = []
+    with open(path, 'r', encoding='utf-8') as f:
+        for line_number, line in enumerate(f, 1):
+            if not line.strip():
+                continue
+            try:
+                items.append(json.loads(line))
+            except json.JSONDecodeError as e:
+                logging.error(f"任务文件第 {line_number} 行解析失败: {e}")
+    return items
+
+
+class CheckpointJournal:
+    """
+    检查点日志（追加写入的 JSONL）
+    每条任务完成或失败后立即追加一行并 fsync，进程崩溃后重新运行可从日志恢复进度
+    """
+    def __init__(self, path):
+        self.path = path
+        self.status = {}  # item_id -> 最新的日志记录
+        if os.path.exists(path):
+            with open(path, 'r', encoding='utf-8') as f:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                    except json.JSONDecodeError:
+                        # 崩溃时可能留下不完整的最后一行
+                        continue
+                    self.status[record["id"]] = record
+
+    def is_done(self, item_id):
+        """任务是否已完成"""
+        return self.status.get(item_id, {}).get("status") == "done"
+
+    def get_attempts(self, item_id):
+        """任务已尝试的次数"""
+        return self.status.get(item_id, {}).get("attempts", 0)
+
+    def record(self, item_id, status, **fields):
+        """追加一条任务结果"""
+        record = {
+            "id": item_id,
+            "status": status,
+            "attempts": self.get_attempts(item_id) + 1,
+            "time": time.strftime("%Y-%m-%d %H:%M:%S"),
+            **fields
+        }
+        with open(self.path, 'a', encoding='utf-8') as f:
+            f.write(json.dumps(record, ensure_ascii=False) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+        self.status[item_id] = record
+
+
+# 每个工作进程各自持有的客户端和文件管理器
+_worker_state = {}
+
+
+def _init_worker(api_provider, openrouter_api_key, index_path):
+    """工作进程初始化：创建本进程的 API 客户端和文件管理器"""
+    load_dotenv()
+    _worker_state["api_provider"] = api_provider
+    _worker_state["client"] = create_api_client(api_provider, openrouter_api_key)
+    _worker_state["file_manager"] = FileManager(index_path=index_path)
+
+
+def _run_item(item, models):
+    """在工作进程中执行一条任务，返回保存的文件路径"""
+    result = run_dialogue_pair(
+        item,
+        _worker_state["client"],
+        _worker_state["api_provider"],
+        models,
+        _worker_state["file_manager"]
+    )
+    return {"initial_path": result["initial_path"], "final_path": result["final_path"]}
+
+
+def run_batch(items, journal, workers, models, api_provider, openrouter_api_key=None,
+              index_path="dialogue_store.db", max_attempts=3):
+    """
+    使用进程池批量执行任务
+
+    Args:
+        items (list): 任务列表
+        journal (CheckpointJournal): 检查点日志
+        workers (int): 工作进程数
+        models (dict): 各 Agent 类型使用的模型
+        api_provider (str): "openai" 或 "openrouter"
+        openrouter_api_key (str, optional): OpenRouter API 密钥
+        index_path (str): 对话索引数据库路径
+        max_attempts (int): 每条任务的最大尝试次数（包括之前运行中的尝试）
+
+    Returns:
+        dict: 各状态的任务数量
+    """
+    pending = {}
+    skipped = 0
+    for item in items:
+        item_id = get_item_id(item)
+        if journal.is_done(item_id):
+            skipped += 1
+        elif journal.get_attempts(item_id) < max_attempts:
+            pending[item_id] = item
+    logging.info(f"共 {len(items)} 条任务，已完成 {skipped} 条，本次执行 {len(pending)} 条")
+
+    done = 0
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                             initargs=(api_provider, openrouter_api_key, index_path)) as executor:
+        # 先执行全部待处理任务，失败的任务放到下一轮重试
+        while pending:
+            futures = {executor.submit(_run_item, item, models): item_id for item_id, item in pending.items()}
+            retry = {}
+            for future in as_completed(futures):
+                item_id = futures[future]
+                try:
+                    paths = future.result()
+                    journal.record(item_id, "done", **paths)
+                    done += 1
+                except Exception as e:
+                    journal.record(item_id, "failed", error=str(e))
+                    logging.warning(f"任务 {item_id} 失败（第 {journal.get_attempts(item_id)} 次）: {e}")
+                    if journal.get_attempts(item_id) < max_attempts:
+                        retry[item_id] = pending[item_id]
+            pending = retry
+
+    failed = sum(1 for item in items if not journal.is_done(get_item_id(item)))
+    return {"total": len(items), "skipped": skipped, "done": done, "failed": failed}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="批量生成对话（Agent 1 生成 + Agent 2 改编）")
+    parser.add_argument("items", help="任务文件（JSONL）")
+    parser.add_argument("--journal", default="batch_journal.jsonl", help="检查点日志路径")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="工作进程数")
+    parser.add_argument("--api-provider", choices=["openai", "openrouter"], default="openai")
+    parser.add_argument("--model", default="o3-mini", help="Agent 1 和 Agent 2 默认使用的模型")
+    parser.add_argument("--initial-model", help="Agent 1 使用的模型")
+    parser.add_argument("--adaptation-model", help="Agent 2 使用的模型")
+    parser.add_argument("--index", default="dialogue_store.db", help="对话索引数据库路径")
+    parser.add_argument("--max-attempts", type=int, default=3, help="每条任务的最大尝试次数")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s")
+    load_dotenv()
+
+    models = {
+        "initial_dialogue": args.initial_model or args.model,
+        "style_adaptation": args.adaptation_model or args.model,
+    }
+    summary = run_batch(
+        load_items(args.items),
+        CheckpointJournal(args.journal),
+        args.workers,
+        models,
+        args.api_provider,
+        os.getenv("OPENROUTER_API_KEY", ""),
+        args.index,
+        args.max_attempts
+    )
+    print(f"完成: {summary['done']}，跳过: {summary['skipped']}，失败: {summary['failed']}，共: {summary['total']}")
+    return 0 if summary["failed"] == 0 else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -7,12 +7,24 @@ st.set_page_config(layout="wide", page_title="AI Dialogue Personalizer")
 from openai import OpenAI, OpenAIError
 import os
 import logging
+import datetime
+import time
 import requests
 from dotenv import load_dotenv
 
 # 导入重构后的组件
 from agents.registry import agent_registry
+from agents.job_worker import WorkerPool, JOB_INITIAL_DIALOGUE, JOB_STYLE_ADAPTATION
+from agents.pipeline import initial_cache_key, adaptation_cache_key, adaptation_signature, check_initial_dialogue
+from agents.prompt_templates import get_template_report
+from utils.token_counter import token_histogram
+from utils.model_profiler import model_profiles
+from utils.single_flight import generation_flights
+from utils.similarity_cache import SimilarityCache
+from utils.response_cache import ResponseCache
 from utils.file_manager import FileManager
+from utils.job_queue import JobQueue, JOB_QUEUED, JOB_DONE, FINISHED_STATUSES
+from utils.markdown_renderer import render_initial_dialogue_markdown, render_final_dialogue_markdown, render_to_stream
 from app_config import AppConfig
 
 # 配置日志
@@ -32,8 +44,66 @@ API_ERROR_MESSAGE = None # 存储具体错误信息
 
 # 初始化应用配置
 app_config = AppConfig()
-# 初始化文件管理器
-file_manager = FileManager()
+# 初始化文件管理器（后台写入线程和对话索引连接在多次重新运行之间共享）
+@st.cache_resource
+def get_file_manager():
+    manager = FileManager(write_behind=True, index_path="dialogue_store.db")
+    # 首次启用索引时导入已有的对话文件
+    if not manager.store.count():
+        manager.rebuild_index()
+    return manager
+
+file_manager = get_file_manager()
+
+# 后台任务的工作线程数和界面轮询间隔（秒）
+JOB_WORKERS = 4
+JOB_POLL_INTERVAL = 2
+# 预计命中缓存的任务在本次运行中等待结束的时间（秒）
+JOB_CACHED_WAIT = 3
+
+# 预热任务写入的响应缓存（与 warmup_cache.py 和 service.py 共用同一个文件）
+@st.cache_resource
+def get_response_cache():
+    return ResponseCache(path="response_cache.db")
+
+response_cache = get_response_cache()
+
+# 模型性能档案保存位置（与 service.py 和 warmup_cache.py 默认共用同一个文件）
+@st.cache_resource
+def get_model_profiles():
+    model_profiles.configure("model_profiles.db")
+    return model_profiles
+
+get_model_profiles()
+
+# 生成任务在后台线程池中执行（所有会话共用），页面重新运行不会中断或重复执行
+@st.cache_resource
+def get_worker_pool():
+    pool = WorkerPool(JobQueue("job_queue.db"), file_manager, workers=JOB_WORKERS, response_cache=response_cache)
+    pool.start()
+    return pool
+
+worker_pool = get_worker_pool()
+
+# 近似重复输入缓存（从对话索引增量同步，所有会话共用）
+@st.cache_resource
+def get_similarity_cache():
+    return SimilarityCache(file_manager.store, check=check_initial_dialogue)
+
+similarity_cache = get_similarity_cache()
+JOB_LABELS = {JOB_INITIAL_DIALOGUE: "初始对话", JOB_STYLE_ADAPTATION: "最终对话"}
+
+# 搜索面板的选项与 FileManager.search_dialogues 参数的对应关系
+SEARCH_SCOPES = {"全部": None, "对话内容": "text", "关键词汇": "vocabulary", "关键句型": "sentences"}
+SEARCH_KINDS = {"全部": None, "初始对话": "initial", "最终对话": "final"}
+
+# 对话浏览器每页显示的条数
+BROWSER_PAGE_SIZE = 20
+# 编辑区组件的 key，载入其他对话时需要清除
+EDITOR_WIDGET_KEYS = [
+    "edit_text", "edit_key_points", "edit_intentions", "edit_key_vocabulary",
+    "edit_key_sentences", "edit_dramatic_elements", "edit_final_dialogue"
+]
 
 def show_api_error(error_message, suggestion=None):
     """显示API错误信息"""
@@ -236,6 +306,47 @@ def render_sidebar():
             )
             app_config.set_setting("model", model)
         
+        # 模型选择方式：手动或按历史延迟/成功率/价格自动选择
+        selection_mode_options = app_config.get_setting("model_selection_mode_options")
+        model_selection_mode = st.radio(
+            "模型选择方式",
+            selection_mode_options,
+            index=selection_mode_options.index(app_config.get_setting("model_selection_mode", "手动选择")),
+            help="最快可用：根据历史调用的延迟、成功率和价格，为每个Agent自动选择满足延迟要求的最便宜模型；数据不足时使用上面选择的模型",
+            horizontal=True
+        )
+        app_config.set_setting("model_selection_mode", model_selection_mode)
+        
+        if model_selection_mode == "最快可用":
+            for agent_type, label in [("initial_dialogue", "Agent 1"), ("style_adaptation", "Agent 2")]:
+                slo = st.number_input(
+                    f"{label} 延迟上限 (秒)",
+                    min_value=1.0,
+                    max_value=300.0,
+                    value=float(app_config.get_setting(f"latency_slo_{agent_type}", 30.0)),
+                    step=5.0,
+                    key=f"latency_slo_{agent_type}_input"
+                )
+                app_config.set_setting(f"latency_slo_{agent_type}", slo)
+                st.caption(f"{label} 当前使用: {app_config.resolve_model_for_agent(agent_type)}")
+            
+            with st.expander("模型性能档案", expanded=False):
+                rows = []
+                for agent_type in ["initial_dialogue", "style_adaptation"]:
+                    for model_id in model_profiles.get_profiled_models(agent_type):
+                        profile = model_profiles.get_profile(agent_type, model_id)
+                        rows.append({
+                            "Agent": agent_type,
+                            "模型": model_id,
+                            "调用次数": profile["calls"],
+                            "成功率": f"{profile['successes'] / profile['calls']:.0%}",
+                            "平均延迟(秒)": round(profile["avg_latency"], 1) if profile["avg_latency"] is not None else None
+                        })
+                if rows:
+                    st.dataframe(rows, hide_index=True)
+                else:
+                    st.write("暂无调用记录")
+        
         # 增加模式选择
         st.header("创作模式")
         work_mode = st.radio(
@@ -244,6 +355,64 @@ def render_sidebar():
             help="自动模式：Agent1生成内容自动传给Agent2；人机协作：Agent1生成后，人工编辑再传给Agent2"
         )
         app_config.set_setting("work_mode", work_mode)
+        
+        use_response_cache = st.checkbox(
+            "优先使用预生成的对话",
+            value=app_config.get_setting("use_response_cache", True),
+            help="输入与预热任务（warmup_cache.py）生成的场景完全一致时直接返回，不再调用模型；需要新的版本时取消勾选"
+        )
+        app_config.set_setting("use_response_cache", use_response_cache)
+        
+        incremental_adaptation = st.checkbox(
+            "编辑后只改编修改过的行",
+            value=app_config.get_setting("incremental_adaptation", True),
+            help="编辑初始对话后再次生成最终对话时，未修改的行沿用已有的改编结果（包括对最终对话的手动修改），只改编新增或修改过的行；角色特质或语言变化时仍完整改编"
+        )
+        app_config.set_setting("incremental_adaptation", incremental_adaptation)
+        
+        # 背景和目标只有细微差别（空白、标点等）时复用已保存的对话，减少重复生成
+        with st.expander("相似输入复用", expanded=False):
+            similarity_options = app_config.get_setting("similarity_mode_options")
+            similarity_mode = st.radio(
+                "复用方式",
+                similarity_options,
+                index=similarity_options.index(app_config.get_setting("similarity_mode", "关闭")),
+                help="提示：找到相似的已保存对话时询问是否使用；直接复用：直接载入相似对话，不再调用模型"
+            )
+            app_config.set_setting("similarity_mode", similarity_mode)
+            similarity_threshold = st.slider(
+                "相似度阈值",
+                min_value=0.5,
+                max_value=1.0,
+                value=float(app_config.get_setting("similarity_threshold", 0.9)),
+                step=0.05,
+                disabled=similarity_mode == "关闭",
+                help="背景和目标的字符 n-gram 相似度；语言、难度、模式、轮数、自定义单词/句型和戏剧性元素须相同"
+            )
+            app_config.set_setting("similarity_threshold", similarity_threshold)
+        
+        # 提示模板统计（模板固定部分的大小，便于衡量模板改动）
+        with st.expander("提示模板统计", expanded=False):
+            st.dataframe(
+                [{"模板": r["name"], "键": str(r["key"]), "字符数": r["chars"], "估算tokens": r["tokens"]} for r in get_template_report()],
+                hide_index=True
+            )
+        
+        # 每次调用的提示 token 数分布
+        with st.expander("提示 token 统计", expanded=False):
+            summary = token_histogram.get_summary()
+            st.write(f"**调用次数**: {summary['total_calls']}")
+            st.write(f"**平均 tokens**: {summary['average_tokens']:.0f}")
+            st.write(f"**最大 tokens**: {summary['max_tokens']}")
+            if summary["buckets"]:
+                st.bar_chart(
+                    [{"区间": f"≤{b['upper_bound']}", "次数": b["count"]} for b in summary["buckets"]],
+                    x="区间",
+                    y="次数"
+                )
+            # 相同输入同时生成时合并为一次调用
+            flights = generation_flights.get_stats()
+            st.write(f"**合并的重复生成**: {flights['coalesced']} / {flights['executed'] + flights['coalesced']}")
 
 def render_agent1_inputs(col):
     """渲染Agent 1的输入界面"""
@@ -292,16 +461,35 @@ def render_agent1_inputs(col):
             key="difficulty_input"
         )
         
-        # 添加对话轮数选择
-        num_turns = st.slider(
-            "对话轮数",
-            min_value=1,
-            max_value=20,
-            value=app_config.get_setting("default_num_turns"),
-            help="设置对话的来回轮数，1轮=用户和AI各说一次",
-            key="num_turns_input"
+        # 长篇模式：按章节生成并逐章保存，适合长听力材料
+        long_form = st.checkbox(
+            "长篇模式",
+            value=False,
+            help="生成50-200轮的长对话，按章节逐步生成并逐章保存，不进入Agent 2改编流程",
+            key="long_form_input"
         )
         
+        # 添加对话轮数选择
+        if long_form:
+            num_turns = st.slider(
+                "对话轮数",
+                min_value=app_config.get_setting("long_form_min_turns"),
+                max_value=app_config.get_setting("long_form_max_turns"),
+                value=app_config.get_setting("default_long_form_turns"),
+                step=10,
+                help="长篇模式下按章节生成，每章生成后立即保存",
+                key="long_num_turns_input"
+            )
+        else:
+            num_turns = st.slider(
+                "对话轮数",
+                min_value=1,
+                max_value=20,
+                value=app_config.get_setting("default_num_turns"),
+                help="设置对话的来回轮数，1轮=用户和AI各说一次",
+                key="num_turns_input"
+            )
+        
         # 添加戏剧性元素选择
         st.subheader("戏剧性元素", help="为对话添加戏剧性和吸引力")
         
@@ -421,6 +609,7 @@ def render_agent1_inputs(col):
             "language": language,
             "difficulty": difficulty,
             "num_turns": num_turns,
+            "long_form": long_form,
             "custom_vocabulary": custom_vocabulary,
             "custom_sentence": custom_sentence,
             "dramatic_elements_selection": dramatic_elements_selection,
@@ -561,33 +750,21 @@ def render_agent2_inputs(col):
         }
 
 def process_agent1_generation(inputs):
-    """处理Agent 1的生成请求"""
+    """处理Agent 1的生成请求：长篇模式逐章生成，其余提交到后台任务队列"""
     try:
         # 验证输入
         if not inputs["context"] or not inputs["goal"]:
             st.error("请至少填写对话背景和对话目标")
             return False
             
-        # 获取配置和客户端
+        # 获取配置
         api_provider = app_config.get_setting("api_provider")
-        model = app_config.get_setting("model")
+        model = app_config.resolve_model_for_agent("initial_dialogue")
         
         # 检查API配置
         if api_provider == "openrouter" and not app_config.get_setting("openrouter_api_key"):
             st.error("请在侧边栏设置OpenRouter API密钥")
             return False
-            
-        # 获取代理
-        client = app_config.create_api_client()
-        if not client:
-            st.error("创建API客户端失败，请检查API设置")
-            return False
-            
-        # 使用agent_registry的create_agent方法创建Agent实例
-        agent = agent_registry.create_agent("initial_dialogue", client, model=model, api_type=api_provider)
-        if not agent:
-            st.error("创建Agent失败，请检查agent_registry")
-            return False
         
         # 处理戏剧性元素
         dramatic_elements = []
@@ -606,95 +783,210 @@ def process_agent1_generation(inputs):
         # 构建戏剧性元素字符串
         dramatic_elements_str = ", ".join(dramatic_elements)
         
-        with st.spinner("正在生成对话..."):
-            # 处理生成请求
-            result = agent.process(
-                context=inputs["context"],
-                dialogue_mode=inputs["dialogue_mode"],
-                goal=inputs["goal"],
-                language=inputs["language"],
-                difficulty=inputs["difficulty"],
-                num_turns=inputs["num_turns"],
-                custom_vocabulary=inputs["custom_vocabulary"],
-                custom_sentence=inputs["custom_sentence"],
-                dramatic_elements=dramatic_elements_str
-            )
-            
-            if result is None:
-                st.error("生成对话失败，请重试")
+        # 长篇模式走逐章生成和保存的流程
+        if inputs.get("long_form"):
+            client = app_config.create_api_client()
+            if not client:
+                st.error("创建API客户端失败，请检查API设置")
                 return False
-                
-            # 检查是否是错误消息字符串
-            if isinstance(result, str) and ("API" in result and "失败" in result or "error" in result.lower()):
-                show_api_error(result)
+            agent = agent_registry.create_agent("initial_dialogue", client, model=model, api_type=api_provider)
+            if not agent:
+                st.error("创建Agent失败，请检查agent_registry")
                 return False
-                
-            # 存储结果
-            st.session_state.dialogue_data = result
-            st.session_state.dialogue_edited = False
+            agent.context_length = app_config.get_model_context_length(model)
+            return process_long_form_generation(agent, inputs, dramatic_elements_str)
+        
+        payload = {
+            "params": {
+                "context": inputs["context"],
+                "dialogue_mode": inputs["dialogue_mode"],
+                "goal": inputs["goal"],
+                "language": inputs["language"],
+                "difficulty": inputs["difficulty"],
+                "num_turns": inputs["num_turns"],
+                "custom_vocabulary": inputs["custom_vocabulary"],
+                "custom_sentence": inputs["custom_sentence"],
+                "dramatic_elements": dramatic_elements_str
+            },
+            "api_provider": api_provider,
+            "model": model,
+            "context_length": app_config.get_model_context_length(model),
+            "use_cache": app_config.get_setting("use_response_cache", True)
+        }
+        
+        # 自动模式下由同一个任务接着调用Agent 2处理
+        work_mode = app_config.get_setting("work_mode")
+        if work_mode == "自动模式":
+            # 构建用户和AI特质数据
+            user_traits_chara = app_config.get_setting("user_traits_chara", "")
+            user_traits_address = app_config.get_setting("user_traits_address", "")
+            user_traits_custom = app_config.get_setting("user_traits_custom", "")
+            ai_traits_chara = app_config.get_setting("ai_traits_chara", "")
+            ai_traits_mantra = app_config.get_setting("ai_traits_mantra", "")
+            ai_traits_tone = app_config.get_setting("ai_traits_tone", "")
+            ai_emo = app_config.get_setting("ai_emo", "")
+            ai_emo_mode = app_config.get_setting("ai_emo_mode", "自动模式")
             
-            # 保存对话数据
-            saved_paths = file_manager.save_initial_dialogue(result, inputs["context"], inputs["goal"])
-            if saved_paths and saved_paths[0]:
-                st.session_state.saved_path = saved_paths
-                st.success(f"已将结构化内容保存至:\n- JSON: {saved_paths[0]}\n- Markdown: {saved_paths[1]}")
+            # 检查特质是否已填写
+            if user_traits_chara or ai_traits_chara:
+                # 构建V1格式的特质字符串
+                user_traits = f"性格:{user_traits_chara}; 称呼:{user_traits_address}; 自定义:{user_traits_custom}"
+                ai_traits = f"性格:{ai_traits_chara}; 口头禅:{ai_traits_mantra}; 语气:{ai_traits_tone}"
+                if ai_emo_mode == "自定义模式" and ai_emo:
+                    ai_traits += f"; 表情/动作:{ai_emo}"
+                elif ai_emo_mode == "自动模式":
+                    ai_traits += "; 表情/动作:自动生成"
                 
-                # 自动模式下直接调用Agent 2处理
-                work_mode = app_config.get_setting("work_mode")
-                if work_mode == "自动模式":
-                    # 构建用户和AI特质数据
-                    user_traits_chara = app_config.get_setting("user_traits_chara", "")
-                    user_traits_address = app_config.get_setting("user_traits_address", "")
-                    user_traits_custom = app_config.get_setting("user_traits_custom", "")
-                    ai_traits_chara = app_config.get_setting("ai_traits_chara", "")
-                    ai_traits_mantra = app_config.get_setting("ai_traits_mantra", "")
-                    ai_traits_tone = app_config.get_setting("ai_traits_tone", "")
-                    ai_emo = app_config.get_setting("ai_emo", "")
-                    ai_emo_mode = app_config.get_setting("ai_emo_mode", "自动模式")
-                    
-                    # 检查特质是否已填写
-                    if user_traits_chara or ai_traits_chara:
-                        with st.spinner("自动模式：正在生成最终对话..."):
-                            # 构建V1格式的特质字符串
-                            user_traits = f"性格:{user_traits_chara}; 称呼:{user_traits_address}; 自定义:{user_traits_custom}"
-                            ai_traits = f"性格:{ai_traits_chara}; 口头禅:{ai_traits_mantra}; 语气:{ai_traits_tone}"
-                            if ai_emo_mode == "自定义模式" and ai_emo:
-                                ai_traits += f"; 表情/动作:{ai_emo}"
-                            elif ai_emo_mode == "自动模式":
-                                ai_traits += "; 表情/动作:自动生成"
-                            
-                            # 构建Agent2的输入参数
-                            agent2_inputs = {
-                                "user_traits_chara": user_traits_chara,
-                                "user_traits_address": user_traits_address,
-                                "user_traits_custom": user_traits_custom,
-                                "ai_traits_chara": ai_traits_chara,
-                                "ai_traits_mantra": ai_traits_mantra,
-                                "ai_traits_tone": ai_traits_tone,
-                                "ai_emo": ai_emo,
-                                "ai_emo_mode": ai_emo_mode,
-                                "user_traits": user_traits,
-                                "ai_traits": ai_traits
-                            }
-                            
-                            # 调用Agent 2进行处理
-                            process_agent2_generation(agent2_inputs)
-                    else:
-                        st.warning("自动模式：需要填写用户性格特质和AI性格特质才能自动生成最终对话")
-            
-            return True
+                # 构建Agent2的输入参数
+                agent2_inputs = {
+                    "user_traits_chara": user_traits_chara,
+                    "user_traits_address": user_traits_address,
+                    "user_traits_custom": user_traits_custom,
+                    "ai_traits_chara": ai_traits_chara,
+                    "ai_traits_mantra": ai_traits_mantra,
+                    "ai_traits_tone": ai_traits_tone,
+                    "ai_emo": ai_emo,
+                    "ai_emo_mode": ai_emo_mode,
+                    "user_traits": user_traits,
+                    "ai_traits": ai_traits
+                }
+                payload["adaptation"] = build_adaptation_payload(agent2_inputs)
+            else:
+                st.warning("自动模式：需要填写用户性格特质和AI性格特质才能自动生成最终对话")
+        
+        # 查找输入近似重复的已保存对话（完全一致的输入已有预生成结果时不需要）
+        similarity_mode = app_config.get_setting("similarity_mode", "关闭")
+        if similarity_mode != "关闭" and not (payload["use_cache"] and job_cache_key(JOB_INITIAL_DIALOGUE, payload) in response_cache):
+            match = similarity_cache.find(
+                payload["params"], app_config.get_setting("similarity_threshold", 0.9), model=payload["model"]
+            )
+            if match:
+                if similarity_mode == "直接复用":
+                    return reuse_similar_dialogue(match, payload)
+                st.session_state.similar_match = {"match": match, "payload": payload}
+                return True
+        
+        submit_job(JOB_INITIAL_DIALOGUE, payload)
+        return True
     except Exception as e:
         st.error(f"处理生成请求时出错: {str(e)}")
         logging.error(f"处理生成请求时出错: {str(e)}", exc_info=True)
         return False
 
+def process_long_form_generation(agent, inputs, dramatic_elements_str):
+    """处理长篇模式的生成请求：逐章生成、逐章保存，页面只保留最近一章的预览"""
+    saved_paths = file_manager.start_long_dialogue(
+        inputs["context"],
+        inputs["goal"],
+        settings={
+            "dialogue_mode": inputs["dialogue_mode"],
+            "language": inputs["language"],
+            "difficulty": inputs["difficulty"],
+            "num_turns": inputs["num_turns"],
+            "dramatic_elements": dramatic_elements_str
+        }
+    )
+    if not saved_paths[0]:
+        st.error("创建长篇对话文件失败")
+        return False
+    
+    num_turns = inputs["num_turns"]
+    progress_bar = st.progress(0.0, text="正在生成长篇对话...")
+    preview = st.empty()
+    generated_turns = 0
+    
+    chapters = agent.generate_long_dialogue(
+        context=inputs["context"],
+        dialogue_mode=inputs["dialogue_mode"],
+        goal=inputs["goal"],
+        language=inputs["language"],
+        difficulty=inputs["difficulty"],
+        num_turns=num_turns,
+        custom_vocabulary=inputs["custom_vocabulary"],
+        custom_sentence=inputs["custom_sentence"],
+        dramatic_elements=dramatic_elements_str,
+        chapter_turns=app_config.get_setting("long_form_chapter_turns", 10)
+    )
+    for chapter in chapters:
+        if not file_manager.append_long_dialogue_chapter(saved_paths[0], chapter):
+            st.error(f"保存第{chapter['chapter']}章失败，已停止生成")
+            break
+        generated_turns = chapter["end_turn"]
+        progress_bar.progress(min(1.0, generated_turns / num_turns), text=f"已生成 {generated_turns}/{num_turns} 轮")
+        with preview.container():
+            st.caption(f"第 {chapter['chapter']} 章 (第 {chapter['start_turn']}-{chapter['end_turn']} 轮)")
+            st.text(chapter["text"])
+    
+    st.session_state.long_dialogue_path = saved_paths
+    if generated_turns < num_turns:
+        st.warning(f"长篇对话提前结束：要求{num_turns}轮，实际{generated_turns}轮")
+    st.success(f"已将长篇对话逐章保存至:\n- JSONL: {saved_paths[0]}\n- Markdown: {saved_paths[1]}")
+    return generated_turns > 0
+
+def build_adaptation_payload(agent2_inputs):
+    """构建Agent 2改编任务的参数（不含初始对话数据）"""
+    model = app_config.resolve_model_for_agent("style_adaptation")
+    return {
+        "traits": agent2_inputs,
+        "language": app_config.get_setting("language"),
+        "model": model,
+        "context_length": app_config.get_model_context_length(model),
+        "use_cache": app_config.get_setting("use_response_cache", True)
+    }
+
+def job_cache_key(kind, payload):
+    """任务结果在响应缓存中的键"""
+    if kind == JOB_INITIAL_DIALOGUE:
+        return initial_cache_key(payload["params"], payload["model"])
+    return adaptation_cache_key(payload["dialogue_data"], payload["traits"], payload.get("language"), payload["model"])
+
+def submit_job(kind, payload):
+    """提交后台任务并记录到会话状态，结果由 poll_pending_jobs 载入"""
+    api_key = app_config.get_setting("openrouter_api_key") if payload["api_provider"] == "openrouter" else None
+    job_id = worker_pool.submit(kind, payload, api_key=api_key)
+    st.session_state.pending_jobs[kind] = job_id
+    # 命中预生成缓存的任务很快结束，稍等即可在本次运行中显示结果
+    if payload.get("use_cache") and job_cache_key(kind, payload) in response_cache:
+        worker_pool.wait(job_id, JOB_CACHED_WAIT)
+    return job_id
+
+def reuse_similar_dialogue(match, payload):
+    """载入近似重复的已保存对话代替重新生成；自动模式下接着提交改编任务"""
+    if not load_saved_dialogue({"json_path": match["json_path"], "md_path": match["md_path"], "kind": "initial"}):
+        return False
+    st.session_state.job_notices.append(
+        ("success", f"已复用相似度 {match['similarity']:.0%} 的已保存对话: {match['json_path']}")
+    )
+    if payload.get("adaptation"):
+        adaptation = dict(payload["adaptation"], dialogue_data=st.session_state.dialogue_data,
+                          api_provider=payload["api_provider"])
+        submit_job(JOB_STYLE_ADAPTATION, adaptation)
+    return True
+
+def render_similar_match():
+    """提示模式下显示找到的相似对话，由用户选择使用该对话或仍然生成"""
+    similar = st.session_state.get("similar_match")
+    if not similar:
+        return
+    match = similar["match"]
+    st.info(
+        f"找到相似度 {match['similarity']:.0%} 的已保存对话（{match['timestamp']}，模型 {match['model'] or '未知'}）\n\n"
+        f"**背景**: {match['context']}\n\n**目标**: {match['goal']}"
+    )
+    use_col, generate_col = st.columns(2)
+    if use_col.button("使用该对话", key="use_similar_match"):
+        del st.session_state.similar_match
+        reuse_similar_dialogue(match, similar["payload"])
+        st.rerun()
+    if generate_col.button("仍然生成新对话", key="skip_similar_match"):
+        del st.session_state.similar_match
+        submit_job(JOB_INITIAL_DIALOGUE, similar["payload"])
+        st.rerun()
+
 def process_agent2_generation(agent2_inputs):
-    """处理Agent 2的风格改编请求"""
+    """处理Agent 2的风格改编请求：提交到后台任务队列"""
     try:
-        # 获取配置和客户端
         api_provider = app_config.get_setting("api_provider")
-        model = app_config.get_setting("model")
-        language = app_config.get_setting("language")
         
         # 检查API配置
         if api_provider == "openrouter" and not app_config.get_setting("openrouter_api_key"):
@@ -706,86 +998,106 @@ def process_agent2_generation(agent2_inputs):
         if not dialogue_data:
             st.error("没有初始对话数据，请先生成或加载对话")
             return False
-            
-        # 获取代理
-        client = app_config.create_api_client()
-        if not client:
-            st.error("创建API客户端失败，请检查API设置")
-            return False
-            
-        # 使用agent_registry的create_agent方法创建Agent实例
-        agent = agent_registry.create_agent("style_adaptation", client, model=model, api_type=api_provider)
-        if not agent:
-            st.error("创建Agent失败，请检查agent_registry")
-            return False
         
-        with st.spinner("正在生成个性化对话..."):
-            # 处理生成请求，传递所有需要的参数
-            result = agent.process(
-                dialogue_data=dialogue_data,
-                user_traits_chara=agent2_inputs["user_traits_chara"],
-                user_traits_address=agent2_inputs["user_traits_address"],
-                user_traits_custom=agent2_inputs["user_traits_custom"],
-                ai_traits_chara=agent2_inputs["ai_traits_chara"],
-                ai_traits_mantra=agent2_inputs["ai_traits_mantra"],
-                ai_traits_tone=agent2_inputs["ai_traits_tone"],
-                ai_emo=agent2_inputs["ai_emo"],
-                ai_emo_mode=agent2_inputs["ai_emo_mode"],
-                language=language,
-                user_traits=agent2_inputs["user_traits"],
-                ai_traits=agent2_inputs["ai_traits"]
-            )
-            
-            if result is None:
-                st.error("生成个性化对话失败，请重试")
-                return False
-                
-            # 检查是否是错误消息字符串
-            if isinstance(result, str) and ("API" in result and "失败" in result or "error" in result.lower()):
-                show_api_error(result)
-                return False
-                
-            # 存储结果
-            st.session_state.final_dialogue = result
-            st.session_state.final_dialogue_edited = False
-            
-            # 构建用户和AI特质数据对象，用于保存
-            user_traits_data = {
-                "user_traits_chara": agent2_inputs["user_traits_chara"],
-                "user_traits_address": agent2_inputs["user_traits_address"],
-                "user_traits_custom": agent2_inputs["user_traits_custom"],
-                "user_traits": agent2_inputs["user_traits"]
-            }
-            
-            ai_traits_data = {
-                "ai_traits_chara": agent2_inputs["ai_traits_chara"],
-                "ai_traits_mantra": agent2_inputs["ai_traits_mantra"],
-                "ai_traits_tone": agent2_inputs["ai_traits_tone"],
-                "ai_emo": agent2_inputs["ai_emo"],
-                "ai_emo_mode": agent2_inputs["ai_emo_mode"],
-                "ai_traits": agent2_inputs["ai_traits"]
+        payload = build_adaptation_payload(agent2_inputs)
+        payload.update({"dialogue_data": dialogue_data, "api_provider": api_provider})
+        
+        # 初始对话编辑过、角色特质和语言不变时，在当前最终对话上只改编修改过的行
+        last_adaptation = st.session_state.get("last_adaptation")
+        if (app_config.get_setting("incremental_adaptation", True) and last_adaptation
+                and st.session_state.get("final_dialogue")
+                and last_adaptation["signature"] == adaptation_signature(payload["traits"], payload["language"])
+                and last_adaptation["original_text"] != dialogue_data.get("original_text")):
+            payload["previous"] = {
+                "original_text": last_adaptation["original_text"],
+                "final_text": st.session_state.final_dialogue
             }
-            
-            # 保存最终对话
-            final_saved_paths = file_manager.save_final_dialogue(
-                result,
-                dialogue_data,
-                agent2_inputs["user_traits"],
-                agent2_inputs["ai_traits"],
-                user_traits_data,
-                ai_traits_data
-            )
-            
-            if final_saved_paths and final_saved_paths[0]:
-                st.session_state.final_saved_path = final_saved_paths
-                st.success(f"已将最终对话内容保存至:\n- JSON: {final_saved_paths[0]}\n- Markdown: {final_saved_paths[1]}")
-            
-            return True
+        submit_job(JOB_STYLE_ADAPTATION, payload)
+        return True
     except Exception as e:
         st.error(f"处理生成请求时出错: {str(e)}")
         logging.error(f"处理生成请求时出错: {str(e)}", exc_info=True)
         return False
 
+def apply_job_result(kind, job):
+    """将已结束的后台任务结果载入会话状态，并记录待显示的提示"""
+    notices = st.session_state.job_notices
+    if job is None:
+        notices.append(("error", f"{JOB_LABELS[kind]}任务不存在或已被清理"))
+        return
+    if job["status"] != JOB_DONE:
+        notices.append(("error", job["error"] or f"生成{JOB_LABELS[kind]}失败，请重试"))
+        return
+    
+    result = job["result"]
+    if kind == JOB_INITIAL_DIALOGUE:
+        # 编辑区的组件带有 key，需要清除旧值才能显示新生成的内容
+        for key in EDITOR_WIDGET_KEYS:
+            st.session_state.pop(key, None)
+        st.session_state.dialogue_data = result["dialogue_data"]
+        st.session_state.dialogue_edited = False
+        st.session_state.saved_path = tuple(result["saved_path"])
+        st.session_state.last_adaptation = None
+        source = "（来自预生成缓存）" if result.get("cached") else ""
+        notices.append(("success", f"已将结构化内容{source}保存至:\n- JSON: {result['saved_path'][0]}\n- Markdown: {result['saved_path'][1]}"))
+        if result.get("adaptation_error"):
+            notices.append(("error", result["adaptation_error"]))
+    
+    if "final_dialogue" in result:
+        st.session_state.pop("edit_final_dialogue", None)
+        st.session_state.final_dialogue = result["final_dialogue"]
+        st.session_state.final_dialogue_edited = False
+        st.session_state.final_saved_path = tuple(result["final_saved_path"])
+        # 记录本次改编使用的初始对话和特质，之后编辑初始对话时可以增量改编
+        adaptation = job["payload"] if kind == JOB_STYLE_ADAPTATION else job["payload"]["adaptation"]
+        adapted_data = adaptation["dialogue_data"] if kind == JOB_STYLE_ADAPTATION else result["dialogue_data"]
+        st.session_state.last_adaptation = {
+            "original_text": adapted_data.get("original_text"),
+            "signature": adaptation_signature(adaptation["traits"], adaptation.get("language"))
+        }
+        if result.get("final_cached"):
+            source = "（来自预生成缓存）"
+        elif result.get("restyled_lines") is not None:
+            source = f"（只改编了修改过的 {result['restyled_lines']} 行）"
+        else:
+            source = ""
+        notices.append(("success", f"已将最终对话内容{source}保存至:\n- JSON: {result['final_saved_path'][0]}\n- Markdown: {result['final_saved_path'][1]}"))
+
+def poll_pending_jobs():
+    """检查已提交的后台任务，载入已结束任务的结果；返回是否有任务结束"""
+    finished = False
+    for kind, job_id in list(st.session_state.pending_jobs.items()):
+        job = worker_pool.queue.get(job_id)
+        if job is not None and job["status"] not in FINISHED_STATUSES:
+            continue
+        del st.session_state.pending_jobs[kind]
+        apply_job_result(kind, job)
+        finished = True
+    return finished
+
+def render_job_notices():
+    """显示后台任务结束后的提示（只显示一次）"""
+    for level, message in st.session_state.job_notices:
+        if level == "success":
+            st.success(message)
+        else:
+            show_api_error(message)
+    st.session_state.job_notices = []
+
+@st.fragment(run_every=JOB_POLL_INTERVAL)
+def render_job_status():
+    """定时刷新后台任务进度；有任务结束时重新运行整个页面以显示结果"""
+    if poll_pending_jobs():
+        st.rerun()
+    for kind, job_id in st.session_state.pending_jobs.items():
+        job = worker_pool.queue.get(job_id)
+        if job["status"] == JOB_QUEUED:
+            position = worker_pool.queue.get_position(job_id) or 0
+            st.info(f"正在排队生成{JOB_LABELS[kind]}，前面还有 {position} 个任务...")
+        else:
+            elapsed = int(time.time() - (job["started_at"] or time.time()))
+            st.info(f"正在生成{JOB_LABELS[kind]}...（已用时 {elapsed} 秒）")
+
 def render_initial_dialogue_display():
     """渲染初始对话的显示界面"""
     if st.session_state.dialogue_data is None:
@@ -905,6 +1217,21 @@ def render_initial_dialogue_display():
                 st.subheader("戏剧性元素")
                 for element in dramatic_elements:
                     st.markdown(f"- {element}")
+    
+    # 在内存中渲染 Markdown 供下载，无需读取已保存的文件
+    timestamp = datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
+    st.download_button(
+        "下载初始对话 (Markdown)",
+        data=render_to_stream(render_initial_dialogue_markdown(
+            st.session_state.dialogue_data,
+            app_config.get_setting("context", ""),
+            app_config.get_setting("goal", ""),
+            timestamp
+        )),
+        file_name=f"dialogue_{timestamp}.md",
+        mime="text/markdown",
+        key="download_initial_dialogue"
+    )
 
 def render_final_dialogue_display():
     """渲染最终对话的显示界面"""
@@ -1026,6 +1353,144 @@ def render_final_dialogue_display():
                         st.session_state.final_saved_path = final_saved_paths
                         st.success(f"已将编辑后的最终对话内容保存至: {final_saved_paths[0]} 和 {final_saved_paths[1]}")
                 st.success("已更新最终对话内容")
+    
+    # 在内存中渲染 Markdown 供下载；已保存时使用保存的记录（元数据和详细特质），与保存的 Markdown 文件一致
+    record = None
+    if st.session_state.final_saved_path:
+        record = file_manager.load_dialogue(st.session_state.final_saved_path[0])
+    if record:
+        metadata = record.get("metadata") or {}
+        timestamp = metadata.get("timestamp") or datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
+        markdown = render_final_dialogue_markdown(
+            st.session_state.final_dialogue,
+            metadata.get("context", ""),
+            metadata.get("goal", ""),
+            timestamp,
+            record.get("user_traits", ""),
+            record.get("ai_traits", ""),
+            record.get("user_traits_data"),
+            record.get("ai_traits_data")
+        )
+    else:
+        timestamp = datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
+        markdown = render_final_dialogue_markdown(
+            st.session_state.final_dialogue,
+            app_config.get_setting("context", ""),
+            app_config.get_setting("goal", ""),
+            timestamp,
+            app_config.get_setting("user_traits", ""),
+            app_config.get_setting("ai_traits", "")
+        )
+    st.download_button(
+        "下载最终对话 (Markdown)",
+        data=render_to_stream(markdown),
+        file_name=f"final_dialogue_{timestamp}.md",
+        mime="text/markdown",
+        key="download_final_dialogue"
+    )
+
+def load_saved_dialogue(result):
+    """将已保存的对话载入会话状态，替换当前显示的对话"""
+    data = file_manager.load_dialogue(result["json_path"])
+    if data is None:
+        st.error(f"读取对话失败: {result['json_path']}")
+        return False
+    
+    # 编辑区的组件带有 key，需要清除旧值才能显示新载入的内容
+    for key in EDITOR_WIDGET_KEYS:
+        st.session_state.pop(key, None)
+    
+    if result["kind"] == "initial":
+        st.session_state.dialogue_data = data
+        st.session_state.saved_path = (result["json_path"], result["md_path"])
+        st.session_state.dialogue_edited = False
+        st.session_state.last_adaptation = None
+    else:
+        st.session_state.dialogue_data = data.get("original_dialogue")
+        st.session_state.saved_path = None
+        st.session_state.final_dialogue = data.get("final_text", "")
+        st.session_state.final_saved_path = (result["json_path"], result["md_path"])
+        st.session_state.final_dialogue_edited = False
+        st.session_state.last_adaptation = {
+            "original_text": (data.get("original_dialogue") or {}).get("original_text"),
+            "signature": adaptation_signature(
+                {**(data.get("user_traits_data") or {}), **(data.get("ai_traits_data") or {})},
+                (data.get("metadata") or {}).get("language")
+            )
+        }
+    return True
+
+def render_dialogue_browser():
+    """渲染已保存对话的分页浏览器（只读取索引中的元数据，选中后才读取完整对话）"""
+    with st.expander("浏览已保存的对话", expanded=False):
+        filter_cols = st.columns(3)
+        with filter_cols[0]:
+            kind = st.selectbox("对话类型", list(SEARCH_KINDS.keys()), key="browser_kind")
+        with filter_cols[1]:
+            difficulty = st.selectbox(
+                "难度", ["全部"] + file_manager.get_filter_options("difficulty"), key="browser_difficulty"
+            )
+        with filter_cols[2]:
+            language = st.selectbox(
+                "语言", ["全部"] + file_manager.get_filter_options("language"), key="browser_language"
+            )
+        
+        filters = {
+            "difficulty": difficulty if difficulty != "全部" else None,
+            "language": language if language != "全部" else None,
+        }
+        total = file_manager.count_dialogues(SEARCH_KINDS[kind], **filters)
+        if not total:
+            st.info("没有符合条件的对话")
+            return
+        
+        page_count = (total + BROWSER_PAGE_SIZE - 1) // BROWSER_PAGE_SIZE
+        page = st.number_input("页码", min_value=1, max_value=page_count, value=1, key="browser_page")
+        st.caption(f"共 {total} 条，第 {page}/{page_count} 页")
+        
+        results = file_manager.list_dialogues(
+            SEARCH_KINDS[kind], limit=BROWSER_PAGE_SIZE, offset=(page - 1) * BROWSER_PAGE_SIZE, **filters
+        )
+        for result in results:
+            row_cols = st.columns([5, 1])
+            with row_cols[0]:
+                kind_label = "初始对话" if result["kind"] == "initial" else "最终对话"
+                details = " · ".join(str(value) for value in (result["difficulty"], result["language"]) if value)
+                st.markdown(f"**{kind_label}** · {result['timestamp'] or ''} · {result['context'] or ''}")
+                st.caption(f"{result['goal'] or ''} {details}")
+            with row_cols[1]:
+                if st.button("载入", key=f"browser_load_{result['json_path']}"):
+                    if load_saved_dialogue(result):
+                        st.rerun()
+
+def render_search_panel():
+    """渲染已保存对话的全文搜索面板"""
+    with st.expander("搜索已保存的对话", expanded=False):
+        search_cols = st.columns([3, 1, 1])
+        with search_cols[0]:
+            query = st.text_input("搜索词", key="dialogue_search_query", placeholder="词汇、句型或对话内容")
+        with search_cols[1]:
+            scope = st.selectbox("搜索范围", list(SEARCH_SCOPES.keys()), key="dialogue_search_scope")
+        with search_cols[2]:
+            kind = st.selectbox("对话类型", list(SEARCH_KINDS.keys()), key="dialogue_search_kind")
+        
+        if not query.strip():
+            return
+        
+        start_time = time.perf_counter()
+        results = file_manager.search_dialogues(query, kind=SEARCH_KINDS[kind], field=SEARCH_SCOPES[scope])
+        elapsed_ms = (time.perf_counter() - start_time) * 1000
+        st.caption(f"找到 {len(results)} 条结果，耗时 {elapsed_ms:.1f} ms")
+        
+        for result in results:
+            kind_label = "初始对话" if result["kind"] == "initial" else "最终对话"
+            st.markdown(f"**{kind_label}** · {result['timestamp'] or ''} · {result['context'] or ''}")
+            if result.get("snippet"):
+                st.markdown(result["snippet"].replace("\n", " "))
+            st.caption(result["json_path"])
+            if st.button("载入", key=f"search_load_{result['json_path']}"):
+                if load_saved_dialogue(result):
+                    st.rerun()
 
 def main():
     # 标题
@@ -1053,7 +1518,7 @@ def main():
     
     # 生成初始对话按钮
     with col_buttons[0]:
-        if st.button("生成初始对话", type="primary"):
+        if st.button("生成初始对话", type="primary", disabled=JOB_INITIAL_DIALOGUE in st.session_state.pending_jobs):
             process_agent1_generation(agent1_inputs)
     
     # 生成最终对话按钮
@@ -1064,14 +1529,27 @@ def main():
         else:
             button_text = "生成最终对话"
             
-        if st.button(button_text, type="primary"):
+        if st.button(button_text, type="primary", disabled=JOB_STYLE_ADAPTATION in st.session_state.pending_jobs):
             process_agent2_generation(agent2_inputs)
     
+    # 提示模式下找到的相似对话
+    render_similar_match()
+    
+    # 载入已结束的后台任务结果，未结束的任务定时刷新进度
+    poll_pending_jobs()
+    render_job_notices()
+    if st.session_state.pending_jobs:
+        render_job_status()
+    
     # 显示初始对话内容
     render_initial_dialogue_display()
     
     # 显示最终对话内容
     render_final_dialogue_display()
+    
+    # 浏览和搜索已保存的对话
+    render_dialogue_browser()
+    render_search_panel()
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,318 @@
+# -*- coding: utf-8 -*- # Ensure UTF-8 encoding for wider character support
+
+"""
+对话生成 HTTP 服务（无界面，ASGI）
+
+接口:
+    GET  /health    服务状态和缓存统计
+    POST /generate  Agent 1 生成初始对话，请求体为生成参数（context、goal、language 等），可选 model、save
+    POST /adapt     Agent 2 改编对话风格，请求体为 {"dialogue": ..., "traits": {...}, "language": ..., "model": ...}
+    POST /batch     完整执行多条任务（生成 + 改编 + 保存），请求体为 {"items": [...], "models": {...}}
+
+所有请求共用同一个 API 客户端（OpenRouter 使用带连接池的会话）、响应缓存和限流器；
+阻塞的 LLM 调用在有上限的线程池中执行，不阻塞事件循环。
+
+配置（环境变量）:
+    DIALOGUE_API_PROVIDER     "openai"（默认）或 "openrouter"
+    DIALOGUE_MODEL            默认模型，默认 o3-mini
+    OPENROUTER_API_KEY        OpenRouter API 密钥
+    DIALOGUE_RATE_LIMIT       每秒最多发起的 LLM 请求数，默认 2
+    DIALOGUE_MAX_CONCURRENCY  同时执行的 LLM 任务数，默认 8
+    DIALOGUE_CACHE_SIZE       内存中的响应缓存条目数，默认 1024
+    DIALOGUE_CACHE_PATH       持久化响应缓存路径（与预热任务 warmup_cache.py 共用），默认 response_cache.db
+    DIALOGUE_CACHE_TTL        新写入的缓存条目的过期时间（秒），默认不过期
+    DIALOGUE_INDEX_PATH       对话索引数据库路径，默认 dialogue_store.db
+    DIALOGUE_PROFILES_PATH    模型性能档案路径，默认 model_profiles.db
+
+用法:
+    uvicorn service:app --host 0.0.0.0 --port 8000
+"""
+
+import os
+import json
+import time
+import asyncio
+import logging
+import functools
+from concurrent.futures import ThreadPoolExecutor
+from dotenv import load_dotenv
+
+from agents.pipeline import (
+    create_api_client, create_agent, generate_initial_dialogue, adapt_dialogue,
+    check_initial_dialogue, check_final_dialogue, get_cached_result,
+    get_generation_params, generation_metadata, initial_cache_key, adaptation_cache_key, run_dialogue_pair
+)
+from utils.file_manager import FileManager
+from utils.rate_limiter import RateLimiter
+from utils.response_cache import ResponseCache
+from utils.model_profiler import model_profiles
+
+
+MAX_BODY_SIZE = 10 * 1024 * 1024
+# 服务初始化失败后，间隔多久（秒）才在下一个请求时重新初始化
+INIT_RETRY_INTERVAL = 30
+
+
+class ServiceState:
+    """服务共享的客户端、线程池、缓存和限流器（在 lifespan startup 时创建）"""
+    def __init__(self):
+        load_dotenv()
+        self.api_provider = os.getenv("DIALOGUE_API_PROVIDER", "openai")
+        self.default_model = os.getenv("DIALOGUE_MODEL", "o3-mini")
+        self.max_concurrency = int(os.getenv("DIALOGUE_MAX_CONCURRENCY", "8"))
+        self.client = create_api_client(
+            self.api_provider,
+            os.getenv("OPENROUTER_API_KEY", ""),
+            pool_size=self.max_concurrency
+        )
+        if self.client is None:
+            raise RuntimeError(f"创建API客户端失败: {self.api_provider}")
+        self.executor = ThreadPoolExecutor(max_workers=self.max_concurrency, thread_name_prefix="dialogue-llm")
+        self.rate_limiter = RateLimiter(float(os.getenv("DIALOGUE_RATE_LIMIT", "2")))
+        self.cache = ResponseCache(
+            max_entries=int(os.getenv("DIALOGUE_CACHE_SIZE", "1024")),
+            ttl=float(os.getenv("DIALOGUE_CACHE_TTL", "0")) or None,
+            path=os.getenv("DIALOGUE_CACHE_PATH", "response_cache.db")
+        )
+        model_profiles.configure(os.getenv("DIALOGUE_PROFILES_PATH", "model_profiles.db"))
+        self.file_manager = FileManager(
+            write_behind=True,
+            index_path=os.getenv("DIALOGUE_INDEX_PATH", "dialogue_store.db")
+        )
+
+    async def run_blocking(self, func, *args, **kwargs):
+        """在线程池中执行阻塞调用"""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.executor, functools.partial(func, *args, **kwargs))
+
+    def create_agent(self, agent_type, model=None):
+        """创建使用共享客户端和限流器的 Agent"""
+        return create_agent(agent_type, self.client, self.api_provider, model or self.default_model,
+                            rate_limiter=self.rate_limiter)
+
+    def close(self):
+        """等待进行中的任务和待写入的文件完成"""
+        self.executor.shutdown(wait=True)
+        self.file_manager.flush()
+        model_profiles.flush()
+
+
+class HTTPError(Exception):
+    """带状态码的请求错误"""
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+        self.message = message
+
+
+async def handle_health(state, body):
+    return {"status": "ok", "api_provider": state.api_provider, "cache": state.cache.get_stats()}
+
+
+async def _run_checked(state, check, func, *args):
+    """
+    执行生成任务并检查结果，只有检查通过的结果才能写入缓存
+
+    Raises:
+        HTTPError: 生成失败或结果无效（502）
+    """
+    try:
+        return check(await state.run_blocking(func, *args))
+    except (HTTPError, ValueError):
+        raise
+    except Exception as e:
+        logging.warning(f"生成失败: {str(e)}")
+        raise HTTPError(502, str(e))
+
+
+async def handle_generate(state, body):
+    """生成初始对话；相同参数和模型的请求直接返回缓存结果"""
+    params = get_generation_params(body)
+    model = body.get("model") or state.default_model
+    cache_key = initial_cache_key(params, model)
+
+    dialogue_data = get_cached_result(state.cache, cache_key, check_initial_dialogue)
+    cached = dialogue_data is not None
+    if not cached:
+        agent = state.create_agent("initial_dialogue", model)
+        dialogue_data = await _run_checked(state, check_initial_dialogue, generate_initial_dialogue, agent, params)
+        state.cache.set(cache_key, dialogue_data)
+
+    response = {"dialogue": dialogue_data, "cached": cached}
+    if body.get("save"):
+        json_path, md_path = await state.run_blocking(
+            state.file_manager.save_initial_dialogue,
+            dialogue_data, params["context"], params["goal"],
+            extra_metadata=generation_metadata(params, model)
+        )
+        if not json_path:
+            raise RuntimeError("保存初始对话失败")
+        response.update({"json_path": json_path, "md_path": md_path})
+    return response
+
+
+async def handle_adapt(state, body):
+    """改编对话风格；相同输入的请求直接返回缓存结果"""
+    dialogue_data = body.get("dialogue")
+    if not isinstance(dialogue_data, dict):
+        raise ValueError("缺少初始对话数据 dialogue")
+    traits = body.get("traits") or {}
+    language = body.get("language") or dialogue_data.get("metadata", {}).get("language")
+    model = body.get("model") or state.default_model
+    cache_key = adaptation_cache_key(dialogue_data, traits, language, model)
+
+    final_text = get_cached_result(state.cache, cache_key, check_final_dialogue)
+    cached = final_text is not None
+    if not cached:
+        agent = state.create_agent("style_adaptation", model)
+        final_text = await _run_checked(state, check_final_dialogue, adapt_dialogue, agent, dialogue_data, traits, language)
+        state.cache.set(cache_key, final_text)
+    return {"final_dialogue": final_text, "cached": cached}
+
+
+async def handle_batch(state, body):
+    """并发执行多条完整任务，单条失败不影响其他任务"""
+    items = body.get("items")
+    if not isinstance(items, list) or not items:
+        raise ValueError("items 必须是非空的任务列表")
+    models = {
+        "initial_dialogue": state.default_model,
+        "style_adaptation": state.default_model,
+        **(body.get("models") or {})
+    }
+
+    async def run_item(item):
+        try:
+            result = await state.run_blocking(
+                run_dialogue_pair, item, state.client, state.api_provider, models, state.file_manager,
+                rate_limiter=state.rate_limiter
+            )
+            return {"status": "done", "initial_path": result["initial_path"], "final_path": result["final_path"]}
+        except Exception as e:
+            return {"status": "failed", "error": str(e)}
+
+    results = await asyncio.gather(*(run_item(item) for item in items))
+    return {"results": results, "failed": sum(1 for result in results if result["status"] == "failed")}
+
+
+ROUTES = {
+    ("GET", "/health"): handle_health,
+    ("POST", "/generate"): handle_generate,
+    ("POST", "/adapt"): handle_adapt,
+    ("POST", "/batch"): handle_batch,
+}
+
+
+async def _read_json_body(receive):
+    """读取并解析请求体"""
+    chunks = []
+    size = 0
+    while True:
+        message = await receive()
+        chunk = message.get("body", b"")
+        size += len(chunk)
+        if size > MAX_BODY_SIZE:
+            raise HTTPError(413, "请求体过大")
+        chunks.append(chunk)
+        if not message.get("more_body"):
+            break
+    raw = b"".join(chunks)
+    if not raw:
+        return {}
+    try:
+        body = json.loads(raw)
+    except (json.JSONDecodeError, UnicodeDecodeError):
+        raise HTTPError(400, "请求体不是有效的 JSON")
+    if not isinstance(body, dict):
+        raise HTTPError(400, "请求体必须是 JSON 对象")
+    return body
+
+
+async def _send_json(send, status, payload):
+    """发送 JSON 响应"""
+    content = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+    await send({
+        "type": "http.response.start",
+        "status": status,
+        "headers": [
+            (b"content-type", b"application/json; charset=utf-8"),
+            (b"content-length", str(len(content)).encode("ascii")),
+        ],
+    })
+    await send({"type": "http.response.body", "body": content})
+
+
+class DialogueService:
+    """ASGI 应用"""
+    def __init__(self):
+        self.state = None
+        self._init_error = None
+        self._init_failed_at = 0.0
+
+    def _ensure_state(self):
+        """
+        服务器未发送 lifespan 事件时在请求中初始化；失败后 INIT_RETRY_INTERVAL 秒内直接返回上次的错误
+
+        Raises:
+            HTTPError: 初始化失败（503）
+        """
+        if self.state is not None:
+            return
+        if self._init_error and time.time() - self._init_failed_at < INIT_RETRY_INTERVAL:
+            raise HTTPError(503, self._init_error)
+        try:
+            self.state = ServiceState()
+            self._init_error = None
+        except Exception as e:
+            logging.error(f"服务初始化失败: {str(e)}")
+            self._init_error = f"服务初始化失败: {str(e)}"
+            self._init_failed_at = time.time()
+            raise HTTPError(503, self._init_error)
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "lifespan":
+            await self._lifespan(receive, send)
+        elif scope["type"] == "http":
+            await self._handle_http(scope, receive, send)
+
+    async def _lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message["type"] == "lifespan.startup":
+                try:
+                    self.state = ServiceState()
+                except Exception as e:
+                    logging.error(f"服务启动失败: {str(e)}")
+                    await send({"type": "lifespan.startup.failed", "message": str(e)})
+                    return
+                await send({"type": "lifespan.startup.complete"})
+            elif message["type"] == "lifespan.shutdown":
+                if self.state:
+                    await asyncio.get_running_loop().run_in_executor(None, self.state.close)
+                await send({"type": "lifespan.shutdown.complete"})
+                return
+
+    async def _handle_http(self, scope, receive, send):
+        handler = ROUTES.get((scope["method"], scope["path"]))
+        try:
+            self._ensure_state()
+            if handler is None:
+                if any(path == scope["path"] for _, path in ROUTES):
+                    raise HTTPError(405, "不支持的请求方法")
+                raise HTTPError(404, "接口不存在")
+            body = await _read_json_body(receive)
+            payload = await handler(self.state, body)
+            status = 200
+        except HTTPError as e:
+            status, payload = e.status, {"error": e.message}
+        except ValueError as e:
+            status, payload = 400, {"error": str(e)}
+        except RuntimeError as e:
+            status, payload = 502, {"error": str(e)}
+        except Exception as e:
+            logging.exception("处理请求失败")
+            status, payload = 500, {"error": str(e)}
+        await _send_json(send, status, payload)
+
+
+app = DialogueService()
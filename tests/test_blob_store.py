@@ -0,0 +1,65 @@
+# -*- coding: utf-8 -*- # Ensure UTF-8 encoding for wider character support
+
+import os
+
+from utils.blob_store import BlobStore, content_hash
+
+
+class _Handle:
+    """后台写入句柄替身"""
+    def __init__(self, error=None, done=True):
+        self.error = error
+        self._done = done
+
+    def done(self):
+        return self._done
+
+
+class _FlakyWriter:
+    """第一次写入在后台失败、之后正常写入的写入函数"""
+    def __init__(self):
+        self.calls = 0
+
+    def __call__(self, path, text):
+        self.calls += 1
+        if self.calls == 1:
+            return _Handle(error=OSError("disk full"))
+        with open(path, 'w', encoding='utf-8') as f:
+            f.write(text)
+        return _Handle()
+
+
+def test_put_is_content_addressed_and_writes_once(tmp_path):
+    store = BlobStore(str(tmp_path))
+    data = {"original_text": "A: Hi", "key_points": ["x"]}
+
+    digest = store.put(data)
+    assert digest == content_hash({"key_points": ["x"], "original_text": "A: Hi"})
+    mtime = os.path.getmtime(store._path_for(digest))
+    assert store.put(dict(data)) == digest
+    assert os.path.getmtime(store._path_for(digest)) == mtime
+
+    fresh = BlobStore(str(tmp_path))
+    assert fresh.get(digest) == data
+
+
+def test_failed_background_write_is_retried_on_next_put(tmp_path):
+    writer = _FlakyWriter()
+    store = BlobStore(str(tmp_path), write_text=writer)
+    data = {"original_text": "A: Hi"}
+
+    digest = store.put(data)
+    assert not os.path.exists(store._path_for(digest))
+
+    store.put(data)
+    assert writer.calls == 2
+    assert BlobStore(str(tmp_path)).get(digest) == data
+
+
+def test_pending_background_write_is_not_repeated(tmp_path):
+    calls = []
+    store = BlobStore(str(tmp_path), write_text=lambda path, text: calls.append(path) or _Handle(done=False))
+
+    store.put({"a": 1})
+    store.put({"a": 1})
+    assert len(calls) == 1
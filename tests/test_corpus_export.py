@@ -0,0 +1,58 @@
+# -*- coding: utf-8 -*- # Ensure UTF-8 encoding for wider character support
+
+import os
+
+import pytest
+
+from utils.corpus_export import CorpusExporter, iter_jsonl_corpus, read_columnar_corpus
+from utils.file_manager import FileManager
+
+
+def _dialogue(text):
+    return {"original_text": text, "key_points": ["k"], "key_vocabulary": ["v"]}
+
+
+@pytest.fixture
+def file_manager(tmp_path):
+    return FileManager(base_dir=str(tmp_path), index_path="dialogue_store.db")
+
+
+def test_requires_index(tmp_path):
+    with pytest.raises(ValueError):
+        CorpusExporter(FileManager(base_dir=str(tmp_path)))
+
+
+def test_export_is_incremental(file_manager, tmp_path):
+    output_dir = str(tmp_path / "export")
+    exporter = CorpusExporter(file_manager, output_dir, batch_size=1)
+    first, _ = file_manager.save_initial_dialogue(_dialogue("A: one"), "咖啡馆", "点单")
+    file_manager.save_initial_dialogue(_dialogue("A: two"), "机场", "值机")
+
+    assert exporter.export() == 2
+    assert exporter.export() == 0
+
+    file_manager.update_initial_dialogue(first, _dialogue("A: one, edited"), "咖啡馆", "点单")
+    file_manager.save_initial_dialogue(_dialogue("A: three"), "酒店", "入住")
+    assert exporter.export() == 2
+
+    parts = sorted(name for name in os.listdir(output_dir) if name.startswith("part-"))
+    assert parts == ["part-00000.jsonl.gz", "part-00001.jsonl.gz"]
+    rows = list(iter_jsonl_corpus(output_dir))
+    assert [row["original_text"] for row in rows] == ["A: one", "A: two", "A: one, edited", "A: three"]
+    assert rows[0]["json_path"] == rows[2]["json_path"] == first
+    assert rows[0]["context"] == "咖啡馆" and rows[0]["key_vocabulary"] == ["v"]
+    assert rows[0]["final_text"] is None
+
+
+def test_columnar_export_keeps_latest_version(file_manager, tmp_path):
+    pytest.importorskip("pyarrow")
+    output_dir = str(tmp_path / "export")
+    exporter = CorpusExporter(file_manager, output_dir)
+    first, _ = file_manager.save_initial_dialogue(_dialogue("A: one"), "咖啡馆", "点单")
+    exporter.export("arrow")
+    file_manager.update_initial_dialogue(first, _dialogue("A: one, edited"), "咖啡馆", "点单")
+    exporter.export("arrow")
+
+    table = read_columnar_corpus(output_dir, "arrow", columns=["original_text"])
+    assert table.column("original_text").to_pylist() == ["A: one, edited"]
+    assert read_columnar_corpus(output_dir, "arrow", latest_only=False).num_rows == 2
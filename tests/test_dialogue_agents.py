@@ -0,0 +1,85 @@
+# -*- coding: utf-8 -*- # Ensure UTF-8 encoding for wider character support
+
+import copy
+
+import pytest
+
+pytest.importorskip("openai")
+pytest.importorskip("requests")
+
+from agents.dialogue_agents import InitialDialogueAgent
+
+
+class _FailingCompletions:
+    def create(self, **kwargs):
+        raise RuntimeError("connection reset")
+
+
+class _FailingClient:
+    """chat.completions.create 总是抛出异常的 OpenAI 客户端"""
+    def __init__(self):
+        self.chat = type("Chat", (), {"completions": _FailingCompletions()})()
+
+
+DIALOGUE = {
+    "original_text": "A: Hi, is this seat free?\nB: Yes, please sit down.",
+    "key_points": ["问座位"],
+    "intentions": [],
+    "key_vocabulary": [],
+    "dramatic_elements": [],
+}
+
+
+def test_extend_dialogue_keeps_text_when_api_call_fails():
+    agent = InitialDialogueAgent(_FailingClient())
+    dialogue_data = copy.deepcopy(DIALOGUE)
+
+    assert agent._extend_dialogue(dialogue_data, "用户先说", 2, "咖啡馆", "找座位") is None
+    assert agent.last_call_failed
+    assert dialogue_data["original_text"] == DIALOGUE["original_text"]
+
+
+def test_extend_dialogue_keeps_text_when_prompt_is_over_budget():
+    agent = InitialDialogueAgent(_FailingClient())
+    agent.context_length = 16
+    dialogue_data = copy.deepcopy(DIALOGUE)
+
+    assert agent._extend_dialogue(dialogue_data, "用户先说", 2, "咖啡馆", "找座位") is None
+    assert agent.last_call_failed
+    assert dialogue_data["original_text"] == DIALOGUE["original_text"]
+
+
+class _ScriptedAgent(InitialDialogueAgent):
+    """按顺序返回预设响应的 Agent，None 表示一次失败的调用"""
+    def __init__(self, responses):
+        super().__init__(client=None)
+        self.responses = list(responses)
+
+    def call_llm_api(self, prompt, tools=None):
+        response = self.responses.pop(0) if self.responses else None
+        self.last_call_failed = response is None
+        return response if response is not None else "API 调用失败: 测试"
+
+
+def _long_dialogue(agent, num_turns=2):
+    return list(agent.generate_long_dialogue("咖啡馆", "用户先说", "找座位", "英文", "B1", num_turns,
+                                             chapter_turns=num_turns, batch_size=num_turns))
+
+
+def test_long_dialogue_first_batch_accepts_plain_text():
+    chapters = _long_dialogue(_ScriptedAgent(["A: Hi\nB: Hello\nA: Is this free?\nB: Yes"]))
+    assert [chapter["text"] for chapter in chapters] == ["A: Hi\nB: Hello\nA: Is this free?\nB: Yes"]
+
+
+def test_long_dialogue_first_batch_ignores_non_object_json():
+    agent = _ScriptedAgent([
+        '["not", "a", "dialogue"]',
+        '{"original_text": "A: Hi\\nB: Hello\\nA: Sit?\\nB: Sure", "key_vocabulary": "seat"}',
+    ])
+    chapters = _long_dialogue(agent)
+    assert chapters[0]["text"] == "A: Hi\nB: Hello\nA: Sit?\nB: Sure"
+
+
+def test_long_dialogue_skips_failed_calls():
+    chapters = _long_dialogue(_ScriptedAgent([None, "A: Hi\nB: Hello\nA: Sit?\nB: Sure"]))
+    assert "API 调用失败" not in chapters[0]["text"]
@@ -0,0 +1,60 @@
+# -*- coding: utf-8 -*- # Ensure UTF-8 encoding for wider character support
+
+from utils.dialogue_diff import changed_targets, plan_incremental_update, splice_adaptation
+
+
+ORIGINAL = "A: Hi.\nB: Hello.\n\nA: How are you?\nB: Fine."
+FINAL = "Round 1\nA: Hey!\nB: Hiya.\n\nA: How's it going?\nB: Great."
+
+
+def _restyle(plan, text="X"):
+    """把每个需要改写的行替换为 "<说话者>: X<位置>" """
+    return {target["id"]: f"{target['speaker']}: {text}{target['id']}" for target in changed_targets(plan)}
+
+
+def test_unchanged_dialogue_keeps_final_text():
+    plan = plan_incremental_update(ORIGINAL, ORIGINAL, FINAL)
+    assert plan["changed"] == 0
+    assert splice_adaptation(plan, {}) == FINAL
+
+
+def test_whitespace_only_edits_are_not_changes():
+    edited = "A:  Hi.\nB:Hello. \n\nA : How   are you?\nB: Fine."
+    assert plan_incremental_update(ORIGINAL, edited, FINAL)["changed"] == 0
+
+
+def test_modified_line_is_rewritten_and_keeps_its_trailing_lines():
+    edited = "A: Hi.\nB: Good morning.\n\nA: How are you?\nB: Fine."
+    plan = plan_incremental_update(ORIGINAL, edited, FINAL)
+    assert plan["changed"] == 1
+    targets = changed_targets(plan, context_lines=1)
+    assert targets == [{"id": 1, "speaker": "B", "original": "B: Good morning.",
+                        "before": ["A: Hey!"], "after": ["A: How's it going?"]}]
+    assert splice_adaptation(plan, _restyle(plan)) == "Round 1\nA: Hey!\nB: X1\n\nA: How's it going?\nB: Great."
+
+
+def test_inserted_line_goes_before_the_previous_lines_trailing_block():
+    edited = "A: Hi.\nB: Hello.\nA: Nice day.\n\nA: How are you?\nB: Fine."
+    plan = plan_incremental_update(ORIGINAL, edited, FINAL)
+    assert plan["changed"] == 1
+    assert splice_adaptation(plan, _restyle(plan)) == (
+        "Round 1\nA: Hey!\nB: Hiya.\nA: X2\n\nA: How's it going?\nB: Great."
+    )
+
+
+def test_deleted_line_is_dropped_from_final():
+    edited = "A: Hi.\nB: Hello.\n\nA: How are you?"
+    plan = plan_incremental_update(ORIGINAL, edited, FINAL)
+    assert plan["changed"] == 0
+    assert splice_adaptation(plan, {}) == "Round 1\nA: Hey!\nB: Hiya.\n\nA: How's it going?"
+
+
+def test_falls_back_when_final_does_not_line_up_or_too_much_changed():
+    # 最终对话的说话者序列与上次的初始对话不一致
+    assert plan_incremental_update(ORIGINAL, ORIGINAL, "A: Hey!\nB: Hiya.") is None
+    # 修改超过一半
+    edited = "A: One.\nB: Two.\n\nA: Three.\nB: Fine."
+    assert plan_incremental_update(ORIGINAL, edited, FINAL) is None
+    assert plan_incremental_update(ORIGINAL, edited, FINAL, max_changed_ratio=1.0)["changed"] == 3
+    # 编辑后没有对话行
+    assert plan_incremental_update(ORIGINAL, "just narration", FINAL) is None
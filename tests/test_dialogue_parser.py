@@ -0,0 +1,70 @@
+# -*- coding: utf-8 -*- # Ensure UTF-8 encoding for wider character support
+
+import os
+
+import pytest
+
+from utils.dialogue_parser import (
+    DialogueLineParser, parse_dialogue, parse_line, speaker_sequence, split_speaker_line, strip_speaker,
+    update_generated_block
+)
+
+
+PLAYER_HTML = os.path.join(os.path.dirname(os.path.dirname(__file__)), "dialog-player.html")
+
+
+@pytest.mark.parametrize("line, speaker, text", [
+    ("A: Hello there", "A", "Hello there"),
+    ("B：你好", "B", "你好"),
+    ("  A :  spaced out  ", "A", "spaced out"),
+])
+def test_parse_line_requires_speaker_and_colon(line, speaker, text):
+    turn = parse_line(line)
+    assert (turn["speaker"], turn["text"]) == (speaker, text)
+
+
+@pytest.mark.parametrize("line", [
+    "A man walks in.",
+    "B is for banana",
+    "Alice: hi",
+    "第一轮",
+    "",
+])
+def test_narration_is_not_a_dialogue_line(line):
+    assert parse_line(line) is None
+    assert strip_speaker(line) == line
+
+
+@pytest.mark.parametrize("line, speaker, text, actions", [
+    ("B (smiling): hey", "B", "hey", ["smiling"]),
+    ("A（微笑）：你好", "A", "你好", ["微笑"]),
+    ("B [laughs] : no way (shakes head)", "B", "no way", ["laughs", "shakes head"]),
+    ("A: Hi *waves* there", "A", "Hi there", ["waves"]),
+])
+def test_stage_directions_are_moved_into_actions(line, speaker, text, actions):
+    turn = parse_line(line)
+    assert (turn["speaker"], turn["text"], turn["actions"]) == (speaker, text, actions)
+
+
+def test_direction_before_colon_stays_with_the_line_body():
+    assert split_speaker_line("B (smiling): hey") == ("B", "(smiling) hey")
+    assert strip_speaker("A: A good idea") == "A good idea"
+
+
+def test_incremental_parser_matches_whole_text():
+    text = "Round 1\nA: Hi (waves)\nB (nods): Hello\n\nA man walks in.\nA: Bye"
+    parser = DialogueLineParser()
+    turns = []
+    for index in range(0, len(text), 4):
+        turns.extend(parser.feed(text[index:index + 4]))
+    turns.extend(parser.close())
+
+    assert turns == parse_dialogue(text)
+    assert [turn["index"] for turn in turns] == [0, 1, 2]
+    assert speaker_sequence(text) == ["A", "B", "A"]
+
+
+def test_player_javascript_is_up_to_date():
+    with open(PLAYER_HTML, 'r', encoding='utf-8') as f:
+        html = f.read()
+    assert update_generated_block(html) == html
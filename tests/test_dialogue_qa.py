@@ -0,0 +1,59 @@
+# -*- coding: utf-8 -*- # Ensure UTF-8 encoding for wider character support
+
+import pytest
+
+from utils import dialogue_qa
+
+
+def _record(text, vocabulary=(), mantra=(), num_turns=None, dialogue_mode="AI先说", difficulty="B1"):
+    return {
+        "json_path": "d.json",
+        "kind": "final",
+        "text": text,
+        "turns": None,
+        "dialogue_mode": dialogue_mode,
+        "num_turns": num_turns,
+        "difficulty": difficulty,
+        "language": "英语",
+        "vocabulary": list(vocabulary),
+        "mantra": list(mantra),
+    }
+
+
+def _plain(features):
+    """把特征统一转为 Python 列表，便于比较两种实现"""
+    return {key: [float(value) for value in values] for key, values in features.items()}
+
+
+def test_vocabulary_matches_whole_words_like_coverage_check():
+    # 子串不算命中；词形变化（makes -> make）算命中，与 CoverageChecker 一致
+    record = _record("B: This category is new.\nA: She makes tea.", vocabulary=["cat", "make", "tea"])
+    result = dialogue_qa.validate_batch([record])[0]
+    assert result["vocabulary_coverage"] == round(2 / 3, 3)
+    assert result["checks"]["vocabulary"] is False
+    assert result["missing_vocabulary"] == ["cat"]
+
+
+def test_mantra_matches_whole_phrase():
+    hit = _record("B: Well, you know, it works.\nA: OK.", mantra=["you know"])
+    miss = _record("B: Do you knowledge it?\nA: OK.", mantra=["you know"])
+    results = dialogue_qa.validate_batch([hit, miss])
+    assert [result["checks"]["mantra"] for result in results] == [True, False]
+
+
+def test_numpy_and_pure_python_features_agree(monkeypatch):
+    pytest.importorskip("numpy")
+    records = [
+        _record("B: Hi there.\nA: Hello, how are you?\nB: Fine.\nA: Good.", vocabulary=["hello", "cat"],
+                mantra=["fine"], num_turns=2),
+        _record(""),
+        _record("A: I start.\nB: Then me.\nB: Again.", dialogue_mode="用户先说", num_turns=1),
+        _record("旁白没有说话者", vocabulary=["说话"]),
+    ]
+    columns = dialogue_qa.tokenize_batch(records)
+    with_numpy = _plain(dialogue_qa.compute_features(columns, len(records)))
+    expected = dialogue_qa.validate_batch(records)
+
+    monkeypatch.setattr(dialogue_qa, "np", None)
+    assert _plain(dialogue_qa.compute_features(columns, len(records))) == with_numpy
+    assert dialogue_qa.validate_batch(records) == expected
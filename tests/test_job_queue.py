@@ -0,0 +1,87 @@
+# -*- coding: utf-8 -*- # Ensure UTF-8 encoding for wider character support
+
+import sqlite3
+import subprocess
+import sys
+
+import pytest
+
+from utils.job_queue import JobQueue, JOB_QUEUED, JOB_RUNNING, JOB_DONE, JOB_FAILED
+
+
+@pytest.fixture
+def db_path(tmp_path):
+    return str(tmp_path / "jobs.db")
+
+
+def _exited_pid():
+    """一个已经退出的进程号"""
+    process = subprocess.Popen([sys.executable, "-c", "pass"])
+    process.wait()
+    return process.pid
+
+
+def test_claim_is_fifo_and_never_returns_a_job_twice(db_path):
+    queue = JobQueue(db_path)
+    first = queue.submit("initial_dialogue", {"n": 1})
+    second = queue.submit("initial_dialogue", {"n": 2})
+
+    claimed = [queue.claim(), queue.claim(), queue.claim()]
+
+    assert [job["id"] for job in claimed[:2]] == [first, second]
+    assert claimed[2] is None
+    assert claimed[0]["status"] == JOB_RUNNING and claimed[0]["attempts"] == 1
+    assert claimed[0]["payload"] == {"n": 1}
+
+    queue.complete(first, {"ok": True})
+    assert queue.get(first)["status"] == JOB_DONE
+    assert queue.get(first)["result"] == {"ok": True}
+
+
+def test_recover_stale_requeues_then_fails_after_max_attempts(db_path):
+    queue = JobQueue(db_path)
+    job_id = queue.submit("initial_dialogue", {})
+
+    queue.claim()
+    assert queue.recover_stale(timeout=3600) == 0
+    assert queue.recover_stale(timeout=-1, max_attempts=2) == 1
+    assert queue.get(job_id)["status"] == JOB_QUEUED
+
+    queue.claim()
+    assert queue.recover_stale(timeout=-1, max_attempts=2) == 1
+    job = queue.get(job_id)
+    assert job["status"] == JOB_FAILED and job["error"]
+
+
+def test_recover_orphaned_requeues_jobs_of_exited_local_processes(db_path):
+    dead = JobQueue(db_path, worker_id=f"{JobQueue(db_path).worker_id.rpartition(':')[0]}:{_exited_pid()}")
+    orphan = dead.submit("initial_dialogue", {})
+    dead.claim()
+
+    remote = JobQueue(db_path, worker_id="other-host:1")
+    remote_job = remote.submit("initial_dialogue", {})
+    remote.claim()
+
+    current = JobQueue(db_path)
+    own_job = current.submit("initial_dialogue", {})
+    current.claim()
+
+    assert current.recover_orphaned() == 1
+    assert current.get(orphan)["status"] == JOB_QUEUED
+    assert current.get(remote_job)["status"] == JOB_RUNNING
+    assert current.get(own_job)["status"] == JOB_RUNNING
+
+
+def test_old_database_gets_worker_column(db_path):
+    conn = sqlite3.connect(db_path)
+    conn.execute(
+        "CREATE TABLE jobs (id TEXT PRIMARY KEY, kind TEXT NOT NULL, status TEXT NOT NULL, payload TEXT NOT NULL, "
+        "result TEXT, error TEXT, attempts INTEGER NOT NULL DEFAULT 0, created_at REAL NOT NULL, "
+        "started_at REAL, finished_at REAL)"
+    )
+    conn.commit()
+    conn.close()
+
+    queue = JobQueue(db_path)
+    queue.submit("initial_dialogue", {})
+    assert queue.claim()["worker"] == queue.worker_id
@@ -0,0 +1,110 @@
+# -*- coding: utf-8 -*- # Ensure UTF-8 encoding for wider character support
+
+import pytest
+
+pytest.importorskip("openai")
+pytest.importorskip("requests")
+
+from agents import pipeline
+
+
+class _CatalogResponse:
+    def __init__(self, data):
+        self._data = data
+
+    def raise_for_status(self):
+        pass
+
+    def json(self):
+        return {"data": self._data}
+
+
+class _CatalogSession:
+    """返回固定模型目录的 requests.Session 替身，记录请求次数"""
+    def __init__(self, data=None, error=None):
+        self.data = data or []
+        self.error = error
+        self.calls = 0
+
+    def get(self, url, headers=None, timeout=None):
+        self.calls += 1
+        if self.error:
+            raise self.error
+        return _CatalogResponse(self.data)
+
+
+@pytest.fixture(autouse=True)
+def reset_catalog(monkeypatch):
+    monkeypatch.setattr(pipeline, "_openrouter_context_lengths", None)
+    monkeypatch.setattr(pipeline, "_catalog_failed_at", 0.0)
+
+
+def test_create_agent_resolves_openai_context_length():
+    agent = pipeline.create_agent("initial_dialogue", object(), "openai", "o3-mini")
+    assert agent.context_length == pipeline.OPENAI_CONTEXT_LENGTHS["o3-mini"]
+    assert agent.get_prompt_token_budget() is not None
+
+
+def test_create_agent_keeps_explicit_context_length():
+    agent = pipeline.create_agent("initial_dialogue", object(), "openai", "o3-mini", context_length=8000)
+    assert agent.context_length == 8000
+
+
+def test_create_agent_resolves_openrouter_context_length_once():
+    session = _CatalogSession([{"id": "vendor/small", "context_length": 4096}, {"id": "vendor/bad"}])
+    client = {"api_key": "key", "session": session}
+
+    first = pipeline.create_agent("initial_dialogue", client, "openrouter", "vendor/small")
+    second = pipeline.create_agent("style_adaptation", client, "openrouter", "vendor/bad")
+
+    assert first.context_length == 4096
+    assert second.context_length is None
+    assert session.calls == 1
+
+
+def test_openrouter_catalog_failure_is_not_retried_immediately():
+    session = _CatalogSession(error=RuntimeError("offline"))
+    client = {"api_key": "key", "session": session}
+
+    assert pipeline.get_model_context_length("openrouter", "vendor/small", client) is None
+    assert pipeline.get_model_context_length("openrouter", "vendor/small", client) is None
+    assert session.calls == 1
+
+
+@pytest.fixture
+def stub_generation(monkeypatch):
+    """不调用模型的生成和改编"""
+    monkeypatch.setattr(pipeline, "create_agent", lambda *args, **kwargs: None)
+    monkeypatch.setattr(pipeline, "generate_initial_dialogue",
+                        lambda agent, params: {"original_text": "A: Hi\nB: Hello", "key_points": []})
+    monkeypatch.setattr(pipeline, "adapt_dialogue", lambda agent, data, traits, language=None: "A: Hey\nB: Hi!")
+
+
+MODELS = {"initial_dialogue": "m1", "style_adaptation": "m2"}
+
+
+def test_run_dialogue_pair_uses_metadata_of_the_just_saved_dialogue(tmp_path, monkeypatch, stub_generation):
+    from utils.file_manager import FileManager
+
+    file_manager = FileManager(base_dir=str(tmp_path), write_behind=True)
+    # 后台写入尚未完成、读取失败时仍使用保存时生成的元数据
+    monkeypatch.setattr(file_manager, "load_dialogue", lambda json_path: None)
+
+    result = pipeline.run_dialogue_pair({"context": "咖啡馆", "goal": "找座位"}, None, "openai", MODELS, file_manager)
+    file_manager.flush()
+
+    metadata = file_manager.get_initial_metadata(result["initial_path"])
+    assert metadata["context"] == "咖啡馆"
+    assert metadata["model"] == "m1"
+
+
+def test_run_dialogue_pair_reports_unreadable_metadata(stub_generation):
+    class UnreadableFileManager:
+        def save_initial_dialogue(self, *args, **kwargs):
+            return ("dialogue.json", "dialogue.md")
+
+        def get_initial_metadata(self, json_path):
+            return None
+
+    with pytest.raises(RuntimeError, match="dialogue.json"):
+        pipeline.run_dialogue_pair({"context": "c", "goal": "g"}, None, "openai", MODELS, UnreadableFileManager())
@@ -0,0 +1,59 @@
+# -*- coding: utf-8 -*- # Ensure UTF-8 encoding for wider character support
+
+from utils import response_cache
+from utils.response_cache import ResponseCache, make_cache_key
+
+
+class _Clock:
+    """可手动拨动的时钟"""
+    def __init__(self):
+        self.now = 1000.0
+
+    def time(self):
+        return self.now
+
+
+def test_cache_key_ignores_parameter_order():
+    assert make_cache_key("x", {"a": 1, "b": "二"}) == make_cache_key("x", {"b": "二", "a": 1})
+    assert make_cache_key("x", {"a": 1}) != make_cache_key("y", {"a": 1})
+
+
+def test_entries_expire_after_ttl_in_memory_and_on_disk(tmp_path, monkeypatch):
+    clock = _Clock()
+    monkeypatch.setattr(response_cache, "time", clock)
+    path = str(tmp_path / "cache.db")
+    cache = ResponseCache(ttl=60, path=path)
+    cache.set("k", {"v": 1})
+
+    clock.now += 59
+    assert cache.get("k") == {"v": 1}
+    # 另一个进程从文件读取到同一条目
+    assert ResponseCache(ttl=60, path=path).get("k") == {"v": 1}
+
+    clock.now += 2
+    assert cache.get("k") is None
+    assert "k" not in ResponseCache(ttl=60, path=path)
+    assert cache.get_stats()["misses"] == 1
+
+
+def test_values_are_copied_and_lru_bounded():
+    cache = ResponseCache(max_entries=2)
+    value = {"items": [1]}
+    cache.set("a", value)
+    value["items"].append(2)
+    cache.get("a")["items"].append(3)
+    assert cache.get("a") == {"items": [1]}
+
+    cache.set("b", 2)
+    cache.get("a")
+    cache.set("c", 3)  # "a" 刚被读取过，淘汰最久未使用的 "b"
+    assert "b" not in cache and "a" in cache and "c" in cache
+
+
+def test_delete_removes_persisted_entry(tmp_path):
+    path = str(tmp_path / "cache.db")
+    cache = ResponseCache(path=path)
+    cache.set("k", "v")
+    cache.delete("k")
+    assert cache.get("k") is None
+    assert len(ResponseCache(path=path)) == 0
@@ -0,0 +1,44 @@
+# -*- coding: utf-8 -*- # Ensure UTF-8 encoding for wider character support
+
+import json
+import asyncio
+
+import pytest
+
+pytest.importorskip("openai")
+pytest.importorskip("requests")
+pytest.importorskip("dotenv")
+
+import service
+
+
+def _request(app, method="GET", path="/health"):
+    """向 ASGI 应用发送一个请求，返回 (状态码, JSON 响应)"""
+    messages = []
+
+    async def receive():
+        return {"type": "http.request", "body": b"", "more_body": False}
+
+    async def send(message):
+        messages.append(message)
+
+    asyncio.run(app({"type": "http", "method": method, "path": path}, receive, send))
+    return messages[0]["status"], json.loads(messages[1]["body"])
+
+
+def test_failed_lazy_init_returns_503_and_backs_off(monkeypatch):
+    attempts = []
+
+    def failing_state():
+        attempts.append(1)
+        raise ValueError("invalid literal for int(): 'many'")
+
+    monkeypatch.setattr(service, "ServiceState", failing_state)
+    app = service.DialogueService()
+
+    status, payload = _request(app)
+    assert status == 503
+    assert "many" in payload["error"]
+
+    assert _request(app)[0] == 503
+    assert len(attempts) == 1
@@ -0,0 +1,81 @@
+# -*- coding: utf-8 -*- # Ensure UTF-8 encoding for wider character support
+
+import time
+import threading
+
+import pytest
+
+from utils.single_flight import SingleFlight, normalize_text
+
+
+def _run_concurrently(flights, key, func, count):
+    """count 个线程同时以相同的键调用，返回各自的结果或异常"""
+    results = [None] * count
+
+    def worker(index):
+        try:
+            results[index] = flights.do(key, func)
+        except Exception as e:
+            results[index] = e
+
+    threads = [threading.Thread(target=worker, args=(index,)) for index in range(count)]
+    for thread in threads:
+        thread.start()
+    return threads, results
+
+
+def _wait_for_coalesced(flights, count, timeout=5):
+    """等到有 count 个调用在等待第一个调用的结果"""
+    deadline = time.time() + timeout
+    while flights.get_stats()["coalesced"] < count:
+        assert time.time() < deadline
+        time.sleep(0.001)
+
+
+def test_concurrent_calls_share_one_execution():
+    flights = SingleFlight()
+    release = threading.Event()
+    calls = []
+
+    def generate():
+        calls.append(1)
+        release.wait(5)
+        return {"text": "hi"}
+
+    threads, results = _run_concurrently(flights, "k", generate, 4)
+    _wait_for_coalesced(flights, 3)
+    release.set()
+    for thread in threads:
+        thread.join(5)
+
+    assert len(calls) == 1
+    assert results == [{"text": "hi"}] * 4
+    # 各调用者拿到的是副本
+    assert len({id(result) for result in results}) == 4
+    assert flights.get_stats() == {"executed": 1, "coalesced": 3, "in_flight": 0}
+
+
+def test_errors_are_shared_and_not_remembered():
+    flights = SingleFlight()
+    release = threading.Event()
+
+    def fail():
+        release.wait(5)
+        raise ValueError("boom")
+
+    threads, results = _run_concurrently(flights, "k", fail, 2)
+    _wait_for_coalesced(flights, 1)
+    release.set()
+    for thread in threads:
+        thread.join(5)
+    assert all(isinstance(result, ValueError) for result in results)
+
+    # 调用结束后不保留结果，下次重新执行
+    assert flights.do("k", lambda: 42) == 42
+    with pytest.raises(KeyError):
+        flights.do("k", lambda: {}["missing"])
+
+
+def test_normalize_text():
+    assert normalize_text("  a \n\t b  ") == "a b"
+    assert normalize_text(None) == ""
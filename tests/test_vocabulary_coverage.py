@@ -0,0 +1,49 @@
+# -*- coding: utf-8 -*- # Ensure UTF-8 encoding for wider character support
+
+from utils.vocabulary_coverage import AhoCorasick, CoverageChecker, sentence_segments, split_items, tokenize
+
+
+def test_tokenize_normalizes_case_width_and_inflection():
+    assert tokenize("Making MAKES make") == ["mak", "mak", "mak"]
+    assert tokenize("Ｈｅｌｌｏ, I'm 你好") == ["hello", "i'm", "你", "好"]
+    assert tokenize(None) == []
+
+
+def test_split_items_and_sentence_segments():
+    assert split_items("apple， banana;\n cherry,,") == ["apple", "banana", "cherry"]
+    assert sentence_segments("not only ... but also") == [["not", "only"], ["but", "also"]]
+    assert sentence_segments("help sb. (to) do sth") == [["help"], ["do"]]
+
+
+def test_aho_corasick_finds_overlapping_patterns():
+    automaton = AhoCorasick([["a", "b"], ["b", "c"], ["b"], ["a", "b", "c", "d"]])
+    found = sorted(automaton.search(["a", "b", "c", "d", "b"]))
+    assert found == [(0, 0, 2), (1, 1, 3), (2, 1, 2), (2, 4, 5), (3, 0, 4)]
+
+
+def test_aho_corasick_follows_failure_links():
+    automaton = AhoCorasick([["a", "a", "b"]])
+    assert list(automaton.search(["a", "a", "a", "b"])) == [(0, 1, 4)]
+
+
+def test_vocabulary_matches_whole_words_anywhere():
+    checker = CoverageChecker(vocabulary=["cat", "make up", "Tea"])
+    result = checker.check(["A: This category is new.", "B: They made up. We are making up!", "A: tea time"])
+    assert result["covered"] == ["make up", "Tea"]
+    assert result["missing"] == ["cat"]
+    assert result["item_lines"] == {"make up": [1], "Tea": [2]}
+    assert result["line_items"] == {1: ["make up"], 2: ["Tea"]}
+
+
+def test_sentence_segments_must_appear_in_order_on_one_line():
+    checker = CoverageChecker(sentences=["not only ... but also"])
+    assert checker.check(["A: Not only fast but also cheap."])["covered"] == ["not only ... but also"]
+    assert checker.check(["A: But also cheap, not only fast."])["missing"] == ["not only ... but also"]
+    assert checker.check(["A: Not only fast.", "B: But also cheap."])["missing"] == ["not only ... but also"]
+    assert checker.kind_of("not only ... but also") == "sentence"
+
+
+def test_empty_checker_is_falsy():
+    checker = CoverageChecker(vocabulary=["", "..."])
+    assert not checker
+    assert checker.check(["A: hi"]) == {"covered": [], "missing": [], "item_lines": {}, "line_items": {}}
@@ -0,0 +1,51 @@
+# -*- coding: utf-8 -*- # Ensure UTF-8 encoding for wider character support
+
+import os
+
+from utils.write_behind import WriteBehindWriter, WriteHandle
+
+
+def _item(path, text, mode='w'):
+    return (path, text, mode, WriteHandle(path))
+
+
+def test_coalesce_keeps_last_overwrite_and_finishes_merged_handles_with_it():
+    writer = WriteBehindWriter(fsync=False)
+    first, second, other, last = _item("a", "1"), _item("a", "2"), _item("b", "x"), _item("a", "3")
+    kept = writer._coalesce([first, second, other, last])
+    assert [(item[0], item[1]) for item, _ in kept] == [("b", "x"), ("a", "3")]
+    assert kept[1][1] == [first[3], second[3]]
+
+
+def test_coalesce_leaves_paths_with_appends_in_order():
+    writer = WriteBehindWriter(fsync=False)
+    batch = [_item("log", "1"), _item("log", "2", 'a'), _item("log", "3")]
+    assert [item for item, _ in writer._coalesce(batch)] == batch
+
+
+def test_submitted_writes_land_atomically_and_in_order(tmp_path):
+    writer = WriteBehindWriter(fsync=False)
+    path = str(tmp_path / "dialogue.json")
+    log = str(tmp_path / "history.log")
+    handles = [writer.submit(path, f"v{index}") for index in range(20)]
+    for index in range(5):
+        writer.submit(log, f"{index}\n", mode='a')
+
+    assert writer.flush(5)
+    assert all(handle.wait(0) for handle in handles)
+    assert not writer.has_pending(path)
+    with open(path, encoding='utf-8') as f:
+        assert f.read() == "v19"
+    with open(log, encoding='utf-8') as f:
+        assert f.read() == "0\n1\n2\n3\n4\n"
+    assert not os.path.exists(f"{path}.tmp")
+
+
+def test_failed_write_is_reported(tmp_path):
+    writer = WriteBehindWriter(fsync=False)
+    path = str(tmp_path / "missing" / "dialogue.json")
+    handle = writer.submit(path, "x")
+    assert handle.wait(5) is False
+    assert isinstance(handle.error, OSError)
+    assert writer.wait_for(path, 5) is False
+    assert writer.flush(5) is False
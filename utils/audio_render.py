@@ -0,0 +1,279 @@
+# -*- coding: utf-8 -*- # Ensure UTF-8 encoding for wider character support
+
+"""
+最终对话的离线语音预渲染
+用本地 TTS 引擎（espeak-ng / espeak，无需联网）把每句台词渲染为一个音频片段，再按顺序拼接为整段音频，
+与时间清单一起保存在对话 JSON 旁边：
+
+    final_dialogue_data/<name>.json
+    final_dialogue_data/<name>.audio/manifest.json   对话行、各句在整段音频中的起止时间
+    final_dialogue_data/<name>.audio/dialogue.wav    整段音频（播放器只需加载这一个文件，跳转和连续播放没有间隙）
+    final_dialogue_data/<name>.audio/segments/*.wav  每句的音频片段，按引擎、音色、语速和台词内容命名，修改对话后只重新渲染变化的句子
+
+括号中的动作、表情说明不朗读。清单与对话内容和渲染参数一致时跳过，可以定时运行：
+
+    python -m utils.audio_render --index dialogue_store.db --gap-ms 300
+"""
+
+import os
+import json
+import wave
+import shutil
+import hashlib
+import logging
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+
+from .dialogue_parser import parse_dialogue
+
+
+# 对话语言对应的 espeak 语音
+ESPEAK_VOICES = {
+    "英文": "en-us",
+    "中文": "cmn",
+    "日文": "ja",
+    "韩文": "ko",
+    "法文": "fr",
+    "德文": "de",
+    "西班牙文": "es",
+}
+# 说话者的音色变体（与播放器默认的 A 女声、B 男声一致）
+SPEAKER_VARIANTS = {"A": "f3", "B": "m3"}
+MANIFEST_VERSION = 1
+
+
+class EspeakEngine:
+    """
+    espeak-ng / espeak 命令行引擎
+    输出单声道 16 位 WAV，同一语音的采样率固定，片段可以直接拼接
+    """
+    name = "espeak"
+
+    def __init__(self, rate=150, executable=None):
+        """
+        Args:
+            rate (int): 语速（每分钟词数）
+            executable (str, optional): 可执行文件路径，默认依次查找 espeak-ng 和 espeak
+        """
+        self.rate = rate
+        self.executable = executable or shutil.which("espeak-ng") or shutil.which("espeak")
+        if not self.executable:
+            raise RuntimeError("未找到 espeak-ng 或 espeak，请先安装（例如 apt install espeak-ng）")
+
+    def voice(self, language, speaker):
+        """说话者使用的语音名称"""
+        return f"{ESPEAK_VOICES.get(language, 'en-us')}+{SPEAKER_VARIANTS.get(speaker, 'f3')}"
+
+    def settings(self):
+        """影响渲染结果的参数，参与片段命名和清单的更新判断"""
+        return {"engine": self.name, "rate": self.rate}
+
+    def synthesize(self, text, voice, path):
+        """把一句台词渲染为 WAV 文件"""
+        subprocess.run(
+            [self.executable, "-v", voice, "-s", str(self.rate), "-w", path, "--stdin"],
+            input=text.encode("utf-8"), check=True, capture_output=True
+        )
+
+
+def _digest(data):
+    """数据的内容哈希"""
+    return hashlib.sha1(json.dumps(data, ensure_ascii=False, sort_keys=True).encode("utf-8")).hexdigest()
+
+
+def audio_directory(json_path):
+    """对话 JSON 对应的音频目录"""
+    return f"{os.path.splitext(json_path)[0]}.audio"
+
+
+def concatenate_wav(paths, output_path, gap_ms=0):
+    """
+    按顺序拼接 WAV 片段，片段之间插入静音
+
+    Returns:
+        tuple: (采样率, 每个片段在整段音频中的 (start, end) 秒数列表)
+    """
+    timings = []
+    with wave.open(output_path, 'wb') as output:
+        params = None
+        position = 0
+        for index, path in enumerate(paths):
+            with wave.open(path, 'rb') as segment:
+                current = (segment.getnchannels(), segment.getsampwidth(), segment.getframerate())
+                if params is None:
+                    params = current
+                    output.setnchannels(current[0])
+                    output.setsampwidth(current[1])
+                    output.setframerate(current[2])
+                elif current != params:
+                    raise ValueError(f"音频片段格式不一致: {path}")
+                frames = segment.readframes(segment.getnframes())
+            if index:
+                gap = int(params[2] * gap_ms / 1000)
+                output.writeframes(b"\x00" * gap * params[0] * params[1])
+                position += gap
+            frame_count = len(frames) // (params[0] * params[1])
+            output.writeframes(frames)
+            timings.append((position / params[2], (position + frame_count) / params[2]))
+            position += frame_count
+        if params is None:
+            raise ValueError("没有可以拼接的音频片段")
+    return params[2], timings
+
+
+class AudioRenderer:
+    """
+    最终对话的批量语音渲染器
+    """
+    def __init__(self, engine, gap_ms=300, workers=2):
+        """
+        Args:
+            engine: TTS 引擎，需要提供 name、voice(language, speaker)、settings() 和 synthesize(text, voice, path)
+            gap_ms (int): 相邻两句之间的停顿（毫秒）
+            workers (int): 并发渲染片段的数量
+        """
+        self.engine = engine
+        self.gap_ms = gap_ms
+        self.workers = workers
+
+    def _source_key(self, turns, language):
+        """对话行和渲染参数的摘要，与清单中记录的一致时无需重新渲染"""
+        return _digest({
+            "turns": [[turn["speaker"], turn["text"]] for turn in turns],
+            "language": language,
+            "gap_ms": self.gap_ms,
+            "settings": self.engine.settings(),
+        })
+
+    def render(self, json_path, data, force=False):
+        """
+        渲染一段最终对话
+
+        Args:
+            json_path (str): 最终对话的 JSON 路径
+            data (dict): 最终对话记录
+            force (bool): 清单已是最新时也重新拼接
+
+        Returns:
+            str: 本次结果 "rendered"、"unchanged" 或 "empty"（没有可朗读的台词）
+        """
+        # 旧记录没有保存解析好的对话行时才解析文本
+        turns = data.get("final_turns")
+        if turns is None:
+            turns = parse_dialogue(data.get("final_text", ""))
+        spoken = [turn for turn in turns if turn["text"]]
+        if not spoken:
+            return "empty"
+
+        language = (data.get("metadata") or {}).get("language", "英文")
+        directory = audio_directory(json_path)
+        manifest_path = os.path.join(directory, "manifest.json")
+        source_key = self._source_key(turns, language)
+        if not force and os.path.exists(manifest_path):
+            with open(manifest_path, 'r', encoding='utf-8') as f:
+                if json.load(f).get("source") == source_key:
+                    return "unchanged"
+
+        # 已存在的片段直接复用，只渲染新的或修改过的台词
+        os.makedirs(os.path.join(directory, "segments"), exist_ok=True)
+        segments = []
+        pending = []
+        for turn in spoken:
+            voice = self.engine.voice(language, turn["speaker"])
+            name = f"segments/{_digest([self.engine.settings(), voice, turn['text']])[:16]}.wav"
+            path = os.path.join(directory, name)
+            segments.append({"turn": turn["index"], "speaker": turn["speaker"], "file": name})
+            if not os.path.exists(path) and all(path != item[2] for item in pending):
+                pending.append((turn["text"], voice, path))
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            list(executor.map(lambda item: self._synthesize(*item), pending))
+
+        sample_rate, timings = concatenate_wav(
+            [os.path.join(directory, segment["file"]) for segment in segments],
+            os.path.join(directory, "dialogue.wav"), self.gap_ms
+        )
+        for segment, (start, end) in zip(segments, timings):
+            segment["start"] = round(start, 3)
+            segment["end"] = round(end, 3)
+
+        manifest = {
+            "version": MANIFEST_VERSION,
+            "dialogue": os.path.relpath(json_path, directory).replace(os.sep, "/"),
+            "source": source_key,
+            "settings": self.engine.settings(),
+            "language": language,
+            "audio": "dialogue.wav",
+            "sample_rate": sample_rate,
+            "duration": segments[-1]["end"],
+            "turns": turns,
+            "segments": segments,
+        }
+        tmp_path = f"{manifest_path}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(manifest, f, ensure_ascii=False, indent=2)
+        os.replace(tmp_path, manifest_path)
+        self._remove_unused_segments(directory, segments)
+        return "rendered"
+
+    def _synthesize(self, text, voice, path):
+        """渲染一个片段（先写临时文件，中断时不会留下不完整的片段）"""
+        tmp_path = f"{path[:-4]}.tmp.wav"
+        self.engine.synthesize(text, voice, tmp_path)
+        os.replace(tmp_path, path)
+
+    @staticmethod
+    def _remove_unused_segments(directory, segments):
+        """删除清单中不再使用的片段"""
+        used = {os.path.basename(segment["file"]) for segment in segments}
+        segment_dir = os.path.join(directory, "segments")
+        for name in os.listdir(segment_dir):
+            if name not in used:
+                os.remove(os.path.join(segment_dir, name))
+
+    def render_corpus(self, file_manager, force=False):
+        """
+        渲染对话索引中的全部最终对话，单段对话失败不影响其他对话
+
+        Args:
+            file_manager (FileManager): 启用了对话索引的文件管理器
+            force (bool): 重新拼接清单已是最新的对话
+
+        Returns:
+            dict: 各结果的对话数量
+        """
+        if not file_manager.store:
+            raise ValueError("批量渲染需要启用对话索引（FileManager 的 index_path）")
+        file_manager.flush()
+
+        # 同一对话被更新过时只渲染最新版本
+        latest = {}
+        for change in file_manager.store.iter_changes(kind="final"):
+            latest[change["json_path"]] = change["data"]
+
+        summary = {"rendered": 0, "unchanged": 0, "empty": 0, "failed": 0}
+        for json_path, data in latest.items():
+            try:
+                summary[self.render(json_path, data, force)] += 1
+            except Exception as e:
+                summary["failed"] += 1
+                logging.warning(f"渲染语音失败 {json_path}: {str(e)}")
+        return summary
+
+
+if __name__ == "__main__":
+    import argparse
+    from utils.file_manager import FileManager
+
+    parser = argparse.ArgumentParser(description="用本地 TTS 引擎预渲染已保存的最终对话")
+    parser.add_argument("--index", default="dialogue_store.db", help="对话索引数据库路径")
+    parser.add_argument("--rate", type=int, default=150, help="语速（每分钟词数）")
+    parser.add_argument("--gap-ms", type=int, default=300, help="相邻两句之间的停顿（毫秒）")
+    parser.add_argument("--workers", type=int, default=2, help="并发渲染片段的数量")
+    parser.add_argument("--force", action="store_true", help="重新拼接清单已是最新的对话")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s")
+    renderer = AudioRenderer(EspeakEngine(rate=args.rate), gap_ms=args.gap_ms, workers=args.workers)
+    summary = renderer.render_corpus(FileManager(index_path=args.index), force=args.force)
+    print(f"新渲染: {summary['rendered']}，无变化: {summary['unchanged']}，"
+          f"无台词: {summary['empty']}，失败: {summary['failed']}")
@@ -0,0 +1,114 @@
+# -*- coding: utf-8 -*- # Ensure UTF-8 encoding for wider character support
+
+import os
+import copy
+import json
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+
+
+def content_hash(data):
+    """
+    计算数据的内容哈希（SHA-256）
+    使用排序后的紧凑 JSON 序列化，相同内容总是得到相同的哈希
+
+    Args:
+        data: 可 JSON 序列化的数据
+
+    Returns:
+        str: 十六进制哈希字符串
+    """
+    canonical = json.dumps(data, ensure_ascii=False, sort_keys=True, separators=(",", ":"))
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+
+class BlobStore:
+    """
+    按内容哈希寻址的共享数据存储
+    相同内容只保存一份，多条记录通过哈希引用同一份数据；
+    内容不可变，读取结果可以安全缓存（缓存中保存副本，调用方修改返回值不影响缓存）
+    """
+    def __init__(self, directory="dialogue_blobs", write_text=None, cache_size=128):
+        """
+        Args:
+            directory (str): 存储目录
+            write_text (callable, optional): 写入函数 (path, text)，默认直接写文件；
+                FileManager 传入自己的写入方法以复用后台写入队列
+            cache_size (int): 内存中缓存的数据条数
+        """
+        self.directory = directory
+        self.write_text = write_text or self._write_file
+        self.cache_size = cache_size
+        self._cache = OrderedDict()
+        self._writes = {}  # digest -> 尚未确认成功的后台写入句柄
+        self._lock = threading.Lock()
+
+    def _write_file(self, path, text):
+        """直接写入文件"""
+        with open(path, 'w', encoding='utf-8') as f:
+            f.write(text)
+
+    def _path_for(self, digest):
+        """数据文件路径（按哈希前两位分目录，避免单个目录下文件过多）"""
+        return os.path.join(self.directory, digest[:2], f"{digest}.json")
+
+    def _remember(self, digest, data):
+        """放入 LRU 缓存"""
+        with self._lock:
+            self._cache[digest] = copy.deepcopy(data)
+            self._cache.move_to_end(digest)
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+
+    def put(self, data):
+        """
+        保存数据并返回其哈希；文件已存在或写入已在队列中时不重复写入，
+        后台写入失败的数据在下次保存时重新写入（读取缓存不代表已经写入文件）
+
+        Returns:
+            str: 内容哈希
+        """
+        digest = content_hash(data)
+        path = self._path_for(digest)
+        with self._lock:
+            handle = self._writes.get(digest)
+        if handle is not None and not handle.done():
+            pass  # 写入已在后台队列中
+        elif os.path.exists(path):
+            with self._lock:
+                self._writes.pop(digest, None)
+        else:
+            if handle is not None:
+                logging.warning(f"共享数据上次写入失败，重新写入 {digest}: {handle.error}")
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            result = self.write_text(path, json.dumps(data, ensure_ascii=False, indent=2))
+            with self._lock:
+                # 后台写入返回句柄，完成前记录下来；直接写入时返回即已写入
+                if hasattr(result, "done"):
+                    self._writes[digest] = result
+                else:
+                    self._writes.pop(digest, None)
+        self._remember(digest, data)
+        return digest
+
+    def get(self, digest):
+        """
+        按哈希读取数据
+
+        Returns:
+            数据；不存在或读取失败时返回 None
+        """
+        with self._lock:
+            if digest in self._cache:
+                self._cache.move_to_end(digest)
+                return copy.deepcopy(self._cache[digest])
+        try:
+            with open(self._path_for(digest), 'r', encoding='utf-8') as f:
+                data = json.load(f)
+        except Exception as e:
+            logging.warning(f"读取共享数据失败 {digest}: {e}")
+            return None
+        self._remember(digest, data)
+        return data
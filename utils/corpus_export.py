@@ -0,0 +1,260 @@
+# -*- coding: utf-8 -*- # Ensure UTF-8 encoding for wider character support
+
+import os
+import glob
+import gzip
+import json
+import logging
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    # 未安装 pyarrow 时只支持 JSONL.gz 导出
+    pa = None
+    pq = None
+
+
+# 导出的标量列和列表列
+SCALAR_COLUMNS = [
+    "json_path", "kind", "timestamp", "context", "goal", "language", "difficulty", "model",
+    "original_text", "final_text"
+]
+LIST_COLUMNS = ["key_points", "key_vocabulary", "key_sentences", "intentions", "dramatic_elements"]
+
+FORMAT_EXTENSIONS = {
+    "jsonl.gz": ".jsonl.gz",
+    "parquet": ".parquet",
+    "arrow": ".arrow",
+}
+
+
+def _require_pyarrow():
+    """列式格式需要 pyarrow"""
+    if pa is None:
+        raise RuntimeError("导出或读取 Parquet/Arrow 格式需要安装 pyarrow: pip install pyarrow")
+
+
+def flatten_record(change, resolve_original=None):
+    """
+    将一条对话记录展开为扁平的导出行
+
+    Args:
+        change (dict): DialogueStore.iter_changes 产出的记录
+        resolve_original (callable, optional): 获取最终对话对应初始对话的函数
+
+    Returns:
+        dict: 包含 SCALAR_COLUMNS 和 LIST_COLUMNS 的导出行
+    """
+    data = change["data"]
+    metadata = data.get("metadata") or {}
+    if change["kind"] == "final":
+        source = (resolve_original(data) if resolve_original else data.get("original_dialogue")) or {}
+        final_text = data.get("final_text")
+    else:
+        source = data
+        final_text = None
+
+    row = {
+        "json_path": change["json_path"],
+        "kind": change["kind"],
+        "original_text": source.get("original_text"),
+        "final_text": final_text,
+    }
+    for key in ("timestamp", "context", "goal", "language", "difficulty", "model"):
+        value = metadata.get(key)
+        row[key] = str(value) if value is not None else None
+    for key in LIST_COLUMNS:
+        row[key] = [str(item) for item in source.get(key) or []]
+    return row
+
+
+def _arrow_schema():
+    """导出文件的 Arrow 表结构"""
+    fields = [pa.field(name, pa.string()) for name in SCALAR_COLUMNS]
+    fields += [pa.field(name, pa.list_(pa.string())) for name in LIST_COLUMNS]
+    return pa.schema(fields)
+
+
+class CorpusExporter:
+    """
+    对话语料导出器
+    从对话索引中增量读取新增或更新过的记录，写入 JSONL.gz、Parquet 或 Arrow 文件；
+    每次导出写入一个新的分片文件，导出进度保存在 manifest.json 中
+    """
+    def __init__(self, file_manager, output_dir="corpus_export", batch_size=5000):
+        if not file_manager.store:
+            raise ValueError("语料导出需要启用对话索引（FileManager 的 index_path）")
+        self.file_manager = file_manager
+        self.output_dir = output_dir
+        self.batch_size = batch_size
+        self.manifest_path = os.path.join(output_dir, "manifest.json")
+
+    def _load_manifest(self):
+        """读取各格式已导出到的 version"""
+        if not os.path.exists(self.manifest_path):
+            return {}
+        with open(self.manifest_path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+
+    def _save_manifest(self, manifest):
+        """保存导出进度（先写临时文件再替换）"""
+        tmp_path = f"{self.manifest_path}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(manifest, f, ensure_ascii=False, indent=2)
+        os.replace(tmp_path, self.manifest_path)
+
+    def _next_part_path(self, fmt):
+        """下一个分片文件路径"""
+        extension = FORMAT_EXTENSIONS[fmt]
+        existing = glob.glob(os.path.join(self.output_dir, f"part-*{extension}"))
+        return os.path.join(self.output_dir, f"part-{len(existing):05d}{extension}")
+
+    def _iter_row_batches(self, since_version):
+        """按批产出 (rows, last_version)"""
+        rows = []
+        last_version = since_version
+        for change in self.file_manager.store.iter_changes(since_version, batch_size=self.batch_size):
+            rows.append(flatten_record(change, self.file_manager.resolve_original_dialogue))
+            last_version = change["version"]
+            if len(rows) >= self.batch_size:
+                yield rows, last_version
+                rows = []
+        if rows:
+            yield rows, last_version
+
+    def export(self, fmt="jsonl.gz"):
+        """
+        增量导出上次导出之后新增或更新的记录
+
+        Args:
+            fmt (str): "jsonl.gz"、"parquet" 或 "arrow"
+
+        Returns:
+            int: 本次导出的记录数
+        """
+        if fmt not in FORMAT_EXTENSIONS:
+            raise ValueError(f"不支持的导出格式: {fmt}")
+        if fmt != "jsonl.gz":
+            _require_pyarrow()
+
+        os.makedirs(self.output_dir, exist_ok=True)
+        manifest = self._load_manifest()
+        since_version = manifest.get(fmt, -1)
+        self.file_manager.flush()
+
+        exported = 0
+        last_version = since_version
+        part_path = None
+        writer = None
+        try:
+            for rows, last_version in self._iter_row_batches(since_version):
+                if part_path is None:
+                    part_path = self._next_part_path(fmt)
+                    writer = self._open_writer(fmt, part_path)
+                self._write_rows(fmt, writer, rows)
+                exported += len(rows)
+        finally:
+            if writer is not None:
+                writer.close()
+
+        if exported:
+            manifest[fmt] = last_version
+            self._save_manifest(manifest)
+            logging.info(f"已导出 {exported} 条对话到 {part_path}")
+        return exported
+
+    def _open_writer(self, fmt, path):
+        """打开分片文件的写入器"""
+        if fmt == "jsonl.gz":
+            return gzip.open(path, 'wt', encoding='utf-8')
+        if fmt == "parquet":
+            return pq.ParquetWriter(path, _arrow_schema(), compression="zstd")
+        return pa.ipc.new_file(path, _arrow_schema())
+
+    def _write_rows(self, fmt, writer, rows):
+        """写入一批导出行"""
+        if fmt == "jsonl.gz":
+            writer.write("".join(json.dumps(row, ensure_ascii=False, separators=(",", ":")) + "\n" for row in rows))
+        else:
+            writer.write_table(pa.Table.from_pylist(rows, schema=_arrow_schema()))
+
+
+def _part_paths(output_dir, fmt):
+    """按写入顺序列出某种格式的所有分片"""
+    return sorted(glob.glob(os.path.join(output_dir, f"part-*{FORMAT_EXTENSIONS[fmt]}")))
+
+
+def iter_jsonl_corpus(output_dir="corpus_export"):
+    """
+    逐行读取 JSONL.gz 导出（同一对话的多个版本都会产出，后出现的为最新版本）
+
+    Yields:
+        dict: 导出行
+    """
+    for path in _part_paths(output_dir, "jsonl.gz"):
+        with gzip.open(path, 'rt', encoding='utf-8') as f:
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)
+
+
+def read_columnar_corpus(output_dir="corpus_export", fmt="arrow", columns=None, latest_only=True):
+    """
+    读取 Parquet 或 Arrow 导出为一个 Arrow 表
+    Arrow 分片通过内存映射读取，数据不经过复制；Parquet 分片同样启用内存映射
+
+    Args:
+        output_dir (str): 导出目录
+        fmt (str): "arrow" 或 "parquet"
+        columns (list, optional): 只读取指定列
+        latest_only (bool): 同一对话被多次导出时只保留最新版本
+
+    Returns:
+        pyarrow.Table: 语料表
+    """
+    _require_pyarrow()
+    if fmt not in ("arrow", "parquet"):
+        raise ValueError(f"不支持的列式格式: {fmt}")
+
+    read_columns = None
+    if columns is not None:
+        read_columns = list(columns) if "json_path" in columns or not latest_only else ["json_path"] + list(columns)
+
+    tables = []
+    for path in _part_paths(output_dir, fmt):
+        if fmt == "arrow":
+            table = pa.ipc.open_file(pa.memory_map(path, 'r')).read_all()
+            if read_columns is not None:
+                table = table.select(read_columns)
+        else:
+            table = pq.read_table(path, columns=read_columns, memory_map=True)
+        tables.append(table)
+
+    if not tables:
+        schema = _arrow_schema()
+        return schema.empty_table() if columns is None else schema.empty_table().select(list(columns))
+    table = pa.concat_tables(tables)
+
+    if latest_only:
+        # 分片按导出顺序排列，同一路径保留最后出现的一行
+        latest = {path: index for index, path in enumerate(table.column("json_path").to_pylist())}
+        if len(latest) < table.num_rows:
+            table = table.take(sorted(latest.values()))
+    if columns is not None:
+        table = table.select(list(columns))
+    return table
+
+
+if __name__ == "__main__":
+    import argparse
+    from utils.file_manager import FileManager
+
+    parser = argparse.ArgumentParser(description="增量导出对话语料")
+    parser.add_argument("--format", choices=list(FORMAT_EXTENSIONS), default="jsonl.gz")
+    parser.add_argument("--index", default="dialogue_store.db", help="对话索引数据库路径")
+    parser.add_argument("--output", default="corpus_export", help="导出目录")
+    args = parser.parse_args()
+
+    count = CorpusExporter(FileManager(index_path=args.index), args.output).export(args.format)
+    print(f"已导出 {count} 条对话")
@@ -0,0 +1,140 @@
+# -*- coding: utf-8 -*- # Ensure UTF-8 encoding for wider character support
+
+"""
+编辑后初始对话的增量改编
+改编结果与初始对话按对话行一一对应（第 k 句改编自第 k 句），因此可以逐行比较编辑前后的初始对话，
+未修改的行直接沿用已有的改编结果，只把新增或修改过的行交给 Agent 2 改写后拼回最终对话
+"""
+
+import difflib
+
+from .dialogue_parser import SPEAKER_PREFIX, strip_speaker
+
+
+def split_turn_lines(text):
+    """
+    按对话行拆分文本
+
+    Returns:
+        tuple: (第一句之前的非对话行列表, [{"speaker", "line", "trailing"}])，
+            trailing 为该句之后、下一句之前的非对话行（空行、轮次标题等）
+    """
+    prefix = []
+    entries = []
+    for line in (text or "").split('\n'):
+        match = SPEAKER_PREFIX.match(line)
+        if match:
+            entries.append({"speaker": match.group(1), "line": line, "trailing": []})
+        elif entries:
+            entries[-1]["trailing"].append(line)
+        else:
+            prefix.append(line)
+    return prefix, entries
+
+
+def _comparable(entry):
+    """比较时忽略首尾空白和连续空白的差异"""
+    return f"{entry['speaker']}:{' '.join(strip_speaker(entry['line']).split())}"
+
+
+def plan_incremental_update(previous_original, edited_original, previous_final, max_changed_ratio=0.5):
+    """
+    比较编辑前后的初始对话，规划最终对话的增量更新
+
+    Args:
+        previous_original (str): 上次改编时使用的初始对话文本
+        edited_original (str): 编辑后的初始对话文本
+        previous_final (str): 上次改编得到（可能经过人工修改）的最终对话文本
+        max_changed_ratio (float): 需要改写的行数超过编辑后总行数的该比例时不做增量改编
+
+    Returns:
+        dict: prefix（最终对话开头的非对话行）、entries（每句为 {"keep": 沿用的行列表} 或
+            {"speaker", "original", "trailing"} 表示需要改写）和 changed（需要改写的行数）；
+            最终对话与上次的初始对话无法逐行对应、或修改过多时返回 None
+    """
+    _, old_entries = split_turn_lines(previous_original)
+    _, new_entries = split_turn_lines(edited_original)
+    final_prefix, final_entries = split_turn_lines(previous_final)
+    if not new_entries or [entry["speaker"] for entry in old_entries] != [entry["speaker"] for entry in final_entries]:
+        return None
+
+    matcher = difflib.SequenceMatcher(
+        None, [_comparable(entry) for entry in old_entries], [_comparable(entry) for entry in new_entries], autojunk=False
+    )
+    entries = []
+    changed = 0
+    for tag, old_start, old_end, new_start, new_end in matcher.get_opcodes():
+        if tag == "equal":
+            for final_entry in final_entries[old_start:old_end]:
+                entries.append({"keep": [final_entry["line"]] + final_entry["trailing"]})
+            continue
+        # 修改的行沿用被替换行之后的空行和标题；新增的行插在上一句和它后面的空行、标题之间
+        replaced = final_entries[old_start:old_end]
+        for offset, new_entry in enumerate(new_entries[new_start:new_end]):
+            if offset < len(replaced):
+                trailing = replaced[offset]["trailing"]
+            elif entries and "keep" in entries[-1]:
+                trailing, entries[-1]["keep"] = entries[-1]["keep"][1:], entries[-1]["keep"][:1]
+            elif entries:
+                trailing, entries[-1]["trailing"] = entries[-1]["trailing"], []
+            else:
+                trailing = []
+            entries.append({
+                "speaker": new_entry["speaker"],
+                "original": new_entry["line"].strip(),
+                "trailing": trailing,
+            })
+            changed += 1
+
+    if changed > max_changed_ratio * len(new_entries):
+        return None
+    return {"prefix": final_prefix, "entries": entries, "changed": changed}
+
+
+def changed_targets(plan, context_lines=2):
+    """
+    需要改写的行及其上下文
+
+    Returns:
+        list: 每项包含 id（在 plan["entries"] 中的位置）、speaker、original，以及 before / after
+            （前后各最多 context_lines 句已改编的行，用于保持衔接）
+    """
+    def final_line(entry):
+        return entry["keep"][0].strip() if "keep" in entry else None
+
+    entries = plan["entries"]
+    targets = []
+    for index, entry in enumerate(entries):
+        if "keep" in entry:
+            continue
+        before = [line for line in (final_line(item) for item in entries[max(0, index - context_lines):index]) if line]
+        after = [line for line in (final_line(item) for item in entries[index + 1:index + 1 + context_lines]) if line]
+        targets.append({
+            "id": index,
+            "speaker": entry["speaker"],
+            "original": entry["original"],
+            "before": before,
+            "after": after,
+        })
+    return targets
+
+
+def splice_adaptation(plan, restyled):
+    """
+    把改写后的行拼回最终对话
+
+    Args:
+        plan (dict): plan_incremental_update 的结果
+        restyled (dict): 行在 plan["entries"] 中的位置 -> 改写后的行
+
+    Returns:
+        str: 更新后的最终对话
+    """
+    lines = list(plan["prefix"])
+    for index, entry in enumerate(plan["entries"]):
+        if "keep" in entry:
+            lines.extend(entry["keep"])
+        else:
+            lines.append(restyled[index])
+            lines.extend(entry["trailing"])
+    return '\n'.join(lines)
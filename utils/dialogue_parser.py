@@ -0,0 +1,250 @@
+# -*- coding: utf-8 -*- # Ensure UTF-8 encoding for wider character support
+
+"""
+对话行解析
+所有模块共用的对话行规则：以 "A:" / "B:"（含全角冒号）开头的行是一句对话，说话者和冒号之间可以有
+一个括号中的动作说明（如 "B (smiling): hey"）；其余的行（空行、轮次标题、"A man walks in." 这样的叙述等）
+不属于任何一句。括号或星号中的内容是动作、表情说明，与台词分开保存。
+
+保存对话时解析一次，结构化的对话行写入 JSON（初始对话为 turns，最终对话为 final_turns），
+使用方直接读取，不再各自解析文本。dialog-player.html 中的 JavaScript 版本由本模块生成：
+
+    python -m utils.dialogue_parser --write dialog-player.html   # 更新播放器中的生成代码
+    python -m utils.dialogue_parser --check dialog-player.html   # 检查是否与本模块一致
+"""
+
+import re
+import sys
+import json
+import argparse
+
+
+# 正则只使用 Python 和 JavaScript 含义相同的语法，生成的 JavaScript 直接复用这些表达式
+# 说话者和冒号之间的动作说明：半角 / 全角括号或方括号
+PREFIX_DIRECTION_PATTERN = r"\([^)\n]*\)|（[^）\n]*）|\[[^\]\n]*\]"
+# 说话者前缀："A:"、"B："、"B (smiling):" 等，必须有冒号（冒号前后可以有空白，不跨行）；
+# 捕获说话者和冒号前的动作说明
+SPEAKER_PREFIX_PATTERN = r"^[^\S\n]*([AB])[^\S\n]*(" + PREFIX_DIRECTION_PATTERN + r")?[^\S\n]*[:：][^\S\n]*"
+# 对话行：另外捕获前缀之后的内容；多行模式下可以一次找出整段文本中的所有对话行
+SPEAKER_LINE_PATTERN = SPEAKER_PREFIX_PATTERN + r"([^\n]*)"
+# 动作、表情说明：半角 / 全角括号、方括号、【】或 *...*
+STAGE_DIRECTION_PATTERN = r"\([^)\n]*\)|（[^）\n]*）|\[[^\]\n]*\]|【[^】\n]*】|\*[^*\n]+\*"
+
+SPEAKER_PREFIX = re.compile(SPEAKER_PREFIX_PATTERN, re.MULTILINE)
+SPEAKER_LINE = re.compile(SPEAKER_LINE_PATTERN, re.MULTILINE)
+STAGE_DIRECTION = re.compile(STAGE_DIRECTION_PATTERN)
+
+
+def split_speaker_line(line):
+    """
+    拆分对话行
+
+    Returns:
+        tuple: (说话者, 台词部分)，冒号前的动作说明移到台词部分开头；不是对话行时返回 None
+    """
+    match = SPEAKER_LINE.match(line)
+    if not match:
+        return None
+    return match.group(1), " ".join(part for part in (match.group(2), match.group(3).strip()) if part)
+
+
+def strip_speaker(text):
+    """去掉说话者前缀（冒号前的动作说明保留在开头）；没有前缀时原样返回"""
+    parts = split_speaker_line(text)
+    return parts[1] if parts else text
+
+
+def parse_line(line, index=0):
+    """
+    解析一行文本
+
+    Args:
+        line (str): 一行文本（不含换行符）
+        index (int): 该句在对话中的序号
+
+    Returns:
+        dict: index、speaker、text（去掉动作说明后的台词）、actions（动作说明列表）和
+            raw（说话者前缀之后的原文，冒号前的动作说明移到开头）；不是对话行时返回 None
+    """
+    parts = split_speaker_line(line)
+    if parts is None:
+        return None
+    speaker, raw = parts
+    return {
+        "index": index,
+        "speaker": speaker,
+        "text": " ".join(STAGE_DIRECTION.sub("", raw).split()),
+        "actions": [action for action in (item[1:-1].strip() for item in STAGE_DIRECTION.findall(raw)) if action],
+        "raw": raw,
+    }
+
+
+class DialogueLineParser:
+    """
+    增量对话行解析器
+    文本可以分块输入（例如流式返回的模型输出），每读到一个完整的行就产出解析结果
+    """
+    def __init__(self):
+        self._buffer = ""
+        self._count = 0
+
+    def _parse(self, line):
+        turn = parse_line(line, self._count)
+        if turn is not None:
+            self._count += 1
+        return turn
+
+    def feed(self, chunk):
+        """
+        输入一段文本
+
+        Returns:
+            list: 本次输入中完成的对话行
+        """
+        self._buffer += chunk or ""
+        *lines, self._buffer = self._buffer.split("\n")
+        return [turn for turn in map(self._parse, lines) if turn is not None]
+
+    def close(self):
+        """
+        输入结束，解析最后一行
+
+        Returns:
+            list: 剩余的对话行（最多一句）
+        """
+        line, self._buffer = self._buffer, ""
+        turn = self._parse(line)
+        return [turn] if turn is not None else []
+
+
+def parse_dialogue(text):
+    """
+    解析整段对话
+
+    Returns:
+        list: 按顺序排列的对话行，格式见 parse_line
+    """
+    parser = DialogueLineParser()
+    return parser.feed(text) + parser.close()
+
+
+def speaker_sequence(text):
+    """对话中依次出现的说话者列表"""
+    return [match.group(1) for match in SPEAKER_PREFIX.finditer(text or "")]
+
+
+GENERATED_BEGIN = "// BEGIN GENERATED: python -m utils.dialogue_parser --write dialog-player.html"
+GENERATED_END = "// END GENERATED"
+
+_JS_TEMPLATE = """\
+// 与 utils/dialogue_parser.py 保持一致，不要手工修改
+const SPEAKER_LINE = new RegExp(__SPEAKER_LINE__);
+const STAGE_DIRECTION = new RegExp(__STAGE_DIRECTION__, 'g');
+
+function parseLine(line, index = 0) {
+    const match = SPEAKER_LINE.exec(line);
+    if (!match) return null;
+    const raw = [match[2], match[3].trim()].filter(Boolean).join(' ');
+    return {
+        index: index,
+        speaker: match[1],
+        text: raw.replace(STAGE_DIRECTION, '').split(/\\s+/).filter(Boolean).join(' '),
+        actions: (raw.match(STAGE_DIRECTION) || []).map(item => item.slice(1, -1).trim()).filter(Boolean),
+        raw: raw
+    };
+}
+
+class DialogueLineParser {
+    constructor() {
+        this.buffer = '';
+        this.count = 0;
+    }
+
+    parse(line) {
+        const turn = parseLine(line, this.count);
+        if (turn !== null) this.count++;
+        return turn;
+    }
+
+    feed(chunk) {
+        this.buffer += chunk || '';
+        const lines = this.buffer.split('\\n');
+        this.buffer = lines.pop();
+        return lines.map(line => this.parse(line)).filter(turn => turn !== null);
+    }
+
+    close() {
+        const turn = this.parse(this.buffer);
+        this.buffer = '';
+        return turn !== null ? [turn] : [];
+    }
+}
+
+function parseDialogue(text) {
+    const parser = new DialogueLineParser();
+    return parser.feed(text).concat(parser.close());
+}"""
+
+
+def render_javascript(indent=""):
+    """
+    生成 JavaScript 版本的解析器（包含开始和结束标记）
+
+    Args:
+        indent (str): 每行的缩进
+    """
+    code = (_JS_TEMPLATE
+            .replace("__SPEAKER_LINE__", json.dumps(SPEAKER_LINE_PATTERN, ensure_ascii=False))
+            .replace("__STAGE_DIRECTION__", json.dumps(STAGE_DIRECTION_PATTERN, ensure_ascii=False)))
+    lines = [GENERATED_BEGIN] + code.split("\n") + [GENERATED_END]
+    return "\n".join(f"{indent}{line}" if line else "" for line in lines)
+
+
+def update_generated_block(html):
+    """
+    替换页面中开始、结束标记之间的生成代码（沿用开始标记的缩进）
+
+    Returns:
+        str: 更新后的页面；页面中没有生成标记时抛出 ValueError
+    """
+    start = html.find(GENERATED_BEGIN)
+    end = html.find(GENERATED_END, start)
+    if start < 0 or end < 0:
+        raise ValueError("页面中没有找到生成代码的标记")
+    line_start = html.rfind("\n", 0, start) + 1
+    indent = html[line_start:start]
+    return html[:line_start] + render_javascript(indent) + html[end + len(GENERATED_END):]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="生成或检查 dialog-player.html 中的对话行解析器")
+    group = parser.add_mutually_exclusive_group(required=True)
+    group.add_argument("--write", metavar="HTML", help="更新页面中的生成代码")
+    group.add_argument("--check", metavar="HTML", help="检查页面中的生成代码是否为最新")
+    group.add_argument("--parse", metavar="TEXT_FILE", help="解析对话文本文件并输出 JSON")
+    args = parser.parse_args()
+
+    if args.parse:
+        with open(args.parse, 'r', encoding='utf-8') as f:
+            print(json.dumps(parse_dialogue(f.read()), ensure_ascii=False, indent=2))
+        return 0
+
+    path = args.write or args.check
+    with open(path, 'r', encoding='utf-8') as f:
+        html = f.read()
+    updated = update_generated_block(html)
+    if args.check:
+        if updated != html:
+            print(f"{path} 中的解析器已过期，请运行 python -m utils.dialogue_parser --write {path}")
+            return 1
+        print(f"{path} 中的解析器是最新的")
+        return 0
+    if updated != html:
+        with open(path, 'w', encoding='utf-8') as f:
+            f.write(updated)
+    print(f"已更新 {path}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,397 @@
+# -*- coding: utf-8 -*- # Ensure UTF-8 encoding for wider character support
+
+"""
+批量对话质检
+一次性对整个语料做分词（每段文本只用预编译的正则扫描一遍），把各行的说话者、长度和词汇命中情况
+展开为按对话编号排列的扁平数组，再用数组运算统一计算各项检查：
+    轮数           与 InitialDialogueAgent._validate_dialogue 的计数规则一致
+    第一个说话者   AI先说时应为 B，否则为 A
+    词汇覆盖       custom_vocabulary 和 key_vocabulary 在对话文本中出现的比例
+    句子长度       平均每句词数是否在难度对应的 CEFR 经验范围内
+    口头禅         最终对话中是否出现 AI 的口头禅
+
+用法:
+    python -m utils.dialogue_qa --index dialogue_store.db --kind final --output qa_report.json
+"""
+
+import re
+import json
+import logging
+
+from .dialogue_parser import SPEAKER_LINE, STAGE_DIRECTION
+from .vocabulary_coverage import CoverageChecker
+
+try:
+    import numpy as np
+except ImportError:
+    # 未安装 numpy 时使用等价的纯 Python 实现
+    np = None
+
+
+# 词：中日文按单字计，其余文字按连续字母计
+CJK_CHAR = re.compile(r"[぀-ヿ㐀-鿿]")
+WORD = re.compile(r"[^\W\d_぀-ヿ㐀-鿿]+(?:['’-][^\W\d_぀-ヿ㐀-鿿]+)*")
+# 口头禅、词汇输入的分隔符
+ITEM_SEPARATOR = re.compile(r"[,，、;；/\n]")
+
+# 各难度平均每句词数的经验范围（CEFR 口语描述的大致长度）
+CEFR_WORDS_PER_LINE = {
+    "A1": (2, 8),
+    "A2": (3, 11),
+    "B1": (5, 15),
+    "B2": (6, 20),
+    "C1": (8, 26),
+    "C2": (8, 32),
+}
+# 中日文约几个字相当于一个词
+CJK_CHARS_PER_WORD = 1.5
+
+SPEAKER_CODES = {"A": 0, "B": 1}
+
+# 报告中的检查项
+CHECKS = ["turns", "first_speaker", "vocabulary", "line_length", "mantra"]
+
+
+def split_items(text):
+    """将逗号、顿号等分隔的输入拆分为去重后的列表（列表输入逐项处理）"""
+    if isinstance(text, (list, tuple)):
+        parts = [str(item) for item in text]
+    else:
+        parts = ITEM_SEPARATOR.split(str(text or ""))
+    seen = set()
+    result = []
+    for item in parts:
+        item = item.strip()
+        if item and item.lower() not in seen:
+            seen.add(item.lower())
+            result.append(item)
+    return result
+
+
+def qa_record(change, resolve_original=None):
+    """
+    将一条对话记录整理为质检输入
+
+    Args:
+        change (dict): DialogueStore.iter_changes 产出的记录
+        resolve_original (callable, optional): 获取最终对话对应初始对话的函数
+
+    Returns:
+        dict: json_path、kind、text、turns（保存时解析好的对话行，旧记录为 None）以及检查所需的生成参数；
+            没有对话文本时返回 None
+    """
+    data = change["data"]
+    if change["kind"] == "final":
+        source = (resolve_original(data) if resolve_original else data.get("original_dialogue")) or {}
+        text = data.get("final_text")
+        turns = data.get("final_turns")
+        mantra = (data.get("ai_traits_data") or {}).get("ai_traits_mantra", "")
+    else:
+        source = data
+        text = data.get("original_text")
+        turns = data.get("turns")
+        mantra = ""
+    if not text:
+        return None
+
+    # 生成参数记录在初始对话的元数据中；最终对话的语言和难度以自身元数据为准
+    params = dict(source.get("metadata") or {})
+    params.update({key: value for key, value in (data.get("metadata") or {}).items()
+                   if key in ("language", "difficulty") and value})
+    num_turns = params.get("num_turns")
+    return {
+        "json_path": change["json_path"],
+        "kind": change["kind"],
+        "text": text,
+        "turns": turns,
+        "dialogue_mode": params.get("dialogue_mode") or "AI先说",
+        "num_turns": int(num_turns) if num_turns not in (None, "") else None,
+        "difficulty": params.get("difficulty"),
+        "language": params.get("language"),
+        "vocabulary": split_items(split_items(params.get("custom_vocabulary")) + list(source.get("key_vocabulary") or [])),
+        "mantra": split_items(mantra),
+    }
+
+
+def _text_length(content):
+    """文本的词数（去掉动作描述；中日文按字数折算）"""
+    content = STAGE_DIRECTION.sub(" ", content)
+    return len(WORD.findall(content)) + len(CJK_CHAR.findall(content)) / CJK_CHARS_PER_WORD
+
+
+def tokenize_batch(records):
+    """
+    对一批记录分词，展开为扁平的列（每段文本只扫描一遍，各对话的全部对话行合并后统计词数）
+
+    Returns:
+        dict: 行级列 line_doc / line_speaker，词汇级列 item_doc / item_hit，口头禅列 mantra_doc / mantra_hit，
+            以及对话级列 expected_first / num_turns / length_total
+    """
+    columns = {key: [] for key in (
+        "line_doc", "line_speaker", "item_doc", "item_hit", "mantra_doc", "mantra_hit",
+        "expected_first", "num_turns", "length_total"
+    )}
+    for doc, record in enumerate(records):
+        text = record["text"]
+        # 优先使用保存时解析好的对话行，旧记录才扫描文本
+        turns = record.get("turns")
+        if turns is not None:
+            lines = [(turn["speaker"], turn["raw"]) for turn in turns]
+        else:
+            lines = [(speaker, f"{direction} {content}".strip()) for speaker, direction, content in SPEAKER_LINE.findall(text)]
+        columns["line_doc"].extend([doc] * len(lines))
+        columns["line_speaker"].extend(SPEAKER_CODES[speaker] for speaker, _ in lines)
+        columns["length_total"].append(_text_length("\n".join(content for _, content in lines)))
+
+        # 与生成时的覆盖检查使用同一套按词匹配的规则（"cat" 不会命中 "category"）
+        covered = set(CoverageChecker(record["vocabulary"] + record["mantra"]).check(text.split('\n'))["covered"])
+        for item in record["vocabulary"]:
+            columns["item_doc"].append(doc)
+            columns["item_hit"].append(item in covered)
+        for item in record["mantra"]:
+            columns["mantra_doc"].append(doc)
+            columns["mantra_hit"].append(item in covered)
+
+        columns["expected_first"].append(SPEAKER_CODES["B" if record["dialogue_mode"] == "AI先说" else "A"])
+        columns["num_turns"].append(-1 if record["num_turns"] is None else record["num_turns"])
+    return columns
+
+
+def _bincount(ids, size, weights=None):
+    """按对话编号求和（weights 为空时计数）"""
+    if np is not None:
+        return np.bincount(np.asarray(ids, dtype=np.int64), weights=weights, minlength=size)
+    totals = [0] * size
+    for index, doc in enumerate(ids):
+        totals[doc] += 1 if weights is None else weights[index]
+    return totals
+
+
+def compute_features(columns, size):
+    """
+    根据扁平列计算每段对话的特征
+
+    Returns:
+        dict: 各项为长度为 size 的序列：lines、turns、first_speaker（没有对话行时为 -1）、
+            mean_length、vocabulary_total、vocabulary_hits、mantra_total、mantra_hits
+    """
+    line_doc = columns["line_doc"]
+    speaker = columns["line_speaker"]
+    expected_first = columns["expected_first"]
+
+    if np is not None:
+        line_doc = np.asarray(line_doc, dtype=np.int64)
+        speaker = np.asarray(speaker, dtype=np.int8)
+        expected_first = np.asarray(expected_first, dtype=np.int8)
+        lines = np.bincount(line_doc, minlength=size)
+        # 相邻两行属于同一对话、前一行是先说的一方、后一行是另一方时算一轮；
+        # 这样的配对不会互相重叠，与逐行跳过两个说话者的计数结果相同
+        pairs = ((line_doc[:-1] == line_doc[1:])
+                 & (speaker[:-1] == expected_first[line_doc[:-1]])
+                 & (speaker[1:] != speaker[:-1]))
+        turns = np.bincount(line_doc[:-1][pairs], minlength=size)
+        first_speaker = np.full(size, -1, dtype=np.int8)
+        starts = np.cumsum(lines) - lines
+        has_lines = lines > 0
+        first_speaker[has_lines] = speaker[starts[has_lines]]
+        mean_length = np.divide(np.asarray(columns["length_total"], dtype=float), lines,
+                                out=np.zeros(size), where=has_lines)
+    else:
+        lines = _bincount(line_doc, size)
+        turns = [0] * size
+        for index in range(len(line_doc) - 1):
+            doc = line_doc[index]
+            if (doc == line_doc[index + 1] and speaker[index] == expected_first[doc]
+                    and speaker[index + 1] != speaker[index]):
+                turns[doc] += 1
+        first_speaker = [-1] * size
+        for index in range(len(line_doc) - 1, -1, -1):
+            first_speaker[line_doc[index]] = speaker[index]
+        mean_length = [total / count if count else 0.0 for total, count in zip(columns["length_total"], lines)]
+
+    return {
+        "lines": lines,
+        "turns": turns,
+        "first_speaker": first_speaker,
+        "mean_length": mean_length,
+        "vocabulary_total": _bincount(columns["item_doc"], size),
+        "vocabulary_hits": _bincount(columns["item_doc"], size, [float(hit) for hit in columns["item_hit"]]),
+        "mantra_total": _bincount(columns["mantra_doc"], size),
+        "mantra_hits": _bincount(columns["mantra_doc"], size, [float(hit) for hit in columns["mantra_hit"]]),
+    }
+
+
+def _length_bounds(records):
+    """每段对话难度对应的句长范围（未知难度不限制）"""
+    lower = [CEFR_WORDS_PER_LINE.get(record["difficulty"], (0, float("inf")))[0] for record in records]
+    upper = [CEFR_WORDS_PER_LINE.get(record["difficulty"], (0, float("inf")))[1] for record in records]
+    return lower, upper
+
+
+def validate_batch(records, min_vocabulary_coverage=1.0):
+    """
+    批量检查一批对话
+
+    Args:
+        records (list): qa_record 产出的质检输入
+        min_vocabulary_coverage (float): 词汇覆盖率低于该值视为不通过
+
+    Returns:
+        list: 每段对话的检查结果，包含 json_path、kind、各项特征、checks（各检查项是否通过，不适用时为 None）
+            和 passed
+    """
+    size = len(records)
+    if size == 0:
+        return []
+    columns = tokenize_batch(records)
+    features = compute_features(columns, size)
+    lower, upper = _length_bounds(records)
+    missing = [[] for _ in records]
+    items = (item for record in records for item in record["vocabulary"])
+    for doc, item, hit in zip(columns["item_doc"], items, columns["item_hit"]):
+        if not hit:
+            missing[doc].append(item)
+
+    if np is not None:
+        num_turns = np.asarray(columns["num_turns"])
+        turns_ok = np.asarray(features["turns"]) == num_turns
+        first_ok = np.asarray(features["first_speaker"]) == np.asarray(columns["expected_first"])
+        vocabulary_total = np.asarray(features["vocabulary_total"])
+        coverage = np.divide(features["vocabulary_hits"], vocabulary_total,
+                             out=np.ones(size), where=vocabulary_total > 0)
+        vocabulary_ok = coverage >= min_vocabulary_coverage
+        mean_length = np.asarray(features["mean_length"])
+        length_ok = (mean_length >= np.asarray(lower)) & (mean_length <= np.asarray(upper))
+        mantra_ok = np.asarray(features["mantra_hits"]) > 0
+        features = {key: np.asarray(value).tolist() for key, value in features.items()}
+        turns_ok, first_ok, coverage, vocabulary_ok, length_ok, mantra_ok = (
+            array.tolist() for array in (turns_ok, first_ok, coverage, vocabulary_ok, length_ok, mantra_ok)
+        )
+    else:
+        turns_ok = [turns == expected for turns, expected in zip(features["turns"], columns["num_turns"])]
+        first_ok = [first == expected for first, expected in zip(features["first_speaker"], columns["expected_first"])]
+        coverage = [hits / total if total else 1.0
+                    for hits, total in zip(features["vocabulary_hits"], features["vocabulary_total"])]
+        vocabulary_ok = [value >= min_vocabulary_coverage for value in coverage]
+        length_ok = [low <= value <= high for value, low, high in zip(features["mean_length"], lower, upper)]
+        mantra_ok = [hits > 0 for hits in features["mantra_hits"]]
+
+    results = []
+    for doc, record in enumerate(records):
+        has_lines = features["lines"][doc] > 0
+        checks = {
+            "turns": bool(turns_ok[doc]) if record["num_turns"] is not None else None,
+            "first_speaker": bool(first_ok[doc]),
+            "vocabulary": bool(vocabulary_ok[doc]) if features["vocabulary_total"][doc] else None,
+            "line_length": bool(length_ok[doc]) if has_lines and record["difficulty"] in CEFR_WORDS_PER_LINE else None,
+            "mantra": bool(mantra_ok[doc]) if features["mantra_total"][doc] else None,
+        }
+        results.append({
+            "json_path": record["json_path"],
+            "kind": record["kind"],
+            "difficulty": record["difficulty"],
+            "language": record["language"],
+            "lines": int(features["lines"][doc]),
+            "turns": int(features["turns"][doc]),
+            "expected_turns": record["num_turns"],
+            "vocabulary_coverage": round(float(coverage[doc]), 3),
+            "missing_vocabulary": missing[doc] if checks["vocabulary"] is False else [],
+            "mean_line_length": round(float(features["mean_length"][doc]), 2),
+            "checks": checks,
+            "passed": all(value is not False for value in checks.values()),
+        })
+    return results
+
+
+def summarize(results):
+    """
+    汇总检查结果
+
+    Returns:
+        dict: total、passed、各检查项的 checked / failed 数量，以及各难度的平均句长
+    """
+    summary = {
+        "total": len(results),
+        "passed": sum(1 for result in results if result["passed"]),
+        "checks": {check: {"checked": 0, "failed": 0} for check in CHECKS},
+        "mean_line_length_by_difficulty": {},
+    }
+    lengths = {}
+    for result in results:
+        for check, value in result["checks"].items():
+            if value is not None:
+                summary["checks"][check]["checked"] += 1
+                summary["checks"][check]["failed"] += int(not value)
+        if result["lines"]:
+            lengths.setdefault(result["difficulty"] or "未知", []).append(result["mean_line_length"])
+    summary["mean_line_length_by_difficulty"] = {
+        difficulty: round(sum(values) / len(values), 2) for difficulty, values in sorted(lengths.items())
+    }
+    return summary
+
+
+def validate_corpus(file_manager, kind=None, batch_size=5000, min_vocabulary_coverage=1.0):
+    """
+    检查对话索引中的全部对话
+
+    Args:
+        file_manager (FileManager): 启用了对话索引的文件管理器
+        kind (str, optional): 只检查 "initial" 或 "final"
+        batch_size (int): 每批分词和计算的对话数
+        min_vocabulary_coverage (float): 词汇覆盖率阈值
+
+    Returns:
+        dict: summary（汇总）和 results（每段对话的检查结果）
+    """
+    if not file_manager.store:
+        raise ValueError("批量质检需要启用对话索引（FileManager 的 index_path）")
+    latest = {}
+    batch = []
+
+    def flush():
+        for result in validate_batch(batch, min_vocabulary_coverage):
+            latest[result["json_path"]] = result
+        batch.clear()
+
+    for change in file_manager.store.iter_changes(kind=kind, batch_size=batch_size):
+        try:
+            record = qa_record(change, file_manager.resolve_original_dialogue)
+        except Exception as e:
+            logging.warning(f"跳过无法解析的记录 {change['json_path']}: {str(e)}")
+            continue
+        if record is not None:
+            batch.append(record)
+        if len(batch) >= batch_size:
+            flush()
+    flush()
+
+    # 同一对话被更新过时只保留最新版本的结果
+    results = list(latest.values())
+    return {"summary": summarize(results), "results": results}
+
+
+if __name__ == "__main__":
+    import argparse
+    import time
+    from utils.file_manager import FileManager
+
+    parser = argparse.ArgumentParser(description="批量检查已保存对话的格式和质量")
+    parser.add_argument("--index", default="dialogue_store.db", help="对话索引数据库路径")
+    parser.add_argument("--kind", choices=["initial", "final"], help="只检查初始对话或最终对话")
+    parser.add_argument("--min-coverage", type=float, default=1.0, help="词汇覆盖率阈值")
+    parser.add_argument("--output", default="qa_report.json", help="报告输出路径")
+    parser.add_argument("--all", action="store_true", help="报告中包含通过检查的对话（默认只列出未通过的）")
+    args = parser.parse_args()
+
+    started = time.perf_counter()
+    report = validate_corpus(FileManager(index_path=args.index), args.kind, min_vocabulary_coverage=args.min_coverage)
+    if not args.all:
+        report["results"] = [result for result in report["results"] if not result["passed"]]
+    with open(args.output, 'w', encoding='utf-8') as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+
+    summary = report["summary"]
+    print(f"共检查 {summary['total']} 段对话，通过 {summary['passed']} 段，用时 {time.perf_counter() - started:.2f} 秒")
+    for check, counts in summary["checks"].items():
+        print(f"  {check}: 检查 {counts['checked']}，未通过 {counts['failed']}")
+    print(f"报告已保存到 {args.output}")
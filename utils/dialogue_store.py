@@ -0,0 +1,337 @@
+# -*- coding: utf-8 -*- # Ensure UTF-8 encoding for wider character support
+
+import os
+import glob
+import json
+import sqlite3
+import logging
+import threading
+
+
+# 元数据中建立索引、可用于筛选的字段
+INDEXED_FIELDS = ["context", "goal", "language", "difficulty", "model"]
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS dialogues (
+    json_path TEXT PRIMARY KEY,
+    md_path TEXT,
+    kind TEXT NOT NULL,
+    timestamp TEXT,
+    context TEXT,
+    goal TEXT,
+    language TEXT,
+    difficulty TEXT,
+    model TEXT,
+    data TEXT NOT NULL,
+    version INTEGER NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS idx_dialogues_kind_timestamp ON dialogues (kind, timestamp);
+CREATE INDEX IF NOT EXISTS idx_dialogues_context ON dialogues (context);
+CREATE INDEX IF NOT EXISTS idx_dialogues_goal ON dialogues (goal);
+CREATE INDEX IF NOT EXISTS idx_dialogues_language ON dialogues (language);
+CREATE INDEX IF NOT EXISTS idx_dialogues_difficulty ON dialogues (difficulty);
+CREATE INDEX IF NOT EXISTS idx_dialogues_model ON dialogues (model);
+"""
+
+# 全文索引的可搜索列：对话正文、关键词汇、关键句型
+SEARCH_FIELDS = ["text", "vocabulary", "sentences"]
+
+# trigram 分词器按三字片段建立索引，中文无需分词也能做子串匹配
+_FTS_SCHEMA = """
+CREATE VIRTUAL TABLE IF NOT EXISTS dialogues_fts USING fts5(
+    json_path UNINDEXED, text, vocabulary, sentences, tokenize='trigram'
+)
+"""
+
+# trigram 索引只能匹配至少三个字符的查询
+_FTS_MIN_QUERY_CHARS = 3
+
+_RESULT_COLUMNS = "d.json_path, d.md_path, d.kind, d.timestamp, d.context, d.goal, d.language, d.difficulty, d.model"
+
+
+def _build_search_document(kind, data, source=None):
+    """
+    从对话数据中提取全文索引的各列内容
+    最终对话的关键词汇和句型来自其初始对话 source（默认取内嵌的 original_dialogue）
+    """
+    if kind == "final":
+        text = data.get("final_text", "")
+        source = source or data.get("original_dialogue") or {}
+    else:
+        text = data.get("original_text", "")
+        source = data
+    return {
+        "text": text or "",
+        "vocabulary": "\n".join(source.get("key_vocabulary") or []),
+        "sentences": "\n".join(source.get("key_sentences") or []),
+    }
+
+
+def _escape_like(query):
+    """转义 LIKE 模式中的通配符"""
+    return query.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+
+
+class DialogueStore:
+    """
+    基于 SQLite 的对话索引
+    每条对话（初始或最终）以其 JSON 文件路径为主键保存一份完整数据，
+    并对元数据字段建立索引，查找和列出对话时无需逐个解析 JSON 文件
+    """
+    def __init__(self, path="dialogue_store.db"):
+        self.path = path
+        self._lock = threading.Lock()
+        # Streamlit 会在不同线程中执行脚本，连接由锁保护后跨线程共享
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.row_factory = sqlite3.Row
+        with self._lock, self._conn:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.executescript(_SCHEMA)
+            # 旧版本创建的数据库没有 version 列
+            columns = [row["name"] for row in self._conn.execute("PRAGMA table_info(dialogues)")]
+            if "version" not in columns:
+                self._conn.execute("ALTER TABLE dialogues ADD COLUMN version INTEGER NOT NULL DEFAULT 0")
+            self._conn.execute("CREATE INDEX IF NOT EXISTS idx_dialogues_version ON dialogues (version)")
+        self.fts_enabled = self._init_fts()
+
+    def _init_fts(self):
+        """
+        创建全文索引；SQLite 未编译 FTS5 或不支持 trigram 分词器时返回 False，搜索退回到 LIKE 扫描
+        已有记录但全文索引为空时（例如旧版本创建的数据库）会补建索引
+        """
+        try:
+            with self._lock, self._conn:
+                self._conn.execute(_FTS_SCHEMA)
+                indexed = self._conn.execute("SELECT COUNT(*) FROM dialogues_fts").fetchone()[0]
+                if not indexed:
+                    rows = self._conn.execute("SELECT json_path, kind, data FROM dialogues").fetchall()
+                    for row in rows:
+                        self._index_text(row["json_path"], row["kind"], json.loads(row["data"]))
+            return True
+        except sqlite3.OperationalError as e:
+            logging.warning(f"全文索引不可用，搜索将使用逐条匹配: {e}")
+            return False
+
+    def _index_text(self, json_path, kind, data, source=None):
+        """更新一条对话的全文索引（调用方需持有锁并处于事务中）"""
+        document = _build_search_document(kind, data, source)
+        self._conn.execute("DELETE FROM dialogues_fts WHERE json_path = ?", (json_path,))
+        self._conn.execute(
+            "INSERT INTO dialogues_fts (json_path, text, vocabulary, sentences) VALUES (?, ?, ?, ?)",
+            [json_path] + [document[field] for field in SEARCH_FIELDS]
+        )
+
+    def upsert(self, kind, json_path, md_path, data, source=None):
+        """
+        写入或更新一条对话记录
+
+        Args:
+            kind (str): "initial" 或 "final"
+            json_path (str): JSON 文件路径（主键）
+            md_path (str): Markdown 文件路径
+            data (dict): 包含 metadata 的完整对话数据
+            source (dict, optional): 最终对话对应的初始对话数据，用于全文索引
+        """
+        metadata = data.get("metadata") or {}
+        values = [json_path, md_path, kind, metadata.get("timestamp")]
+        values += [metadata.get(field) for field in INDEXED_FIELDS]
+        values.append(json.dumps(data, ensure_ascii=False))
+        with self._lock, self._conn:
+            # version 为全局递增序号，每次写入（包括更新）都会变大，用于增量导出
+            self._conn.execute(
+                "INSERT OR REPLACE INTO dialogues "
+                "(json_path, md_path, kind, timestamp, context, goal, language, difficulty, model, data, version) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, (SELECT COALESCE(MAX(version), 0) + 1 FROM dialogues))",
+                values
+            )
+            if self.fts_enabled:
+                self._index_text(json_path, kind, data, source)
+
+    def get(self, json_path):
+        """
+        按 JSON 文件路径获取完整对话数据
+
+        Returns:
+            dict: 对话数据；不存在时返回 None
+        """
+        with self._lock:
+            row = self._conn.execute("SELECT data FROM dialogues WHERE json_path = ?", (json_path,)).fetchone()
+        return json.loads(row["data"]) if row else None
+
+    def get_metadata(self, json_path):
+        """按 JSON 文件路径获取元数据，不解析完整对话数据"""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT timestamp, context, goal, language, difficulty, model FROM dialogues WHERE json_path = ?",
+                (json_path,)
+            ).fetchone()
+        if not row:
+            return None
+        return {key: row[key] for key in row.keys() if row[key] is not None}
+
+    def _build_filters(self, kind, filters):
+        """根据筛选条件构造 WHERE 子句"""
+        clauses = []
+        params = []
+        if kind:
+            clauses.append("kind = ?")
+            params.append(kind)
+        for field in INDEXED_FIELDS:
+            if filters.get(field):
+                clauses.append(f"{field} = ?")
+                params.append(filters[field])
+        where = f" WHERE {' AND '.join(clauses)}" if clauses else ""
+        return where, params
+
+    def list_dialogues(self, kind=None, limit=50, offset=0, **filters):
+        """
+        按元数据筛选并列出对话（按时间倒序），只返回元数据，不包含对话正文
+
+        Args:
+            kind (str, optional): "initial" 或 "final"
+            limit (int): 返回条数上限
+            offset (int): 跳过的条数，用于分页
+            **filters: 字段的精确匹配条件，可用字段见 INDEXED_FIELDS
+
+        Returns:
+            list: 每条对话的 json_path、md_path、kind 和元数据字段
+        """
+        where, params = self._build_filters(kind, filters)
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT json_path, md_path, kind, timestamp, context, goal, language, difficulty, model "
+                f"FROM dialogues{where} ORDER BY timestamp DESC LIMIT ? OFFSET ?",
+                params + [limit, offset]
+            ).fetchall()
+        return [dict(row) for row in rows]
+
+    def count(self, kind=None, **filters):
+        """统计满足筛选条件的对话数量"""
+        where, params = self._build_filters(kind, filters)
+        with self._lock:
+            return self._conn.execute(f"SELECT COUNT(*) FROM dialogues{where}", params).fetchone()[0]
+
+    def get_distinct_values(self, field, kind=None):
+        """获取某个索引字段的所有取值，用于构建筛选选项"""
+        if field not in INDEXED_FIELDS:
+            raise ValueError(f"不支持的索引字段: {field}")
+        where, params = self._build_filters(kind, {})
+        with self._lock:
+            rows = self._conn.execute(
+                f"SELECT DISTINCT {field} FROM dialogues{where} ORDER BY {field}", params
+            ).fetchall()
+        return [row[0] for row in rows if row[0] is not None]
+
+    def search(self, query, kind=None, field=None, limit=50):
+        """
+        全文搜索已保存的对话
+
+        Args:
+            query (str): 搜索词（按子串匹配）
+            kind (str, optional): "initial" 或 "final"
+            field (str, optional): 只搜索某一列（text、vocabulary、sentences），默认搜索全部列
+            limit (int): 返回条数上限
+
+        Returns:
+            list: 匹配对话的路径、元数据和命中片段 snippet
+        """
+        query = (query or "").strip()
+        if not query:
+            return []
+        if field is not None and field not in SEARCH_FIELDS:
+            raise ValueError(f"不支持的搜索字段: {field}")
+        fields = [field] if field else SEARCH_FIELDS
+        kind_clause = " AND d.kind = ?" if kind else ""
+        kind_params = [kind] if kind else []
+
+        if self.fts_enabled and len(query) >= _FTS_MIN_QUERY_CHARS:
+            # 将整个查询作为短语匹配，避免用户输入被解析为 FTS 语法
+            phrase = '"' + query.replace('"', '""') + '"'
+            match = f"{field} : {phrase}" if field else phrase
+            snippet_column = SEARCH_FIELDS.index(field) + 1 if field else -1
+            sql = (
+                f"SELECT {_RESULT_COLUMNS}, snippet(dialogues_fts, {snippet_column}, '**', '**', '…', 32) AS snippet "
+                "FROM dialogues_fts f JOIN dialogues d ON d.json_path = f.json_path "
+                f"WHERE dialogues_fts MATCH ?{kind_clause} ORDER BY f.rank LIMIT ?"
+            )
+            params = [match] + kind_params + [limit]
+        else:
+            pattern = f"%{_escape_like(query)}%"
+            if self.fts_enabled:
+                # 短查询无法使用 trigram 索引，在全文索引表上逐条匹配
+                source = "dialogues_fts f JOIN dialogues d ON d.json_path = f.json_path"
+                columns = [f"f.{name}" for name in fields]
+            else:
+                # 没有全文索引时在完整数据上逐条匹配（无法区分列）
+                source = "dialogues d"
+                columns = ["d.data"]
+            conditions = " OR ".join(f"{column} LIKE ? ESCAPE '\\'" for column in columns)
+            sql = (
+                f"SELECT {_RESULT_COLUMNS}, NULL AS snippet FROM {source} "
+                f"WHERE ({conditions}){kind_clause} ORDER BY d.timestamp DESC LIMIT ?"
+            )
+            params = [pattern] * len(columns) + kind_params + [limit]
+
+        with self._lock:
+            rows = self._conn.execute(sql, params).fetchall()
+        return [dict(row) for row in rows]
+
+    def iter_changes(self, since_version=-1, kind=None, batch_size=1000):
+        """
+        按写入顺序分批读取 version 大于 since_version 的记录，用于增量导出
+        （旧版本数据库中已有记录的 version 为 0，默认值 -1 会包含这些记录）
+
+        Yields:
+            dict: 包含 version、kind、json_path、md_path 和完整数据 data
+        """
+        kind_clause = " AND kind = ?" if kind else ""
+        last_version = since_version
+        while True:
+            with self._lock:
+                rows = self._conn.execute(
+                    "SELECT version, kind, json_path, md_path, data FROM dialogues "
+                    f"WHERE version > ?{kind_clause} ORDER BY version LIMIT ?",
+                    [last_version] + ([kind] if kind else []) + [batch_size]
+                ).fetchall()
+            if not rows:
+                return
+            for row in rows:
+                yield {
+                    "version": row["version"],
+                    "kind": row["kind"],
+                    "json_path": row["json_path"],
+                    "md_path": row["md_path"],
+                    "data": json.loads(row["data"])
+                }
+            last_version = rows[-1]["version"]
+
+    def import_directory(self, directory, kind, load_source=None):
+        """
+        将已有的 JSON 文件导入索引（用于索引建立之前保存的对话）
+
+        Args:
+            directory (str): 对话文件目录
+            kind (str): "initial" 或 "final"
+            load_source (callable, optional): 根据最终对话数据返回其初始对话数据的函数
+
+        Returns:
+            int: 导入的对话数量
+        """
+        imported = 0
+        for json_path in sorted(glob.glob(os.path.join(directory, "*.json"))):
+            json_path = json_path.replace(os.sep, "/")
+            try:
+                with open(json_path, 'r', encoding='utf-8') as f:
+                    data = json.load(f)
+            except Exception as e:
+                logging.warning(f"导入对话文件失败 {json_path}: {e}")
+                continue
+            source = load_source(data) if load_source else None
+            self.upsert(kind, json_path, f"{os.path.splitext(json_path)[0]}.md", data, source)
+            imported += 1
+        return imported
+
+    def close(self):
+        """关闭数据库连接"""
+        with self._lock:
+            self._conn.close()
@@ -1,18 +1,49 @@
 # -*- coding: utf-8 -*- # Ensure UTF-8 encoding for wider character support
 
 import os
+import copy
 import json
 import datetime
 import uuid
 import re
+import threading
+from collections import OrderedDict
+from .write_behind import WriteBehindWriter
+from .dialogue_store import DialogueStore
+from .blob_store import BlobStore
+from .dialogue_parser import parse_dialogue
+from .markdown_renderer import (
+    INITIAL_MARKDOWN_FIELDS, render_initial_dialogue_markdown, render_final_dialogue_markdown,
+    render_long_dialogue_header, render_long_dialogue_chapter
+)
 
 class FileManager:
     """
     文件管理类，负责对话内容的保存和读取
     支持各种格式的存储和读取
+    
+    启用 write_behind 后，写入交给后台线程完成（原子替换 + 批量 fsync），
+    保存方法立即返回文件路径；需要确保落盘时调用 flush()
+    
+    指定 index_path 后，每次保存同时写入 SQLite 对话索引，
+    可按元数据快速查找和列出对话，更新时也无需重新解析 JSON 文件
+    
+    最终对话记录通过内容哈希（original_dialogue_ref）引用共享存储中的初始对话，
+    同一初始对话改编出的多个版本只保存一份初始对话数据
+    
+    最近保存的初始对话按路径缓存在内存中，更新时只比较发生变化的字段：
+    内容未变化时不写入，Markdown 只在其展示的字段变化时重新生成；
+    load_dialogue 读取的完整对话同样保存在 LRU 缓存中，保存或更新时自动失效
     """
-    def __init__(self, base_dir=""):
+    def __init__(self, base_dir="", write_behind=False, index_path=None, cache_size=256):
         self.base_dir = base_dir
+        self.writer = WriteBehindWriter() if write_behind else None
+        self.store = DialogueStore(os.path.join(base_dir, index_path)) if index_path else None
+        self.blobs = BlobStore(os.path.join(base_dir, "dialogue_blobs"), write_text=self._write_text)
+        self.cache_size = cache_size
+        self._initial_cache = OrderedDict()  # json_path -> 最近一次保存的数据（含 metadata）
+        self._loaded_cache = OrderedDict()  # json_path -> 最近读取的完整对话数据
+        self._cache_lock = threading.Lock()  # HTTP 服务等场景下多个线程共用同一个 FileManager
         
     def _ensure_directory(self, directory):
         """确保目录存在"""
@@ -28,7 +59,108 @@ class FileManager:
         safe_context = re.sub(r'[^\w\s-]', '', context)[:20].strip().replace(' ', '_')
         return f"{timestamp}_{safe_context}_{unique_id}"
     
-    def save_initial_dialogue(self, dialogue_data, context, goal, directory="dialogue_data"):
+    def _write_text(self, path, text):
+        """将完整文本一次性写入文件（启用后台写入时提交到写入队列）"""
+        if self.writer:
+            return self.writer.submit(path, text)
+        with open(path, 'w', encoding='utf-8') as f:
+            f.write(text)
+    
+    def _append_text(self, path, text):
+        """追加文本到文件末尾（启用后台写入时按提交顺序追加）"""
+        if self.writer:
+            return self.writer.submit(path, text, mode='a')
+        with open(path, 'a', encoding='utf-8') as f:
+            f.write(text)
+    
+    def _write_json(self, path, data):
+        """将数据序列化后一次性写入 JSON 文件"""
+        return self._write_text(path, json.dumps(data, ensure_ascii=False, indent=2))
+    
+    def _file_exists(self, path):
+        """等待该路径上尚未完成的后台写入后，判断文件是否存在"""
+        if not path:
+            return False
+        if self.writer:
+            self.writer.wait_for(path)
+        return os.path.exists(path)
+    
+    def _index(self, kind, json_path, md_path, data, source=None):
+        """将对话写入索引（未启用索引时忽略），并使该路径的读取缓存失效"""
+        with self._cache_lock:
+            self._loaded_cache.pop(json_path, None)
+        if self.store:
+            self.store.upsert(kind, json_path, md_path, data, source)
+    
+    def _cache_put(self, cache, json_path, data):
+        """放入 LRU 缓存（保存副本，调用方之后修改数据不影响缓存）"""
+        data = copy.deepcopy(data)
+        with self._cache_lock:
+            cache[json_path] = data
+            cache.move_to_end(json_path)
+            while len(cache) > self.cache_size:
+                cache.popitem(last=False)
+    
+    def _cache_get(self, cache, json_path):
+        """读取 LRU 缓存并标记为最近使用；返回缓存中的对象，调用方不能修改"""
+        with self._cache_lock:
+            data = cache.get(json_path)
+            if data is not None:
+                cache.move_to_end(json_path)
+            return data
+    
+    def _cache_initial(self, json_path, dialogue_data_with_meta):
+        """缓存最近保存的初始对话，用于更新时比较变化的字段"""
+        self._cache_put(self._initial_cache, json_path, dialogue_data_with_meta)
+    
+    @staticmethod
+    def _with_turns(dialogue_data):
+        """复制初始对话数据并附加解析好的对话行 turns，读取 JSON 的一方无需再解析对话文本"""
+        data = dialogue_data.copy()
+        data["turns"] = parse_dialogue(dialogue_data.get("original_text", ""))
+        return data
+    
+    @staticmethod
+    def _changed_fields(previous, current):
+        """比较两份对话数据，返回发生变化的字段（不含 metadata）"""
+        keys = (set(previous) | set(current)) - {"metadata"}
+        return {key for key in keys if previous.get(key) != current.get(key)}
+    
+    def _store_original(self, initial_dialogue_data):
+        """将初始对话放入共享存储，返回其内容哈希"""
+        return self.blobs.put(initial_dialogue_data) if initial_dialogue_data else None
+    
+    def resolve_original_dialogue(self, final_dialogue_data):
+        """
+        获取最终对话记录对应的初始对话数据
+        兼容直接内嵌 original_dialogue 的旧记录
+        
+        Args:
+            final_dialogue_data (dict): 最终对话记录
+            
+        Returns:
+            dict: 初始对话数据；没有时返回 None
+        """
+        if final_dialogue_data.get("original_dialogue") is not None:
+            return final_dialogue_data["original_dialogue"]
+        ref = final_dialogue_data.get("original_dialogue_ref")
+        return self.blobs.get(ref) if ref else None
+    
+    def flush(self, timeout=None):
+        """
+        等待所有后台写入完成
+        
+        Args:
+            timeout (float, optional): 每个写入的最长等待时间（秒）
+            
+        Returns:
+            bool: 全部写入成功返回 True；未启用后台写入时直接返回 True
+        """
+        if not self.writer:
+            return True
+        return self.writer.flush(timeout)
+    
+    def save_initial_dialogue(self, dialogue_data, context, goal, directory="dialogue_data", extra_metadata=None):
         """
         保存 Agent 1 生成的结构化数据为 JSON 和 Markdown 格式
         
@@ -37,6 +169,7 @@ class FileManager:
             context (str): 对话背景
             goal (str): 对话目标
             directory (str): 存储目录
+            extra_metadata (dict, optional): 额外的元数据，如 language、difficulty、model
             
         Returns:
             tuple: (json_path, md_path) 元组
@@ -56,57 +189,22 @@ class FileManager:
             
             # 添加元数据
             timestamp = datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
-            dialogue_data_with_meta = dialogue_data.copy()
+            dialogue_data_with_meta = self._with_turns(dialogue_data)
             dialogue_data_with_meta["metadata"] = {
                 "timestamp": timestamp,
                 "context": context,
-                "goal": goal
+                "goal": goal,
+                **(extra_metadata or {})
             }
             
             # 保存 JSON 文件
-            with open(json_filename, 'w', encoding='utf-8') as f:
-                json.dump(dialogue_data_with_meta, f, ensure_ascii=False, indent=2)
+            self._write_json(json_filename, dialogue_data_with_meta)
             
             # 生成并保存 Markdown 文件
-            with open(md_filename, 'w', encoding='utf-8') as f:
-                # 写入标题和元数据
-                f.write(f"# 对话记录: {context[:30]}...\n\n")
-                f.write(f"**生成时间**: {timestamp}\n\n")
-                f.write(f"**对话背景**: {context}\n\n")
-                f.write(f"**对话目标**: {goal}\n\n")
-                
-                # 写入原始对话内容
-                f.write("## 对话内容\n\n")
-                f.write("```\n")
-                f.write(dialogue_data.get("original_text", ""))
-                f.write("\n```\n\n")
-                
-                # 写入关键节点
-                if dialogue_data.get("key_points"):
-                    f.write("## 关键节点\n\n")
-                    for point in dialogue_data.get("key_points", []):
-                        f.write(f"- {point}\n")
-                    f.write("\n")
-                
-                # 写入关键词汇
-                if dialogue_data.get("key_vocabulary"):
-                    f.write("## 关键情节词汇\n\n")
-                    for vocab in dialogue_data.get("key_vocabulary", []):
-                        f.write(f"- {vocab}\n")
-                    f.write("\n")
-                
-                # 写入关键句型
-                if dialogue_data.get("key_sentences"):
-                    f.write("## 关键情节句型\n\n")
-                    for sentence in dialogue_data.get("key_sentences", []):
-                        f.write(f"- {sentence}\n")
-                    f.write("\n")
-                
-                # 写入对话意图
-                if dialogue_data.get("intentions"):
-                    f.write("## 对话意图\n\n")
-                    for intent in dialogue_data.get("intentions", []):
-                        f.write(f"- {intent}\n")
+            self._write_text(md_filename, render_initial_dialogue_markdown(dialogue_data, context, goal, timestamp))
+            
+            self._index("initial", json_filename, md_filename, dialogue_data_with_meta)
+            self._cache_initial(json_filename, dialogue_data_with_meta)
             
             return (json_filename, md_filename)
         except Exception as e:
@@ -117,6 +215,9 @@ class FileManager:
         """
         更新已存在的对话数据文件（JSON 和 MD）
         
+        只写入有变化的内容：与上次保存的数据相同时不写入任何文件，
+        只有 Markdown 中展示的字段变化时才重新生成 Markdown
+        
         Args:
             json_path (str): JSON 文件路径
             dialogue_data (dict): 新的对话数据
@@ -127,112 +228,86 @@ class FileManager:
             tuple: (json_path, md_path) 元组
         """
         try:
-            if not json_path or not os.path.exists(json_path):
+            # 元数据依次从内存缓存、索引、原始 JSON 文件获取
+            previous = self._cache_get(self._initial_cache, json_path) if json_path else None
+            if previous is not None:
+                indexed_metadata = previous["metadata"]
+            else:
+                indexed_metadata = self.store.get_metadata(json_path) if self.store and json_path else None
+            
+            if not indexed_metadata and not self._file_exists(json_path):
                 return self.save_initial_dialogue(dialogue_data, context, goal)
                 
             # 获取文件名基础部分和 MD 文件路径
             base_path = os.path.splitext(json_path)[0]
             md_path = f"{base_path}.md"
             
-            # 从原始 JSON 文件读取元数据
-            metadata = {}
-            try:
-                with open(json_path, 'r', encoding='utf-8') as f:
-                    original_data = json.load(f)
-                    if "metadata" in original_data:
-                        metadata = original_data["metadata"]
-            except Exception:
-                # 如果原始文件读取失败，使用新的元数据
-                timestamp = datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
-                metadata = {
-                    "timestamp": timestamp,
-                    "context": context,
-                    "goal": goal
-                }
-            
-            # 更新对话数据和元数据
-            dialogue_data_with_meta = dialogue_data.copy()
+            # 没有缓存时视为全部字段都已变化
+            dialogue_data_with_meta = self._with_turns(dialogue_data)
+            changed_fields = self._changed_fields(previous, dialogue_data_with_meta) if previous is not None else None
+            if changed_fields is not None and not changed_fields:
+                return (json_path, md_path)
+            
+            # 缓存和索引中都没有记录时，从原始 JSON 文件读取元数据
+            metadata = indexed_metadata or {}
+            if not metadata:
+                try:
+                    with open(json_path, 'r', encoding='utf-8') as f:
+                        original_data = json.load(f)
+                        if "metadata" in original_data:
+                            metadata = original_data["metadata"]
+                except Exception:
+                    # 如果原始文件读取失败，使用新的元数据
+                    timestamp = datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
+                    metadata = {
+                        "timestamp": timestamp,
+                        "context": context,
+                        "goal": goal
+                    }
+            
+            # 更新元数据
             dialogue_data_with_meta["metadata"] = metadata
             
             # 保存更新后的 JSON 文件
-            with open(json_path, 'w', encoding='utf-8') as f:
-                json.dump(dialogue_data_with_meta, f, ensure_ascii=False, indent=2)
+            self._write_json(json_path, dialogue_data_with_meta)
             
-            # 更新 Markdown 文件
-            timestamp = metadata.get("timestamp", "")
-            with open(md_path, 'w', encoding='utf-8') as f:
-                # 写入标题和元数据
-                f.write(f"# 对话记录: {context[:30]}...\n\n")
-                f.write(f"**生成时间**: {timestamp}\n\n")
-                f.write(f"**对话背景**: {metadata.get('context', context)}\n\n")
-                f.write(f"**对话目标**: {metadata.get('goal', goal)}\n\n")
-                
-                # 写入原始对话内容
-                f.write("## 对话内容\n\n")
-                f.write("```\n")
-                f.write(dialogue_data.get("original_text", ""))
-                f.write("\n```\n\n")
-                
-                # 写入关键节点
-                if dialogue_data.get("key_points"):
-                    f.write("## 关键节点\n\n")
-                    for point in dialogue_data.get("key_points", []):
-                        f.write(f"- {point}\n")
-                    f.write("\n")
-                
-                # 写入关键词汇
-                if dialogue_data.get("key_vocabulary"):
-                    f.write("## 关键情节词汇\n\n")
-                    for vocab in dialogue_data.get("key_vocabulary", []):
-                        f.write(f"- {vocab}\n")
-                    f.write("\n")
-                
-                # 写入关键句型
-                if dialogue_data.get("key_sentences"):
-                    f.write("## 关键情节句型\n\n")
-                    for sentence in dialogue_data.get("key_sentences", []):
-                        f.write(f"- {sentence}\n")
-                    f.write("\n")
-                
-                # 写入对话意图
-                if dialogue_data.get("intentions"):
-                    f.write("## 对话意图\n\n")
-                    for intent in dialogue_data.get("intentions", []):
-                        f.write(f"- {intent}\n")
+            # 只有 Markdown 中展示的字段变化时才更新 Markdown 文件
+            if changed_fields is None or changed_fields & INITIAL_MARKDOWN_FIELDS:
+                self._write_text(md_path, render_initial_dialogue_markdown(
+                    dialogue_data,
+                    metadata.get("context", context),
+                    metadata.get("goal", goal),
+                    metadata.get("timestamp", "")
+                ))
+            
+            self._index("initial", json_path, md_path, dialogue_data_with_meta)
+            self._cache_initial(json_path, dialogue_data_with_meta)
             
             return (json_path, md_path)
         except Exception as e:
             print(f"更新对话数据文件时出错: {e}")
             return (None, None)
     
-    # Function to prepare and format markdown output for AI traits
-    def _format_ai_traits_for_markdown(self, ai_traits_data):
-        """Helper function to format AI traits for markdown output based on emotion mode"""
-        output = ""
-        
-        if ai_traits_data:
-            if "ai_traits_chara" in ai_traits_data and ai_traits_data["ai_traits_chara"]:
-                output += f"**性格特质**: {ai_traits_data['ai_traits_chara']}\n\n"
-            if "ai_traits_mantra" in ai_traits_data and ai_traits_data["ai_traits_mantra"]:
-                output += f"**口头禅**: {ai_traits_data['ai_traits_mantra']}\n\n"
-            if "ai_traits_tone" in ai_traits_data and ai_traits_data["ai_traits_tone"]:
-                output += f"**语气**: {ai_traits_data['ai_traits_tone']}\n\n"
-                
-            # Handle emotion display based on mode
-            if "ai_emo_mode" in ai_traits_data:
-                output += f"**动作/表情模式**: {ai_traits_data['ai_emo_mode']}\n\n"
-                
-                if ai_traits_data["ai_emo_mode"] == "自定义模式" and "ai_emo" in ai_traits_data and ai_traits_data["ai_emo"]:
-                    output += f"**动作/表情描述**: {ai_traits_data['ai_emo']}\n\n"
-                elif ai_traits_data["ai_emo_mode"] == "自动模式":
-                    output += "**动作/表情描述**: 根据上下文自动生成\n\n"
-            elif "ai_emo" in ai_traits_data and ai_traits_data["ai_emo"]:
-                output += f"**动作/表情描述**: {ai_traits_data['ai_emo']}\n\n"
-        
-        return output
+    def get_initial_metadata(self, json_path):
+        """
+        获取已保存初始对话的完整元数据（先查最近保存的缓存，后台写入尚未完成时也能取得）
         
+        Args:
+            json_path (str): JSON 文件路径
+            
+        Returns:
+            dict: 元数据；无法读取时返回 None
+        """
+        saved = self._cache_get(self._initial_cache, json_path)
+        if saved is None:
+            saved = self.load_dialogue(json_path)
+        if not saved or not isinstance(saved.get("metadata"), dict):
+            return None
+        return dict(saved["metadata"])
+    
     def save_final_dialogue(self, dialogue_text, initial_dialogue_data, user_traits, ai_traits, 
-                             user_traits_data=None, ai_traits_data=None, directory="final_dialogue_data"):
+                             user_traits_data=None, ai_traits_data=None, directory="final_dialogue_data",
+                             extra_metadata=None):
         """
         保存 Agent 2 生成的最终对话内容为 JSON 和 Markdown 格式
         
@@ -244,6 +319,7 @@ class FileManager:
             user_traits_data (dict, optional): 用户特征详细数据（V2格式）
             ai_traits_data (dict, optional): AI特征详细数据（V2格式）
             directory (str): 存储目录
+            extra_metadata (dict, optional): 额外的元数据，如 model；语言和难度沿用初始对话的元数据
             
         Returns:
             tuple: (json_path, md_path) 元组
@@ -275,13 +351,16 @@ class FileManager:
             timestamp = datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
             final_dialogue_data = {
                 "final_text": dialogue_text,
+                "final_turns": parse_dialogue(dialogue_text),
                 "user_traits": user_traits,
                 "ai_traits": ai_traits,
-                "original_dialogue": initial_dialogue_data,
+                "original_dialogue_ref": self._store_original(initial_dialogue_data),
                 "metadata": {
                     "timestamp": timestamp,
                     "context": context,
-                    "goal": goal
+                    "goal": goal,
+                    **{key: metadata[key] for key in ("language", "difficulty") if key in metadata},
+                    **(extra_metadata or {})
                 }
             }
             
@@ -292,45 +371,15 @@ class FileManager:
                 final_dialogue_data["ai_traits_data"] = ai_traits_data
             
             # 保存 JSON 文件
-            with open(json_filename, 'w', encoding='utf-8') as f:
-                json.dump(final_dialogue_data, f, ensure_ascii=False, indent=2)
+            self._write_json(json_filename, final_dialogue_data)
             
             # 生成并保存 Markdown 文件
-            with open(md_filename, 'w', encoding='utf-8') as f:
-                # 写入标题和元数据
-                f.write(f"# 最终对话: {context[:30]}...\n\n")
-                f.write(f"**生成时间**: {timestamp}\n\n")
-                f.write(f"**对话背景**: {context}\n\n")
-                f.write(f"**对话目标**: {goal}\n\n")
-                
-                # 写入角色特质
-                f.write("## 角色特质\n\n")
-                
-                # 优先使用V2格式的详细特质
-                if user_traits_data:
-                    f.write("### 用户角色详情\n\n")
-                    if user_traits_data.get("user_traits_chara"):
-                        f.write(f"**性格特质**: {user_traits_data['user_traits_chara']}\n\n")
-                    if user_traits_data.get("user_traits_address"):
-                        f.write(f"**称呼方式**: {user_traits_data['user_traits_address']}\n\n")
-                    if user_traits_data.get("user_traits_custom"):
-                        f.write(f"**自定义特质**: {user_traits_data['user_traits_custom']}\n\n")
-                else:
-                    # 使用V1的综合特质
-                    f.write(f"**用户特征**: {user_traits}\n\n")
-                
-                if ai_traits_data:
-                    f.write("### AI角色详情\n\n")
-                    f.write(self._format_ai_traits_for_markdown(ai_traits_data))
-                else:
-                    # 使用V1的综合特质
-                    f.write(f"**AI 特征**: {ai_traits}\n\n")
-                
-                # 写入最终对话内容
-                f.write("## 最终对话\n\n")
-                f.write("```\n")
-                f.write(dialogue_text)
-                f.write("\n```\n")
+            self._write_text(md_filename, render_final_dialogue_markdown(
+                dialogue_text, context, goal, timestamp, user_traits, ai_traits,
+                user_traits_data, ai_traits_data
+            ))
+            
+            self._index("final", json_filename, md_filename, final_dialogue_data, initial_dialogue_data)
             
             return (json_filename, md_filename)
         except Exception as e:
@@ -355,7 +404,10 @@ class FileManager:
             tuple: (json_path, md_path) 元组
         """
         try:
-            if not json_path or not os.path.exists(json_path):
+            # 优先从索引读取原有记录，无需等待后台写入或解析 JSON 文件
+            original_data = self.store.get(json_path) if self.store and json_path else None
+            
+            if original_data is None and not self._file_exists(json_path):
                 # 如果文件不存在，创建新文件
                 context = ""
                 goal = ""
@@ -370,22 +422,26 @@ class FileManager:
             base_path = os.path.splitext(json_path)[0]
             md_path = f"{base_path}.md"
             
-            # 从原始 JSON 文件读取元数据
+            # 索引中没有记录时，从原始 JSON 文件读取元数据
             try:
-                with open(json_path, 'r', encoding='utf-8') as f:
-                    original_data = json.load(f)
-                    metadata = original_data.get("metadata", {})
-                    original_initial_dialogue = original_data.get("original_dialogue", {})
+                if original_data is None:
+                    with open(json_path, 'r', encoding='utf-8') as f:
+                        original_data = json.load(f)
+                metadata = original_data.get("metadata", {})
             except Exception:
                 # 如果原始文件读取失败，使用新的元数据
+                original_data = {}
                 metadata = {}
                 if initial_dialogue_data and "metadata" in initial_dialogue_data:
                     metadata = initial_dialogue_data["metadata"]
-                original_initial_dialogue = initial_dialogue_data
             
-            # 如果没有初始对话数据，使用原始数据
-            if not initial_dialogue_data:
-                initial_dialogue_data = original_initial_dialogue
+            # 没有传入初始对话数据时沿用原有引用，无需读取初始对话内容
+            if initial_dialogue_data:
+                original_ref = self._store_original(initial_dialogue_data)
+            elif original_data.get("original_dialogue_ref"):
+                original_ref = original_data["original_dialogue_ref"]
+            else:
+                original_ref = self._store_original(original_data.get("original_dialogue"))
             
             # 获取对话背景和目标
             context = metadata.get("context", "")
@@ -398,9 +454,10 @@ class FileManager:
             # 构造新的最终对话数据
             final_dialogue_data = {
                 "final_text": dialogue_text,
+                "final_turns": parse_dialogue(dialogue_text),
                 "user_traits": user_traits,
                 "ai_traits": ai_traits,
-                "original_dialogue": initial_dialogue_data,
+                "original_dialogue_ref": original_ref,
                 "metadata": metadata
             }
             
@@ -411,47 +468,196 @@ class FileManager:
                 final_dialogue_data["ai_traits_data"] = ai_traits_data
             
             # 保存更新后的 JSON 文件
-            with open(json_path, 'w', encoding='utf-8') as f:
-                json.dump(final_dialogue_data, f, ensure_ascii=False, indent=2)
+            self._write_json(json_path, final_dialogue_data)
             
             # 更新 Markdown 文件
-            with open(md_path, 'w', encoding='utf-8') as f:
-                # 写入标题和元数据
-                f.write(f"# 最终对话: {context[:30]}...\n\n")
-                f.write(f"**生成时间**: {timestamp}\n\n")
-                f.write(f"**对话背景**: {context}\n\n")
-                f.write(f"**对话目标**: {goal}\n\n")
-                
-                # 写入角色特质
-                f.write("## 角色特质\n\n")
-                
-                # 优先使用V2格式的详细特质
-                if user_traits_data:
-                    f.write("### 用户角色详情\n\n")
-                    if user_traits_data.get("user_traits_chara"):
-                        f.write(f"**性格特质**: {user_traits_data['user_traits_chara']}\n\n")
-                    if user_traits_data.get("user_traits_address"):
-                        f.write(f"**称呼方式**: {user_traits_data['user_traits_address']}\n\n")
-                    if user_traits_data.get("user_traits_custom"):
-                        f.write(f"**自定义特质**: {user_traits_data['user_traits_custom']}\n\n")
-                else:
-                    # 使用V1的综合特质
-                    f.write(f"**用户特征**: {user_traits}\n\n")
-                
-                if ai_traits_data:
-                    f.write("### AI角色详情\n\n")
-                    f.write(self._format_ai_traits_for_markdown(ai_traits_data))
-                else:
-                    # 使用V1的综合特质
-                    f.write(f"**AI 特征**: {ai_traits}\n\n")
-                
-                # 写入最终对话内容
-                f.write("## 最终对话\n\n")
-                f.write("```\n")
-                f.write(dialogue_text)
-                f.write("\n```\n")
+            self._write_text(md_path, render_final_dialogue_markdown(
+                dialogue_text, context, goal, timestamp, user_traits, ai_traits,
+                user_traits_data, ai_traits_data
+            ))
+            
+            if self.store:
+                # 全文索引需要初始对话中的关键词汇和句型（共享存储的读取结果有缓存）
+                source = initial_dialogue_data or (self.blobs.get(original_ref) if original_ref else None)
+                self._index("final", json_path, md_path, final_dialogue_data, source)
             
             return (json_path, md_path)
         except Exception as e:
             print(f"更新最终对话内容文件时出错: {e}")
             return (None, None)
+
+    def start_long_dialogue(self, context, goal, settings=None, directory="long_dialogue_data"):
+        """
+        创建长篇对话的存储文件，后续章节以追加方式写入
+        
+        JSONL 文件第一行为元数据，之后每行一个章节；Markdown 文件随章节追加
+        
+        Args:
+            context (str): 对话背景
+            goal (str): 对话目标
+            settings (dict, optional): 生成参数（语言、难度、轮数等）
+            directory (str): 存储目录
+            
+        Returns:
+            tuple: (jsonl_path, md_path) 元组
+        """
+        try:
+            save_dir = self._ensure_directory(directory)
+            base_filename = self._generate_filename("long", context)
+            jsonl_filename = f"{save_dir}/{base_filename}.jsonl"
+            md_filename = f"{save_dir}/{base_filename}.md"
+            
+            timestamp = datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
+            metadata = {
+                "type": "metadata",
+                "timestamp": timestamp,
+                "context": context,
+                "goal": goal,
+                "settings": settings or {}
+            }
+            
+            self._write_text(jsonl_filename, json.dumps(metadata, ensure_ascii=False) + "\n")
+            self._write_text(md_filename, render_long_dialogue_header(context, goal, timestamp))
+            
+            return (jsonl_filename, md_filename)
+        except Exception as e:
+            print(f"创建长篇对话文件时出错: {e}")
+            return (None, None)
+    
+    def append_long_dialogue_chapter(self, jsonl_path, chapter):
+        """
+        追加一个章节到长篇对话文件，不读取或重写已有内容
+        
+        Args:
+            jsonl_path (str): start_long_dialogue 返回的 JSONL 文件路径
+            chapter (dict): InitialDialogueAgent.generate_long_dialogue 产出的章节数据
+            
+        Returns:
+            bool: 是否写入成功
+        """
+        try:
+            md_path = f"{os.path.splitext(jsonl_path)[0]}.md"
+            record = dict(chapter, type="chapter")
+            
+            self._append_text(jsonl_path, json.dumps(record, ensure_ascii=False) + "\n")
+            self._append_text(md_path, render_long_dialogue_chapter(chapter))
+            
+            return True
+        except Exception as e:
+            print(f"追加长篇对话章节时出错: {e}")
+            return False
+    
+    def iter_long_dialogue_chapters(self, jsonl_path):
+        """
+        逐行读取长篇对话的章节，不一次性加载整个文件
+        
+        Args:
+            jsonl_path (str): 长篇对话 JSONL 文件路径
+            
+        Yields:
+            dict: 章节数据
+        """
+        if self.writer:
+            self.writer.wait_for(jsonl_path)
+        with open(jsonl_path, 'r', encoding='utf-8') as f:
+            for line in f:
+                if not line.strip():
+                    continue
+                record = json.loads(line)
+                if record.get("type") == "chapter":
+                    yield record
+    
+    def list_dialogues(self, kind=None, limit=50, offset=0, **filters):
+        """
+        按元数据筛选并列出已保存的对话（需要启用索引）
+        
+        Args:
+            kind (str, optional): "initial" 或 "final"
+            limit (int): 返回条数上限
+            offset (int): 跳过的条数，用于分页
+            **filters: 元数据字段的精确匹配条件（context、goal、language、difficulty、model）
+            
+        Returns:
+            list: 对话的路径和元数据；未启用索引时返回空列表
+        """
+        if not self.store:
+            return []
+        return self.store.list_dialogues(kind, limit, offset, **filters)
+    
+    def count_dialogues(self, kind=None, **filters):
+        """统计满足筛选条件的对话数量（需要启用索引），用于分页"""
+        if not self.store:
+            return 0
+        return self.store.count(kind, **filters)
+    
+    def get_filter_options(self, field, kind=None):
+        """获取某个元数据字段的所有取值（需要启用索引），用于构建筛选选项"""
+        if not self.store:
+            return []
+        return self.store.get_distinct_values(field, kind)
+    
+    def load_dialogue(self, json_path):
+        """
+        读取已保存的对话数据，优先从索引读取，否则解析 JSON 文件
+        最终对话记录中引用的初始对话会被展开到 original_dialogue 字段；
+        最近读取的对话保存在 LRU 缓存中，重复打开时无需再次读取
+        
+        Args:
+            json_path (str): JSON 文件路径
+            
+        Returns:
+            dict: 对话数据；读取失败时返回 None
+        """
+        cached = self._cache_get(self._loaded_cache, json_path)
+        if cached is not None:
+            return copy.deepcopy(cached)
+        
+        data = self.store.get(json_path) if self.store else None
+        try:
+            if data is None:
+                if not self._file_exists(json_path):
+                    return None
+                with open(json_path, 'r', encoding='utf-8') as f:
+                    data = json.load(f)
+        except Exception as e:
+            print(f"读取对话数据时出错: {e}")
+            return None
+        if "original_dialogue_ref" in data:
+            data["original_dialogue"] = self.resolve_original_dialogue(data)
+        self._cache_put(self._loaded_cache, json_path, data)
+        return data
+    
+    def search_dialogues(self, query, kind=None, field=None, limit=50):
+        """
+        全文搜索已保存的对话（需要启用索引）
+        
+        Args:
+            query (str): 搜索词
+            kind (str, optional): "initial" 或 "final"
+            field (str, optional): 只搜索 text（对话正文）、vocabulary（关键词汇）或 sentences（关键句型）
+            limit (int): 返回条数上限
+            
+        Returns:
+            list: 匹配对话的路径、元数据和命中片段；未启用索引时返回空列表
+        """
+        if not self.store:
+            return []
+        return self.store.search(query, kind, field, limit)
+    
+    def rebuild_index(self, initial_directory="dialogue_data", final_directory="final_dialogue_data"):
+        """
+        将目录中已有的对话文件导入索引，用于索引建立之前保存的对话
+        
+        Returns:
+            int: 导入的对话数量
+        """
+        if not self.store:
+            return 0
+        self.flush()
+        imported = 0
+        for kind, directory in (("initial", initial_directory), ("final", final_directory)):
+            full_path = os.path.join(self.base_dir, directory)
+            if os.path.isdir(full_path):
+                load_source = self.resolve_original_dialogue if kind == "final" else None
+                imported += self.store.import_directory(full_path, kind, load_source)
+        return imported
@@ -0,0 +1,249 @@
+# -*- coding: utf-8 -*- # Ensure UTF-8 encoding for wider character support
+
+import os
+import json
+import time
+import uuid
+import socket
+import sqlite3
+import threading
+
+
+# 任务状态
+JOB_QUEUED = "queued"
+JOB_RUNNING = "running"
+JOB_DONE = "done"
+JOB_FAILED = "failed"
+FINISHED_STATUSES = (JOB_DONE, JOB_FAILED)
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id TEXT PRIMARY KEY,
+    kind TEXT NOT NULL,
+    status TEXT NOT NULL,
+    payload TEXT NOT NULL,
+    result TEXT,
+    error TEXT,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    created_at REAL NOT NULL,
+    started_at REAL,
+    finished_at REAL,
+    worker TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_jobs_status_created ON jobs (status, created_at);
+"""
+
+
+def _pid_alive(pid):
+    """本机上的进程是否仍在运行（Windows 上无法安全探测，视为仍在运行）"""
+    if os.name == "nt":
+        return True
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except OSError:
+        return True
+    return True
+
+
+class JobQueue:
+    """
+    基于 SQLite 的持久化任务队列
+    任务提交后立即落盘，进程重启后未完成的任务可以重新排队；
+    领取任务在 IMMEDIATE 事务中完成，多个线程或进程共用同一个数据库时不会重复领取；
+    领取时记录执行者（主机名:进程号），本机上已退出的进程领取的任务可以立即重新排队
+    """
+    def __init__(self, path="job_queue.db", worker_id=None):
+        """
+        Args:
+            path (str): SQLite 文件路径
+            worker_id (str, optional): 执行者标识，默认为 "主机名:进程号"
+        """
+        self.path = path
+        self.worker_id = worker_id or f"{socket.gethostname()}:{os.getpid()}"
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=30, isolation_level=None)
+        self._conn.row_factory = sqlite3.Row
+        with self._lock:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.executescript(_SCHEMA)
+            # 旧版本创建的数据库没有 worker 列
+            columns = {row["name"] for row in self._conn.execute("PRAGMA table_info(jobs)")}
+            if "worker" not in columns:
+                self._conn.execute("ALTER TABLE jobs ADD COLUMN worker TEXT")
+
+    @staticmethod
+    def _row_to_job(row):
+        """将数据库行转换为任务字典"""
+        job = dict(row)
+        job["payload"] = json.loads(job["payload"])
+        job["result"] = json.loads(job["result"]) if job["result"] else None
+        return job
+
+    def submit(self, kind, payload):
+        """
+        提交任务
+
+        Args:
+            kind (str): 任务类型
+            payload (dict): 可 JSON 序列化的任务参数
+
+        Returns:
+            str: 任务 ID
+        """
+        job_id = uuid.uuid4().hex
+        with self._lock:
+            self._conn.execute(
+                "INSERT INTO jobs (id, kind, status, payload, created_at) VALUES (?, ?, ?, ?, ?)",
+                (job_id, kind, JOB_QUEUED, json.dumps(payload, ensure_ascii=False), time.time())
+            )
+        return job_id
+
+    def claim(self):
+        """
+        领取最早提交的排队任务并标记为执行中
+
+        Returns:
+            dict: 任务；没有排队任务时返回 None
+        """
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                row = self._conn.execute(
+                    "SELECT * FROM jobs WHERE status = ? ORDER BY created_at LIMIT 1", (JOB_QUEUED,)
+                ).fetchone()
+                if row is None:
+                    self._conn.execute("COMMIT")
+                    return None
+                self._conn.execute(
+                    "UPDATE jobs SET status = ?, started_at = ?, attempts = attempts + 1, worker = ? WHERE id = ?",
+                    (JOB_RUNNING, time.time(), self.worker_id, row["id"])
+                )
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+        job = self._row_to_job(row)
+        job["status"] = JOB_RUNNING
+        job["attempts"] += 1
+        job["worker"] = self.worker_id
+        return job
+
+    def complete(self, job_id, result):
+        """标记任务完成并保存结果"""
+        with self._lock:
+            self._conn.execute(
+                "UPDATE jobs SET status = ?, result = ?, error = NULL, finished_at = ? WHERE id = ?",
+                (JOB_DONE, json.dumps(result, ensure_ascii=False), time.time(), job_id)
+            )
+
+    def fail(self, job_id, error):
+        """标记任务失败"""
+        with self._lock:
+            self._conn.execute(
+                "UPDATE jobs SET status = ?, error = ?, finished_at = ? WHERE id = ?",
+                (JOB_FAILED, str(error), time.time(), job_id)
+            )
+
+    def get(self, job_id):
+        """获取任务；不存在时返回 None"""
+        with self._lock:
+            row = self._conn.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return self._row_to_job(row) if row else None
+
+    def get_position(self, job_id):
+        """排队任务前面还有多少个排队任务；任务不在排队中时返回 None"""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT created_at FROM jobs WHERE id = ? AND status = ?", (job_id, JOB_QUEUED)
+            ).fetchone()
+            if row is None:
+                return None
+            return self._conn.execute(
+                "SELECT COUNT(*) FROM jobs WHERE status = ? AND created_at < ?", (JOB_QUEUED, row["created_at"])
+            ).fetchone()[0]
+
+    def count(self, status=None):
+        """统计任务数量"""
+        with self._lock:
+            if status is None:
+                return self._conn.execute("SELECT COUNT(*) FROM jobs").fetchone()[0]
+            return self._conn.execute("SELECT COUNT(*) FROM jobs WHERE status = ?", (status,)).fetchone()[0]
+
+    def _release(self, job_ids, max_attempts):
+        """
+        处理执行中断的任务：尝试次数未达到 max_attempts 的重新排队，否则标记为失败
+        （调用方需持有锁并处于事务中）
+        """
+        released = 0
+        for job_id in job_ids:
+            cursor = self._conn.execute(
+                "UPDATE jobs SET status = ?, started_at = NULL, worker = NULL WHERE id = ? AND status = ? AND attempts < ?",
+                (JOB_QUEUED, job_id, JOB_RUNNING, max_attempts)
+            )
+            if not cursor.rowcount:
+                cursor = self._conn.execute(
+                    "UPDATE jobs SET status = ?, error = ?, finished_at = ? WHERE id = ? AND status = ?",
+                    (JOB_FAILED, "任务执行中断且已达到最大尝试次数", time.time(), job_id, JOB_RUNNING)
+                )
+            released += cursor.rowcount
+        return released
+
+    def _recover(self, select_running, max_attempts):
+        """在 IMMEDIATE 事务中找出中断的执行中任务并处理，返回处理的任务数"""
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                rows = self._conn.execute(
+                    "SELECT id, worker, started_at FROM jobs WHERE status = ?", (JOB_RUNNING,)
+                ).fetchall()
+                released = self._release([row["id"] for row in rows if select_running(row)], max_attempts)
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+        return released
+
+    def recover_stale(self, timeout, max_attempts=3):
+        """
+        处理执行时间超过 timeout 秒的任务（通常是执行它的进程已经退出）：
+        尝试次数未达到 max_attempts 的重新排队，否则标记为失败
+
+        Returns:
+            int: 处理的任务数
+        """
+        cutoff = time.time() - timeout
+        return self._recover(lambda row: row["started_at"] is not None and row["started_at"] < cutoff, max_attempts)
+
+    def recover_orphaned(self, max_attempts=3):
+        """
+        立即处理本机上已退出的进程领取的任务（例如应用崩溃或重启前正在执行的任务），
+        不必等待 recover_stale 的超时；其他主机的任务仍按超时处理
+
+        Returns:
+            int: 处理的任务数
+        """
+        host, _, pid = self.worker_id.rpartition(":")
+
+        def orphaned(row):
+            worker_host, _, worker_pid = (row["worker"] or "").rpartition(":")
+            if worker_host != host or not worker_pid.isdigit() or worker_pid == pid:
+                return False
+            return not _pid_alive(int(worker_pid))
+
+        return self._recover(orphaned, max_attempts)
+
+    def purge_finished(self, older_than):
+        """删除完成时间早于 older_than 秒之前的已结束任务，返回删除数量"""
+        cutoff = time.time() - older_than
+        with self._lock:
+            return self._conn.execute(
+                f"DELETE FROM jobs WHERE status IN ({', '.join('?' * len(FINISHED_STATUSES))}) AND finished_at < ?",
+                (*FINISHED_STATUSES, cutoff)
+            ).rowcount
+
+    def close(self):
+        """关闭数据库连接"""
+        with self._lock:
+            self._conn.close()
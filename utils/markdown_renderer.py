@@ -0,0 +1,159 @@
+# -*- coding: utf-8 -*- # Ensure UTF-8 encoding for wider character support
+
+import io
+
+# 文档各部分的模板，渲染时拼接到同一个列表中，最后一次性合并
+_HEADER_TEMPLATE = "# {title}: {short_context}...\n\n**生成时间**: {timestamp}\n\n**对话背景**: {context}\n\n**对话目标**: {goal}\n\n"
+_CODE_BLOCK_TEMPLATE = "## {heading}\n\n```\n{text}\n```\n"
+_FIELD_TEMPLATE = "**{label}**: {value}\n\n"
+
+# 初始对话中按顺序输出的列表字段
+_INITIAL_LIST_SECTIONS = [
+    ("key_points", "关键节点"),
+    ("key_vocabulary", "关键情节词汇"),
+    ("key_sentences", "关键情节句型"),
+    ("intentions", "对话意图"),
+]
+
+# 初始对话 Markdown 中展示的字段，其他字段变化时无需重新生成 Markdown
+INITIAL_MARKDOWN_FIELDS = frozenset(["original_text"] + [key for key, _ in _INITIAL_LIST_SECTIONS])
+
+_USER_TRAIT_FIELDS = [
+    ("user_traits_chara", "性格特质"),
+    ("user_traits_address", "称呼方式"),
+    ("user_traits_custom", "自定义特质"),
+]
+
+_AI_TRAIT_FIELDS = [
+    ("ai_traits_chara", "性格特质"),
+    ("ai_traits_mantra", "口头禅"),
+    ("ai_traits_tone", "语气"),
+]
+
+
+def _render_header(parts, title, context, goal, timestamp):
+    """渲染标题和元数据"""
+    parts.append(_HEADER_TEMPLATE.format(
+        title=title, short_context=context[:30], timestamp=timestamp, context=context, goal=goal
+    ))
+
+
+def _render_ai_traits(parts, ai_traits_data):
+    """根据表情模式渲染 AI 角色特质"""
+    for key, label in _AI_TRAIT_FIELDS:
+        if ai_traits_data.get(key):
+            parts.append(_FIELD_TEMPLATE.format(label=label, value=ai_traits_data[key]))
+
+    if "ai_emo_mode" in ai_traits_data:
+        parts.append(_FIELD_TEMPLATE.format(label="动作/表情模式", value=ai_traits_data["ai_emo_mode"]))
+        if ai_traits_data["ai_emo_mode"] == "自定义模式" and ai_traits_data.get("ai_emo"):
+            parts.append(_FIELD_TEMPLATE.format(label="动作/表情描述", value=ai_traits_data["ai_emo"]))
+        elif ai_traits_data["ai_emo_mode"] == "自动模式":
+            parts.append(_FIELD_TEMPLATE.format(label="动作/表情描述", value="根据上下文自动生成"))
+    elif ai_traits_data.get("ai_emo"):
+        parts.append(_FIELD_TEMPLATE.format(label="动作/表情描述", value=ai_traits_data["ai_emo"]))
+
+
+def render_initial_dialogue_markdown(dialogue_data, context, goal, timestamp):
+    """
+    渲染初始对话的 Markdown 文档
+
+    Args:
+        dialogue_data (dict): 对话数据
+        context (str): 对话背景
+        goal (str): 对话目标
+        timestamp (str): 生成时间
+
+    Returns:
+        str: Markdown 文本
+    """
+    parts = []
+    _render_header(parts, "对话记录", context, goal, timestamp)
+    parts.append(_CODE_BLOCK_TEMPLATE.format(heading="对话内容", text=dialogue_data.get("original_text", "")))
+    parts.append("\n")
+
+    sections = []
+    for key, heading in _INITIAL_LIST_SECTIONS:
+        items = dialogue_data.get(key)
+        if items:
+            sections.append(f"## {heading}\n\n" + "".join(f"- {item}\n" for item in items))
+    parts.append("\n".join(sections))
+    return "".join(parts)
+
+
+def render_final_dialogue_markdown(dialogue_text, context, goal, timestamp, user_traits, ai_traits,
+                                   user_traits_data=None, ai_traits_data=None):
+    """
+    渲染最终对话的 Markdown 文档
+
+    Args:
+        dialogue_text (str): 最终对话内容
+        context (str): 对话背景
+        goal (str): 对话目标
+        timestamp (str): 生成时间
+        user_traits (str): 用户特征（V1格式）
+        ai_traits (str): AI 特征（V1格式）
+        user_traits_data (dict, optional): 用户特征详细数据（V2格式）
+        ai_traits_data (dict, optional): AI特征详细数据（V2格式）
+
+    Returns:
+        str: Markdown 文本
+    """
+    parts = []
+    _render_header(parts, "最终对话", context, goal, timestamp)
+    parts.append("## 角色特质\n\n")
+
+    # 优先使用V2格式的详细特质，否则使用V1的综合特质
+    if user_traits_data:
+        parts.append("### 用户角色详情\n\n")
+        for key, label in _USER_TRAIT_FIELDS:
+            if user_traits_data.get(key):
+                parts.append(_FIELD_TEMPLATE.format(label=label, value=user_traits_data[key]))
+    else:
+        parts.append(_FIELD_TEMPLATE.format(label="用户特征", value=user_traits))
+
+    if ai_traits_data:
+        parts.append("### AI角色详情\n\n")
+        _render_ai_traits(parts, ai_traits_data)
+    else:
+        parts.append(_FIELD_TEMPLATE.format(label="AI 特征", value=ai_traits))
+
+    parts.append(_CODE_BLOCK_TEMPLATE.format(heading="最终对话", text=dialogue_text))
+    return "".join(parts)
+
+
+def render_long_dialogue_header(context, goal, timestamp):
+    """渲染长篇对话 Markdown 文档的标题和元数据"""
+    parts = []
+    _render_header(parts, "长篇对话", context, goal, timestamp)
+    return "".join(parts)
+
+
+def render_long_dialogue_chapter(chapter):
+    """
+    渲染长篇对话的一个章节，用于追加到已有的 Markdown 文档
+
+    Args:
+        chapter (dict): 章节数据，包含 chapter、start_turn、end_turn、text 和 plot_beats
+
+    Returns:
+        str: Markdown 文本
+    """
+    parts = [
+        f"## 第 {chapter.get('chapter')} 章 (第 {chapter.get('start_turn')}-{chapter.get('end_turn')} 轮)\n\n",
+        f"```\n{chapter.get('text', '')}\n```\n\n"
+    ]
+    if chapter.get("plot_beats"):
+        parts.append("".join(f"- {beat}\n" for beat in chapter["plot_beats"]))
+        parts.append("\n")
+    return "".join(parts)
+
+
+def render_to_stream(markdown_text):
+    """
+    将渲染好的 Markdown 放入内存流，用于下载而无需落盘
+
+    Returns:
+        io.BytesIO: UTF-8 编码的内存流
+    """
+    return io.BytesIO(markdown_text.encode("utf-8"))
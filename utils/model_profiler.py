@@ -0,0 +1,224 @@
+# -*- coding: utf-8 -*- # Ensure UTF-8 encoding for wider character support
+
+import time
+import atexit
+import sqlite3
+import logging
+import threading
+
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS model_profiles (
+    agent_type TEXT NOT NULL,
+    model TEXT NOT NULL,
+    calls INTEGER NOT NULL,
+    successes INTEGER NOT NULL,
+    avg_latency REAL,
+    updated_at REAL NOT NULL,
+    PRIMARY KEY (agent_type, model)
+)
+"""
+
+
+class ModelProfileStore:
+    """
+    模型性能档案，记录每个 Agent 类型下各模型的调用延迟和成功率，供"最快可用"模式自动选择模型
+    未指定 path 时只保存在内存中；指定后保存在 SQLite 文件中，多个进程可以共用。
+    调用记录先累积在内存，每隔 save_interval 秒合并到文件中已有的数据（其他进程写入的记录不会被覆盖）
+    """
+    def __init__(self, path=None, smoothing=0.3, save_interval=10.0):
+        """
+        Args:
+            path (str, optional): SQLite 文件路径，None 表示不持久化
+            smoothing (float): 延迟指数移动平均的平滑系数
+            save_interval (float): 两次写入文件的最短间隔（秒）
+        """
+        self.path = None
+        self.smoothing = smoothing
+        self.save_interval = save_interval
+        self._lock = threading.Lock()
+        self._profiles = {}
+        self._pending = {}  # (agent_type, model) -> 尚未写入文件的调用次数、成功次数和成功调用的延迟
+        self._last_save = 0.0
+        self._conn = None
+        if path:
+            self.configure(path)
+
+    def configure(self, path):
+        """
+        指定持久化文件并载入其中的档案（之前未写入的记录会先合并进去）
+
+        Args:
+            path (str): SQLite 文件路径
+        """
+        with self._lock:
+            if self._conn is not None:
+                self._save()
+                self._conn.close()
+            self.path = path
+            self._conn = sqlite3.connect(path, check_same_thread=False, timeout=30, isolation_level=None)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(_SCHEMA)
+            self._save()
+            self._last_save = time.time()
+
+    def _update(self, profile, latencies):
+        """把成功调用的延迟依次计入指数移动平均"""
+        for latency in latencies:
+            if profile["avg_latency"] is None:
+                profile["avg_latency"] = latency
+            else:
+                profile["avg_latency"] = (1 - self.smoothing) * profile["avg_latency"] + self.smoothing * latency
+
+    def _save(self):
+        """
+        把累积的记录合并到文件中并重新载入全部档案（调用方需持有锁）
+        读取和写入在同一个 IMMEDIATE 事务中完成，多个进程同时保存时不会丢失记录
+        """
+        if self._conn is None:
+            return
+        try:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                for (agent_type, model), pending in self._pending.items():
+                    row = self._conn.execute(
+                        "SELECT calls, successes, avg_latency FROM model_profiles WHERE agent_type = ? AND model = ?",
+                        (agent_type, model)
+                    ).fetchone()
+                    profile = {"calls": 0, "successes": 0, "avg_latency": None}
+                    if row is not None:
+                        profile = {"calls": row[0], "successes": row[1], "avg_latency": row[2]}
+                    profile["calls"] += pending["calls"]
+                    profile["successes"] += pending["successes"]
+                    self._update(profile, pending["latencies"])
+                    self._conn.execute(
+                        "INSERT INTO model_profiles (agent_type, model, calls, successes, avg_latency, updated_at) "
+                        "VALUES (?, ?, ?, ?, ?, ?) ON CONFLICT (agent_type, model) DO UPDATE SET "
+                        "calls = excluded.calls, successes = excluded.successes, "
+                        "avg_latency = excluded.avg_latency, updated_at = excluded.updated_at",
+                        (agent_type, model, profile["calls"], profile["successes"], profile["avg_latency"], time.time())
+                    )
+                rows = self._conn.execute(
+                    "SELECT agent_type, model, calls, successes, avg_latency FROM model_profiles"
+                ).fetchall()
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+        except Exception as e:
+            logging.warning(f"保存模型性能档案失败: {e}")
+            return
+        self._pending = {}
+        self._profiles = {}
+        for agent_type, model, calls, successes, avg_latency in rows:
+            self._profiles.setdefault(agent_type, {})[model] = {
+                "calls": calls,
+                "successes": successes,
+                "avg_latency": avg_latency
+            }
+
+    def flush(self):
+        """立即把累积的记录写入文件"""
+        with self._lock:
+            self._save()
+            self._last_save = time.time()
+
+    def record(self, agent_type, model, latency, success):
+        """
+        记录一次调用结果
+
+        Args:
+            agent_type (str): Agent 类型标识符
+            model (str): 模型ID
+            latency (float): 调用耗时（秒）
+            success (bool): 是否成功
+        """
+        with self._lock:
+            profile = self._profiles.setdefault(agent_type, {}).setdefault(model, {
+                "calls": 0,
+                "successes": 0,
+                "avg_latency": None
+            })
+            pending = self._pending.setdefault((agent_type, model), {"calls": 0, "successes": 0, "latencies": []})
+            profile["calls"] += 1
+            pending["calls"] += 1
+            if success:
+                profile["successes"] += 1
+                pending["successes"] += 1
+                # 只用成功调用更新延迟，失败调用的耗时通常是超时或立即报错
+                self._update(profile, [latency])
+                pending["latencies"].append(latency)
+            if self._conn is not None and time.time() - self._last_save >= self.save_interval:
+                self._save()
+                self._last_save = time.time()
+
+    def get_profile(self, agent_type, model):
+        """获取指定 Agent 类型下某个模型的档案"""
+        with self._lock:
+            profile = self._profiles.get(agent_type, {}).get(model)
+            return dict(profile) if profile else None
+
+    def get_profiled_models(self, agent_type):
+        """获取指定 Agent 类型下有调用记录的模型列表"""
+        with self._lock:
+            return list(self._profiles.get(agent_type, {}).keys())
+
+
+def get_model_price(model_details):
+    """
+    从 OpenRouter 模型目录数据中获取每 token 的价格（输入和输出价格之和）
+
+    Returns:
+        float: 价格；目录中没有价格信息时返回 None
+    """
+    pricing = (model_details or {}).get("pricing") or {}
+    try:
+        return float(pricing.get("prompt", 0)) + float(pricing.get("completion", 0))
+    except (TypeError, ValueError):
+        return None
+
+
+def select_fastest_acceptable_model(profile_store, agent_type, candidates, latency_slo,
+                                    get_model_details=None, min_success_rate=0.8, min_calls=3):
+    """
+    "最快可用"模式：在满足延迟 SLO 和成功率要求的模型中选择最便宜的，价格相同时选择更快的
+
+    Args:
+        profile_store (ModelProfileStore): 模型性能档案
+        agent_type (str): Agent 类型标识符
+        candidates (list): 候选模型ID列表
+        latency_slo (float): 延迟上限（秒）
+        get_model_details (callable, optional): 根据模型ID返回目录数据的函数，用于获取价格
+        min_success_rate (float): 最低成功率
+        min_calls (int): 参与评估所需的最少调用次数
+
+    Returns:
+        str: 选中的模型ID；没有足够数据时返回 None
+    """
+    acceptable = []
+    fallback = []
+    for model in candidates:
+        profile = profile_store.get_profile(agent_type, model)
+        if not profile or profile["calls"] < min_calls or profile["avg_latency"] is None:
+            continue
+        success_rate = profile["successes"] / profile["calls"]
+        if success_rate < min_success_rate:
+            continue
+        price = get_model_price(get_model_details(model)) if get_model_details else None
+        entry = (price if price is not None else float("inf"), profile["avg_latency"], model)
+        fallback.append(entry)
+        if profile["avg_latency"] <= latency_slo:
+            acceptable.append(entry)
+
+    if acceptable:
+        return min(acceptable)[2]
+    if fallback:
+        # 没有模型满足 SLO 时，选择最快的可靠模型
+        return min(fallback, key=lambda entry: entry[1])[2]
+    return None
+
+
+# 全局的模型性能档案实例（导入时不写文件，由应用调用 configure 指定保存位置）
+model_profiles = ModelProfileStore()
+# 进程退出时写入尚未保存的记录
+atexit.register(model_profiles.flush)
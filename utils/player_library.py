@@ -0,0 +1,158 @@
+# -*- coding: utf-8 -*- # Ensure UTF-8 encoding for wider character support
+
+"""
+播放器对话库导出
+把对话索引中的全部最终对话导出为 dialog-player.html 可以分页加载的静态文件：
+
+    player_library/index.json            总数、每页条数和各页文件
+    player_library/pages/page-00000.json 一页对话的标题和元数据（按时间倒序）
+    player_library/bodies/<id>.json      一段对话的对话行，选中时才加载；有预渲染音频时附带清单地址
+
+正文内容没有变化的文件不会重写。用 HTTP 服务打开播放器后填入 index.json 的地址，
+或使用 dialog-player.html?library=player_library/index.json
+
+用法:
+    python -m utils.player_library --index dialogue_store.db --output player_library --page-size 100
+"""
+
+import os
+import glob
+import json
+import hashlib
+import logging
+import datetime
+
+from .dialogue_parser import parse_dialogue
+from .audio_render import audio_directory
+
+
+LIBRARY_VERSION = 1
+
+
+def _write_json_atomic(path, data):
+    """先写临时文件再替换，播放器不会读到写了一半的文件"""
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(data, f, ensure_ascii=False, separators=(",", ":"))
+    os.replace(tmp_path, path)
+
+
+class PlayerLibraryExporter:
+    """
+    播放器对话库导出器
+    """
+    def __init__(self, file_manager, output_dir="player_library", page_size=100):
+        if not file_manager.store:
+            raise ValueError("导出对话库需要启用对话索引（FileManager 的 index_path）")
+        self.file_manager = file_manager
+        self.output_dir = output_dir
+        self.page_size = page_size
+        self.index_path = os.path.join(output_dir, "index.json")
+
+    def _load_digests(self):
+        """上次导出时各正文文件的内容摘要"""
+        digests = {}
+        for page_path in glob.glob(os.path.join(self.output_dir, "pages", "page-*.json")):
+            try:
+                with open(page_path, 'r', encoding='utf-8') as f:
+                    for entry in json.load(f)["entries"]:
+                        digests[entry["id"]] = entry["digest"]
+            except Exception as e:
+                logging.warning(f"忽略无法读取的分页文件 {page_path}: {str(e)}")
+        return digests
+
+    def _relative_url(self, path):
+        """相对于对话库目录的地址"""
+        return os.path.relpath(path, self.output_dir).replace(os.sep, "/")
+
+    def _build_body(self, row, data):
+        """一段对话的正文文件内容"""
+        turns = data.get("final_turns")
+        if turns is None:
+            turns = parse_dialogue(data.get("final_text", ""))
+        manifest_path = os.path.join(audio_directory(row["json_path"]), "manifest.json")
+        return {
+            "context": row.get("context") or "",
+            "goal": row.get("goal") or "",
+            "language": row.get("language"),
+            "difficulty": row.get("difficulty"),
+            "timestamp": row.get("timestamp"),
+            "turns": turns,
+            "audio": self._relative_url(manifest_path) if os.path.exists(manifest_path) else None,
+        }
+
+    def export(self):
+        """
+        导出全部最终对话
+
+        Returns:
+            dict: total（对话数）、pages（页数）和 written（重写的正文文件数）
+        """
+        for directory in ("pages", "bodies"):
+            os.makedirs(os.path.join(self.output_dir, directory), exist_ok=True)
+        self.file_manager.flush()
+        previous_digests = self._load_digests()
+
+        total = self.file_manager.count_dialogues(kind="final")
+        pages = []
+        used_bodies = set()
+        written = 0
+        for offset in range(0, total, self.page_size):
+            entries = []
+            for row in self.file_manager.list_dialogues(kind="final", limit=self.page_size, offset=offset):
+                # 每页条数固定，播放器按序号计算所在的页，读取失败的记录也保留位置
+                data = self.file_manager.store.get(row["json_path"]) or {}
+                body = self._build_body(row, data)
+                body_id = hashlib.sha1(row["json_path"].encode("utf-8")).hexdigest()[:16]
+                digest = hashlib.sha1(json.dumps(body, ensure_ascii=False, sort_keys=True).encode("utf-8")).hexdigest()
+                body_path = os.path.join(self.output_dir, "bodies", f"{body_id}.json")
+                if previous_digests.get(body_id) != digest or not os.path.exists(body_path):
+                    _write_json_atomic(body_path, body)
+                    written += 1
+                used_bodies.add(f"{body_id}.json")
+                entries.append({
+                    "id": body_id,
+                    "digest": digest,
+                    "title": body["context"],
+                    "goal": body["goal"],
+                    "language": body["language"],
+                    "difficulty": body["difficulty"],
+                    "timestamp": body["timestamp"],
+                    "lines": len(body["turns"]),
+                    "audio": body["audio"] is not None,
+                    "body": f"bodies/{body_id}.json",
+                })
+            page_name = f"pages/page-{len(pages):05d}.json"
+            _write_json_atomic(os.path.join(self.output_dir, page_name), {"page": len(pages), "entries": entries})
+            pages.append(page_name)
+
+        _write_json_atomic(self.index_path, {
+            "version": LIBRARY_VERSION,
+            "generated": datetime.datetime.now().strftime("%Y%m%d_%H%M%S"),
+            "total": total,
+            "page_size": self.page_size,
+            "pages": pages,
+        })
+
+        # 删除已不存在的对话和多余的分页
+        for path in glob.glob(os.path.join(self.output_dir, "bodies", "*.json")):
+            if os.path.basename(path) not in used_bodies:
+                os.remove(path)
+        for path in glob.glob(os.path.join(self.output_dir, "pages", "page-*.json")):
+            if self._relative_url(path) not in pages:
+                os.remove(path)
+        return {"total": total, "pages": len(pages), "written": written}
+
+
+if __name__ == "__main__":
+    import argparse
+    from utils.file_manager import FileManager
+
+    parser = argparse.ArgumentParser(description="导出播放器可以分页加载的对话库")
+    parser.add_argument("--index", default="dialogue_store.db", help="对话索引数据库路径")
+    parser.add_argument("--output", default="player_library", help="导出目录")
+    parser.add_argument("--page-size", type=int, default=100, help="每页对话数")
+    args = parser.parse_args()
+
+    result = PlayerLibraryExporter(FileManager(index_path=args.index), args.output, args.page_size).export()
+    print(f"已导出 {result['total']} 段对话（{result['pages']} 页，更新正文 {result['written']} 个）")
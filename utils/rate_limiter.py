@@ -0,0 +1,39 @@
+# -*- coding: utf-8 -*- # Ensure UTF-8 encoding for wider character support
+
+import time
+import threading
+
+
+class RateLimiter:
+    """
+    令牌桶限流器，可在多个线程间共用
+    以固定速率补充令牌，最多积累 burst 个，用于限制对 LLM API 的请求速率
+    """
+    def __init__(self, rate, burst=None):
+        """
+        Args:
+            rate (float): 每秒补充的令牌数
+            burst (int, optional): 令牌桶容量，默认与 rate 相同（至少为 1）
+        """
+        self.rate = rate
+        self.capacity = burst or max(1, int(rate))
+        self._tokens = float(self.capacity)
+        self._updated_at = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _reserve(self):
+        """预留一个令牌，返回需要等待的秒数"""
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.capacity, self._tokens + (now - self._updated_at) * self.rate)
+            self._updated_at = now
+            self._tokens -= 1
+            if self._tokens >= 0:
+                return 0.0
+            return -self._tokens / self.rate
+
+    def acquire(self):
+        """获取一个令牌（阻塞等待）"""
+        wait = self._reserve()
+        if wait > 0:
+            time.sleep(wait)
@@ -0,0 +1,136 @@
+# -*- coding: utf-8 -*- # Ensure UTF-8 encoding for wider character support
+
+import copy
+import json
+import time
+import sqlite3
+import hashlib
+import threading
+from collections import OrderedDict
+
+
+def make_cache_key(namespace, params):
+    """
+    根据参数生成缓存键（参数按键排序后序列化，顺序不同的相同参数得到相同的键）
+
+    Args:
+        namespace (str): 命名空间，如 "initial_dialogue"
+        params (dict): 可 JSON 序列化的参数
+
+    Returns:
+        str: 缓存键
+    """
+    canonical = json.dumps(params, ensure_ascii=False, sort_keys=True, separators=(",", ":"))
+    return f"{namespace}:{hashlib.sha256(canonical.encode('utf-8')).hexdigest()}"
+
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS responses (
+    key TEXT PRIMARY KEY,
+    value TEXT NOT NULL,
+    expires_at REAL,
+    created_at REAL NOT NULL
+)
+"""
+
+
+class ResponseCache:
+    """
+    线程安全的 LRU 响应缓存，支持过期时间
+    存取时都复制数据，调用方修改结果不会影响缓存；
+    指定 path 时同时写入 SQLite 文件，内存中未命中时从文件读取，
+    预热任务、HTTP 服务和界面等多个进程可以共用同一份缓存（数据需可 JSON 序列化）
+    """
+    def __init__(self, max_entries=1024, ttl=None, path=None):
+        """
+        Args:
+            max_entries (int): 内存中的最大条目数
+            ttl (float, optional): 过期时间（秒），None 表示不过期
+            path (str, optional): 持久化缓存的 SQLite 文件路径
+        """
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.path = path
+        self._entries = OrderedDict()  # key -> (过期时间, 数据)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self._conn = None
+        if path:
+            self._conn = sqlite3.connect(path, check_same_thread=False, timeout=30)
+            with self._conn:
+                self._conn.execute("PRAGMA journal_mode=WAL")
+                self._conn.execute(_SCHEMA)
+
+    def _remember(self, key, expires_at, value):
+        """放入内存 LRU（调用方需持有锁）"""
+        self._entries[key] = (expires_at, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def _lookup(self, key):
+        """查找未过期的条目，返回数据或 None（调用方需持有锁）"""
+        now = time.time()
+        entry = self._entries.get(key)
+        if entry is not None and entry[0] is not None and entry[0] < now:
+            del self._entries[key]
+            entry = None
+        if entry is None and self._conn is not None:
+            row = self._conn.execute(
+                "SELECT value, expires_at FROM responses WHERE key = ? AND (expires_at IS NULL OR expires_at >= ?)",
+                (key, now)
+            ).fetchone()
+            if row is not None:
+                entry = (row[1], json.loads(row[0]))
+                self._remember(key, *entry)
+        if entry is None:
+            return None
+        self._entries.move_to_end(key)
+        return entry[1]
+
+    def get(self, key):
+        """获取缓存的数据，不存在或已过期时返回 None"""
+        with self._lock:
+            value = self._lookup(key)
+            if value is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            return copy.deepcopy(value)
+
+    def set(self, key, value):
+        """写入缓存"""
+        expires_at = time.time() + self.ttl if self.ttl else None
+        with self._lock:
+            self._remember(key, expires_at, copy.deepcopy(value))
+            if self._conn is not None:
+                with self._conn:
+                    self._conn.execute(
+                        "INSERT OR REPLACE INTO responses (key, value, expires_at, created_at) VALUES (?, ?, ?, ?)",
+                        (key, json.dumps(value, ensure_ascii=False), expires_at, time.time())
+                    )
+
+    def delete(self, key):
+        """删除缓存的数据（例如读取后发现是无效结果）"""
+        with self._lock:
+            self._entries.pop(key, None)
+            if self._conn is not None:
+                with self._conn:
+                    self._conn.execute("DELETE FROM responses WHERE key = ?", (key,))
+
+    def __contains__(self, key):
+        with self._lock:
+            return self._lookup(key) is not None
+
+    def __len__(self):
+        with self._lock:
+            if self._conn is not None:
+                return self._conn.execute("SELECT COUNT(*) FROM responses").fetchone()[0]
+            return len(self._entries)
+
+    def get_stats(self):
+        """获取缓存统计"""
+        entries = len(self)
+        with self._lock:
+            return {"entries": entries, "hits": self.hits, "misses": self.misses}
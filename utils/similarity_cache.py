@@ -0,0 +1,182 @@
+# -*- coding: utf-8 -*- # Ensure UTF-8 encoding for wider character support
+
+import heapq
+import threading
+import unicodedata
+from collections import Counter
+
+
+# 必须完全一致（规范化后）才可复用的生成参数；不同的值生成的对话结构不同
+EXACT_MATCH_FIELDS = [
+    "language", "difficulty", "dialogue_mode", "num_turns",
+    "custom_vocabulary", "custom_sentence", "dramatic_elements"
+]
+# 按相似度比较的生成参数
+SIMILARITY_FIELDS = ["context", "goal"]
+
+_HASH_MASK = (1 << 64) - 1
+
+
+def normalize_for_similarity(text):
+    """规范化文本：全角转半角、转小写，并去掉空白、标点和符号"""
+    text = unicodedata.normalize("NFKC", str(text or "")).lower()
+    return "".join(char for char in text if unicodedata.category(char)[0] not in "PSZC")
+
+
+def char_ngrams(text, n=3):
+    """字符 n-gram 集合（文本短于 n 时返回整个文本）"""
+    if len(text) <= n:
+        return {text} if text else set()
+    return {text[i:i + n] for i in range(len(text) - n + 1)}
+
+
+def minhash_sketch(shingles, size=128):
+    """
+    bottom-k MinHash 草图：所有片段哈希值中最小的 size 个
+    （只在进程内比较，可以直接使用 Python 内置的字符串哈希）
+    """
+    return frozenset(heapq.nsmallest(size, {hash(shingle) & _HASH_MASK for shingle in shingles}))
+
+
+def estimate_jaccard(sketch_a, sketch_b, size=128):
+    """根据两个 bottom-k 草图估计 Jaccard 相似度（片段数少于 size 时为精确值）"""
+    if not sketch_a or not sketch_b:
+        return 0.0
+    union = heapq.nsmallest(size, sketch_a | sketch_b)
+    shared = sum(1 for value in union if value in sketch_a and value in sketch_b)
+    return shared / len(union)
+
+
+def _check_has_text(dialogue_data):
+    """默认的复用检查：对话数据中有非空的对话文本"""
+    original_text = dialogue_data.get("original_text") if isinstance(dialogue_data, dict) else None
+    if not isinstance(original_text, str) or not original_text.strip():
+        raise RuntimeError("没有对话内容")
+    return dialogue_data
+
+
+class SimilarityCache:
+    """
+    近似重复输入缓存
+    对已保存初始对话的生成参数建立字符 n-gram MinHash 草图，只在本地计算；
+    模型和 EXACT_MATCH_FIELDS 规范化后相同、且背景和目标的相似度超过阈值时，返回可复用的已保存对话。
+    数据来自对话索引，通过 DialogueStore.iter_changes 增量同步，其他进程保存的对话同样可以命中；
+    每个精确匹配分组内按草图哈希值建立倒排索引，只对共享哈希值最多的少数候选计算相似度
+    """
+    def __init__(self, store, threshold=0.9, ngram=3, sketch_size=128, max_candidates=20, check=None):
+        """
+        Args:
+            store (DialogueStore): 对话索引
+            threshold (float): 默认相似度阈值
+            ngram (int): 字符 n-gram 长度
+            sketch_size (int): MinHash 草图大小
+            max_candidates (int): 每次查找计算相似度的候选数量上限
+            check (callable, optional): 检查对话数据是否可以复用，不可复用时抛出 RuntimeError
+                （如 agents.pipeline.check_initial_dialogue）；默认只要求有对话文本
+        """
+        self.store = store
+        self.threshold = threshold
+        self.ngram = ngram
+        self.sketch_size = sketch_size
+        self.max_candidates = max_candidates
+        self.check = check or _check_has_text
+        self._entries = {}  # json_path -> (精确匹配键, 草图, 记录摘要)
+        self._postings = {}  # (精确匹配键, 哈希值) -> {json_path}
+        self._version = -1
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _bucket_key(params, model):
+        """精确匹配键（模型和 EXACT_MATCH_FIELDS）；缺少轮数的记录（旧版本保存）返回 None，不参与复用"""
+        if params.get("num_turns") in (None, ""):
+            return None
+        return (str(model or ""),) + tuple(
+            str(int(params["num_turns"])) if field == "num_turns" else normalize_for_similarity(params.get(field))
+            for field in EXACT_MATCH_FIELDS
+        )
+
+    def _sketch(self, params):
+        """背景和目标的 MinHash 草图（各字段的片段加上字段前缀，互不混淆）"""
+        shingles = set()
+        for field in SIMILARITY_FIELDS:
+            shingles |= {f"{field}:{shingle}" for shingle in char_ngrams(normalize_for_similarity(params.get(field)), self.ngram)}
+        return minhash_sketch(shingles, self.sketch_size)
+
+    def _sync(self):
+        """读取上次同步之后新增或更新的初始对话（调用方需持有锁）"""
+        for change in self.store.iter_changes(self._version, kind="initial"):
+            self._version = change["version"]
+            json_path = change["json_path"]
+            self._remove(json_path)
+
+            # 生成失败时保存的后备对话或空对话不参与复用
+            try:
+                self.check(change["data"])
+            except RuntimeError:
+                continue
+            metadata = change["data"].get("metadata") or {}
+            key = self._bucket_key(metadata, metadata.get("model"))
+            if key is None:
+                continue
+            summary = {
+                "json_path": json_path,
+                "md_path": change["md_path"],
+                "context": metadata.get("context", ""),
+                "goal": metadata.get("goal", ""),
+                "model": metadata.get("model"),
+                "timestamp": metadata.get("timestamp"),
+            }
+            sketch = self._sketch(metadata)
+            self._entries[json_path] = (key, sketch, summary)
+            for value in sketch:
+                self._postings.setdefault((key, value), set()).add(json_path)
+
+    def _remove(self, json_path):
+        """移除一条记录（对话被更新后重新加入）"""
+        entry = self._entries.pop(json_path, None)
+        if entry is None:
+            return
+        key, sketch, _ = entry
+        for value in sketch:
+            paths = self._postings.get((key, value))
+            if paths is not None:
+                paths.discard(json_path)
+                if not paths:
+                    del self._postings[(key, value)]
+
+    def find(self, params, threshold=None, model=None):
+        """
+        查找与生成参数近似重复的已保存初始对话
+
+        Args:
+            params (dict): Agent 1 的生成参数
+            threshold (float, optional): 相似度阈值，默认使用 self.threshold
+            model (str, optional): 生成使用的模型，只复用同一模型生成的对话
+
+        Returns:
+            dict: 最相似对话的 json_path、md_path、context、goal、model、timestamp 和 similarity；没有时返回 None
+        """
+        threshold = self.threshold if threshold is None else threshold
+        key = self._bucket_key(params, model)
+        if key is None:
+            return None
+        sketch = self._sketch(params)
+
+        with self._lock:
+            self._sync()
+            overlaps = Counter()
+            for value in sketch:
+                overlaps.update(self._postings.get((key, value), ()))
+            best, best_score = None, threshold
+            for json_path, _ in overlaps.most_common(self.max_candidates):
+                _, candidate_sketch, summary = self._entries[json_path]
+                score = estimate_jaccard(sketch, candidate_sketch, self.sketch_size)
+                if score >= best_score:
+                    best, best_score = summary, score
+        if best is None:
+            return None
+        return dict(best, similarity=best_score)
+
+    def __len__(self):
+        with self._lock:
+            return len(self._entries)
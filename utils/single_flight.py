@@ -0,0 +1,80 @@
+# -*- coding: utf-8 -*- # Ensure UTF-8 encoding for wider character support
+
+import re
+import copy
+import threading
+
+
+def normalize_text(value):
+    """规范化文本输入：去掉首尾空白，连续空白合并为一个空格"""
+    if value is None:
+        return ""
+    return re.sub(r"\s+", " ", str(value)).strip()
+
+
+class _Flight:
+    """一次进行中的调用"""
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    """
+    合并进程内相同键的并发调用
+    第一个调用者执行函数，执行期间到达的相同键的调用等待并共享同一个结果（或同一个异常）；
+    调用结束后不保留结果，之后的调用会重新执行
+    """
+    def __init__(self):
+        self._flights = {}
+        self._lock = threading.Lock()
+        self.executed = 0
+        self.coalesced = 0
+
+    def do(self, key, func, *args, **kwargs):
+        """
+        执行 func(*args, **kwargs)；已有相同键的调用在执行时等待其结果
+
+        Args:
+            key (hashable): 调用的键
+            func (callable): 要执行的函数
+
+        Returns:
+            函数返回值的副本（各调用者互相修改不受影响）
+        """
+        with self._lock:
+            flight = self._flights.get(key)
+            if flight is None:
+                flight = self._flights[key] = _Flight()
+                leader = True
+                self.executed += 1
+            else:
+                leader = False
+                self.coalesced += 1
+
+        if not leader:
+            flight.done.wait()
+            if flight.error is not None:
+                raise flight.error
+            return copy.deepcopy(flight.result)
+
+        try:
+            flight.result = func(*args, **kwargs)
+            return copy.deepcopy(flight.result)
+        except BaseException as e:
+            flight.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._flights[key]
+            flight.done.set()
+
+    def get_stats(self):
+        """获取执行和合并的调用次数"""
+        with self._lock:
+            return {"executed": self.executed, "coalesced": self.coalesced, "in_flight": len(self._flights)}
+
+
+# 全局的对话生成调用合并器
+generation_flights = SingleFlight()
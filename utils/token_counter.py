@@ -0,0 +1,99 @@
+# -*- coding: utf-8 -*- # Ensure UTF-8 encoding for wider character support
+
+import re
+import threading
+
+try:
+    import tiktoken
+    _ENCODING = tiktoken.get_encoding("cl100k_base")
+except Exception:
+    # 未安装 tiktoken 时退回到本地估算
+    _ENCODING = None
+
+
+# 中日韩字符大约每个字符一个 token，其余文本按单词和标点估算
+_CJK_PATTERN = re.compile(r'[぀-ヿ㐀-䶿一-鿿가-힯＀-￯]')
+_WORD_PATTERN = re.compile(r"[A-Za-z0-9]+|[^\sA-Za-z0-9]")
+
+
+def estimate_tokens(text):
+    """
+    估算文本的 token 数量（本地计算，无需网络）
+
+    Args:
+        text (str): 需要估算的文本
+
+    Returns:
+        int: 估算的 token 数
+    """
+    if not text:
+        return 0
+    cjk_count = len(_CJK_PATTERN.findall(text))
+    rest = _CJK_PATTERN.sub(" ", text)
+    tokens = 0
+    for piece in _WORD_PATTERN.findall(rest):
+        # 较长的英文单词通常会被拆成多个 token
+        tokens += max(1, (len(piece) + 3) // 4) if piece[0].isalnum() else 1
+    return cjk_count + tokens
+
+
+def count_tokens(text):
+    """
+    计算文本的 token 数量
+    已安装 tiktoken 时使用其分词器，否则使用 estimate_tokens 估算
+
+    Args:
+        text (str): 需要计算的文本
+
+    Returns:
+        int: token 数
+    """
+    if not text:
+        return 0
+    if _ENCODING is not None:
+        return len(_ENCODING.encode(text, disallowed_special=()))
+    return estimate_tokens(text)
+
+
+class TokenHistogram:
+    """
+    每次调用的提示 token 数直方图
+    按 2 的幂分桶（<=256, <=512, ...），用于观察提示大小的分布
+    """
+    def __init__(self, min_bucket=256, max_bucket=262144):
+        self.min_bucket = min_bucket
+        self.max_bucket = max_bucket
+        self.buckets = {}
+        self.total_calls = 0
+        self.total_tokens = 0
+        self.max_tokens = 0
+        self._lock = threading.Lock()
+
+    def _bucket_for(self, tokens):
+        """获取 token 数所属的桶上限"""
+        bucket = self.min_bucket
+        while bucket < tokens and bucket < self.max_bucket:
+            bucket *= 2
+        return bucket
+
+    def record(self, tokens):
+        """记录一次调用的 token 数"""
+        bucket = self._bucket_for(tokens)
+        with self._lock:
+            self.buckets[bucket] = self.buckets.get(bucket, 0) + 1
+            self.total_calls += 1
+            self.total_tokens += tokens
+            self.max_tokens = max(self.max_tokens, tokens)
+
+    def get_summary(self):
+        """获取直方图统计"""
+        return {
+            "total_calls": self.total_calls,
+            "average_tokens": self.total_tokens / self.total_calls if self.total_calls else 0,
+            "max_tokens": self.max_tokens,
+            "buckets": [{"upper_bound": bucket, "count": self.buckets[bucket]} for bucket in sorted(self.buckets)]
+        }
+
+
+# 全局的提示 token 直方图
+token_histogram = TokenHistogram()
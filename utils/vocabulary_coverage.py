@@ -0,0 +1,188 @@
+# -*- coding: utf-8 -*- # Ensure UTF-8 encoding for wider character support
+
+import re
+import unicodedata
+from collections import deque
+
+
+# 词：中日文按单字计，其余文字按连续字母数字计（保留 I'm、don't 这类缩写）
+_TOKEN = re.compile(r"[぀-ヿ㐀-鿿]|[^\W_぀-ヿ㐀-鿿]+(?:['’][^\W_぀-ヿ㐀-鿿]+)*")
+# 句型中的占位部分：省略号、下划线、sb / sth 以及括号中的说明
+_PLACEHOLDER = re.compile(
+    r"\.{2,}|…+|_{2,}|\[[^\]]*\]|【[^】]*】|\([^)]*\)|（[^）]*）|\b(?:sb|sth|somebody|something|someone)\b\.?",
+    re.IGNORECASE
+)
+_ITEM_SEPARATOR = re.compile(r"[,，;；\n]")
+# 英文常见屈折词尾，按顺序尝试去掉其中一个
+_SUFFIXES = ("ing", "ed", "es", "s")
+
+
+def normalize_token(token):
+    """
+    简单的词形归一：转小写，去掉一个常见的屈折词尾和结尾的 e
+    （make / makes / making 归一为同一个词；只用于匹配，文本和词汇使用相同的规则）
+    """
+    token = token.lower().replace("’", "'")
+    if not token.isascii():
+        return token
+    for suffix in _SUFFIXES:
+        if token.endswith(suffix) and len(token) - len(suffix) >= 3 and not token.endswith("ss"):
+            token = token[:-len(suffix)]
+            break
+    if len(token) > 3 and token.endswith("e"):
+        token = token[:-1]
+    return token
+
+
+def tokenize(text):
+    """将文本切分为归一化的词序列（全角字符先转为半角）"""
+    return [normalize_token(token) for token in _TOKEN.findall(unicodedata.normalize("NFKC", str(text or "")))]
+
+
+def split_items(text):
+    """将逗号、分号或换行分隔的输入拆分为列表（支持中英文标点）"""
+    return [item.strip() for item in _ITEM_SEPARATOR.split(text or "") if item.strip()]
+
+
+def sentence_segments(sentence):
+    """按占位部分把句型拆分为依次出现的固定片段，例如 "not only ... but also" 拆为两段"""
+    return [segment for segment in (tokenize(part) for part in _PLACEHOLDER.split(sentence)) if segment]
+
+
+class AhoCorasick:
+    """
+    Aho–Corasick 多模式匹配自动机
+    模式和文本都是词序列，一次扫描找出所有模式的全部出现位置
+    """
+    def __init__(self, patterns):
+        """
+        Args:
+            patterns (list): 模式列表，每个模式是非空的词序列
+        """
+        self._goto = [{}]
+        self._fail = [0]
+        self._output = [[]]
+        for pattern_id, pattern in enumerate(patterns):
+            state = 0
+            for symbol in pattern:
+                next_state = self._goto[state].get(symbol)
+                if next_state is None:
+                    next_state = len(self._goto)
+                    self._goto[state][symbol] = next_state
+                    self._goto.append({})
+                    self._fail.append(0)
+                    self._output.append([])
+                state = next_state
+            self._output[state].append((pattern_id, len(pattern)))
+        self._build_failure_links()
+
+    def _build_failure_links(self):
+        """按层次遍历建立失败指针，并把失败状态的输出合并进来"""
+        queue = deque(self._goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for symbol, next_state in self._goto[state].items():
+                queue.append(next_state)
+                fallback = self._fail[state]
+                while fallback and symbol not in self._goto[fallback]:
+                    fallback = self._fail[fallback]
+                self._fail[next_state] = self._goto[fallback].get(symbol, 0)
+                self._output[next_state] = self._output[next_state] + self._output[self._fail[next_state]]
+
+    def search(self, tokens):
+        """
+        在词序列中查找所有模式
+
+        Yields:
+            tuple: (pattern_id, start, end)，end 不包含在内
+        """
+        state = 0
+        for index, symbol in enumerate(tokens):
+            while state and symbol not in self._goto[state]:
+                state = self._fail[state]
+            state = self._goto[state].get(symbol, 0)
+            for pattern_id, length in self._output[state]:
+                yield pattern_id, index + 1 - length, index + 1
+
+
+class CoverageChecker:
+    """
+    自定义词汇和句型的覆盖检查器
+    词汇在对话任意位置出现即视为覆盖；句型的各固定片段需要在同一行中按顺序出现
+    """
+    def __init__(self, vocabulary=None, sentences=None):
+        """
+        Args:
+            vocabulary (list): 需要出现的词汇
+            sentences (list): 需要使用的句型，可以用 ...、sb、sth 等表示可替换的部分
+        """
+        self.items = []  # [(类型, 原始文本)]
+        patterns = []
+        self._segments = []  # 每个条目对应的模式编号
+        for kind, values in (("vocabulary", vocabulary or []), ("sentence", sentences or [])):
+            for value in values:
+                segments = [tokenize(value)] if kind == "vocabulary" else sentence_segments(value)
+                segments = [segment for segment in segments if segment]
+                if not segments:
+                    continue
+                self._segments.append(list(range(len(patterns), len(patterns) + len(segments))))
+                patterns.extend(segments)
+                self.items.append((kind, value))
+        self._automaton = AhoCorasick(patterns)
+
+    def _line_items(self, line):
+        """一行中覆盖的条目编号"""
+        occurrences = {}
+        for pattern_id, start, end in self._automaton.search(tokenize(line)):
+            occurrences.setdefault(pattern_id, []).append((start, end))
+        if not occurrences:
+            return set()
+
+        covered = set()
+        for item_id, pattern_ids in enumerate(self._segments):
+            position = 0
+            for pattern_id in pattern_ids:
+                # 依次取每个片段在上一个片段之后的最早出现位置
+                ends = [end for start, end in occurrences.get(pattern_id, ()) if start >= position]
+                if not ends:
+                    break
+                position = min(ends)
+            else:
+                covered.add(item_id)
+        return covered
+
+    def check(self, lines):
+        """
+        检查对话各行的覆盖情况
+
+        Args:
+            lines (list): 对话文本按行拆分的列表
+
+        Returns:
+            dict: covered / missing（条目原文列表）、item_lines（条目原文 -> 出现的行号列表）
+                和 line_items（包含条目的行号 -> 条目原文列表）
+        """
+        item_lines = {}
+        line_items = {}
+        if self.items:
+            for index, line in enumerate(lines):
+                for item_id in sorted(self._line_items(line)):
+                    value = self.items[item_id][1]
+                    item_lines.setdefault(value, []).append(index)
+                    line_items.setdefault(index, []).append(value)
+        return {
+            "covered": [value for _, value in self.items if value in item_lines],
+            "missing": [value for _, value in self.items if value not in item_lines],
+            "item_lines": item_lines,
+            "line_items": line_items,
+        }
+
+    def kind_of(self, value):
+        """条目的类型："vocabulary" 或 "sentence" """
+        for kind, item in self.items:
+            if item == value:
+                return kind
+        return None
+
+    def __bool__(self):
+        return bool(self.items)
@@ -0,0 +1,175 @@
+# -*- coding: utf-8 -*- # Ensure UTF-8 encoding for wider character support
+
+import os
+import queue
+import atexit
+import logging
+import threading
+
+
+class WriteHandle:
+    """
+    单次写入请求的句柄，可用于等待写入完成并获取错误信息
+    """
+    def __init__(self, path):
+        self.path = path
+        self.error = None
+        self._done = threading.Event()
+
+    def _finish(self, error=None):
+        """标记写入完成"""
+        self.error = error
+        self._done.set()
+
+    def done(self):
+        """写入是否已完成（成功或失败）"""
+        return self._done.is_set()
+
+    def wait(self, timeout=None):
+        """
+        等待写入完成
+
+        Returns:
+            bool: 写入成功返回 True；超时或失败返回 False
+        """
+        if not self._done.wait(timeout):
+            return False
+        return self.error is None
+
+
+class WriteBehindWriter:
+    """
+    后台写入线程
+    调用方提交写入后立即返回，由后台线程完成写入：
+    覆盖写入使用"临时文件 + 重命名"保证原子性，追加写入按提交顺序执行；
+    每批写入结束后统一对目录执行一次 fsync
+    """
+    def __init__(self, fsync=True, max_batch=64):
+        self.fsync = fsync
+        self.max_batch = max_batch
+        self._queue = queue.Queue()
+        self._pending = {}  # path -> 最近一次提交的写入句柄
+        self._lock = threading.Lock()
+        self._thread = threading.Thread(target=self._run, name="write-behind", daemon=True)
+        self._thread.start()
+        atexit.register(self.flush)
+
+    def submit(self, path, text, mode='w'):
+        """
+        提交一次写入
+
+        Args:
+            path (str): 文件路径
+            text (str): 写入内容
+            mode (str): 'w' 覆盖写入（原子）或 'a' 追加写入
+
+        Returns:
+            WriteHandle: 写入句柄
+        """
+        handle = WriteHandle(path)
+        with self._lock:
+            self._pending[path] = handle
+        self._queue.put((path, text, mode, handle))
+        return handle
+
+    def wait_for(self, path, timeout=None):
+        """等待某个路径上已提交的写入全部完成，用于先写后读的场景"""
+        with self._lock:
+            handle = self._pending.get(path)
+        return handle.wait(timeout) if handle else True
+
+    def has_pending(self, path):
+        """某个路径是否有尚未完成的写入"""
+        with self._lock:
+            handle = self._pending.get(path)
+        return handle is not None and not handle.done()
+
+    def flush(self, timeout=None):
+        """
+        等待所有已提交的写入完成
+
+        Returns:
+            bool: 全部成功返回 True
+        """
+        with self._lock:
+            handles = list(self._pending.values())
+        return all(handle.wait(timeout) for handle in handles)
+
+    def _run(self):
+        """后台线程主循环：每次取出一批写入统一处理"""
+        while True:
+            batch = [self._queue.get()]
+            while len(batch) < self.max_batch:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            self._write_batch(batch)
+
+    def _coalesce(self, batch):
+        """
+        合并同一批次中对同一文件的多次覆盖写入，只保留最后一次
+        同一文件存在追加写入时保持原样，以免打乱写入顺序
+        """
+        appended = {path for path, _, mode, _ in batch if mode == 'a'}
+        last_write = {}
+        for index, (path, _, mode, _) in enumerate(batch):
+            if mode == 'w' and path not in appended:
+                last_write[path] = index
+
+        # 被合并的句柄跟随保留下来的写入一起完成
+        superseded = {}
+        for index, (path, _, mode, handle) in enumerate(batch):
+            if mode == 'w' and path in last_write and last_write[path] != index:
+                superseded.setdefault(last_write[path], []).append(handle)
+
+        return [
+            (item, superseded.get(index, []))
+            for index, item in enumerate(batch)
+            if not (item[2] == 'w' and item[0] in last_write and last_write[item[0]] != index)
+        ]
+
+    def _write_batch(self, batch):
+        """执行一批写入"""
+        directories = set()
+        for (path, text, mode, handle), merged_handles in self._coalesce(batch):
+            error = None
+            try:
+                directory = os.path.dirname(os.path.abspath(path))
+                if mode == 'a':
+                    with open(path, 'a', encoding='utf-8') as f:
+                        f.write(text)
+                        f.flush()
+                        if self.fsync:
+                            os.fsync(f.fileno())
+                else:
+                    tmp_path = f"{path}.tmp"
+                    with open(tmp_path, 'w', encoding='utf-8') as f:
+                        f.write(text)
+                        f.flush()
+                        if self.fsync:
+                            os.fsync(f.fileno())
+                    os.replace(tmp_path, path)
+                directories.add(directory)
+            except Exception as e:
+                error = e
+                logging.error(f"后台写入文件失败 {path}: {e}")
+            for finished in [handle] + merged_handles:
+                finished._finish(error)
+            with self._lock:
+                # 写入成功且该路径没有更新的写入时移除记录，避免长期运行时不断增长；
+                # 失败的句柄保留，使 flush() 能报告失败
+                if error is None and self._pending.get(path) is handle:
+                    del self._pending[path]
+
+        # 每批只对涉及的目录做一次 fsync，使重命名持久化
+        if self.fsync and hasattr(os, "O_DIRECTORY"):
+            for directory in directories:
+                try:
+                    fd = os.open(directory, os.O_RDONLY | os.O_DIRECTORY)
+                    try:
+                        os.fsync(fd)
+                    finally:
+                        os.close(fd)
+                except OSError as e:
+                    logging.warning(f"目录 fsync 失败 {directory}: {e}")
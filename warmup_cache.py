@@ -0,0 +1,192 @@
+# -*- coding: utf-8 -*- # Ensure UTF-8 encoding for wider character support
+
+"""
+预热响应缓存（无界面）
+
+为场景库中的每个场景 × 难度 × 语言预先生成初始对话和改编后的对话，写入持久化响应缓存。
+界面（勾选"优先使用预生成的对话"时）和 HTTP 服务遇到输入完全一致的请求时直接返回缓存结果。
+已在缓存中的条目会跳过（检查不通过的旧条目会删除并重新生成），可在低峰时段定时运行，例如 cron:
+
+    0 3 * * * cd /path/to/app && python warmup_cache.py --until 06:00
+
+场景库为 JSON 文件（见 scenario_library.json）：
+    difficulties / languages  默认的难度和语言列表
+    defaults                  各场景共用的生成参数和角色特质 traits
+    scenarios                 场景列表，每项至少包含 context 和 goal，可覆盖 defaults 中的字段以及 difficulties / languages
+
+缓存键包含全部生成参数，场景库中的默认值应与界面默认输入保持一致才能命中。
+
+用法:
+    python warmup_cache.py --library scenario_library.json --workers 4 --rate-limit 1 --ttl 604800
+"""
+
+import os
+import sys
+import json
+import time
+import logging
+import argparse
+import datetime
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from dotenv import load_dotenv
+
+from agents.pipeline import (
+    create_api_client, create_agent, generate_initial_dialogue, adapt_dialogue, get_generation_params,
+    initial_cache_key, adaptation_cache_key, check_initial_dialogue, check_final_dialogue, get_cached_result
+)
+from utils.rate_limiter import RateLimiter
+from utils.response_cache import ResponseCache
+from utils.model_profiler import model_profiles
+
+
+def load_library(path):
+    """读取场景库"""
+    with open(path, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+
+def expand_library(library, difficulties=None, languages=None):
+    """
+    将场景库展开为预热任务列表
+
+    Args:
+        library (dict): 场景库
+        difficulties (list, optional): 覆盖场景库中的难度列表
+        languages (list, optional): 覆盖场景库中的语言列表
+
+    Returns:
+        list: 每项包含 params（生成参数）和 traits（角色特质，可为空）
+    """
+    defaults = library.get("defaults", {})
+    items = []
+    for scenario in library.get("scenarios", []):
+        merged = {**defaults, **scenario}
+        traits = {**defaults.get("traits", {}), **scenario.get("traits", {})}
+        for difficulty in difficulties or merged.get("difficulties") or library.get("difficulties") or ["B1"]:
+            for language in languages or merged.get("languages") or library.get("languages") or ["英文"]:
+                params = get_generation_params(dict(merged, difficulty=difficulty, language=language))
+                items.append({"params": params, "traits": traits})
+    return items
+
+
+def parse_deadline(value):
+    """将 HH:MM 解析为今天（已过则为明天）该时刻的时间戳"""
+    now = datetime.datetime.now()
+    hour, minute = (int(part) for part in value.split(":"))
+    deadline = now.replace(hour=hour, minute=minute, second=0, microsecond=0)
+    if deadline <= now:
+        deadline += datetime.timedelta(days=1)
+    return deadline.timestamp()
+
+
+def warm_item(item, client, api_provider, models, cache, rate_limiter=None, refresh=False, deadline=None):
+    """
+    预热一个场景：初始对话不在缓存中时生成，再用其结果生成改编后的对话
+    只有检查通过的结果才写入缓存，缓存中无效的条目按未命中处理
+
+    Returns:
+        dict: generated（新生成的条目数）、cached（已在缓存中的条目数）和 skipped（是否因超过截止时间跳过）
+    """
+    if deadline and time.time() >= deadline:
+        return {"generated": 0, "cached": 0, "skipped": True}
+
+    params = item["params"]
+    generated = cached = 0
+
+    initial_key = initial_cache_key(params, models["initial_dialogue"])
+    dialogue_data = None if refresh else get_cached_result(cache, initial_key, check_initial_dialogue)
+    if dialogue_data is None:
+        agent = create_agent("initial_dialogue", client, api_provider, models["initial_dialogue"], rate_limiter=rate_limiter)
+        dialogue_data = check_initial_dialogue(generate_initial_dialogue(agent, params))
+        cache.set(initial_key, dialogue_data)
+        generated += 1
+    else:
+        cached += 1
+
+    traits = item.get("traits")
+    if traits:
+        adaptation_key = adaptation_cache_key(dialogue_data, traits, params["language"], models["style_adaptation"])
+        if refresh or get_cached_result(cache, adaptation_key, check_final_dialogue) is None:
+            agent = create_agent("style_adaptation", client, api_provider, models["style_adaptation"], rate_limiter=rate_limiter)
+            final_text = check_final_dialogue(adapt_dialogue(agent, dialogue_data, traits, params["language"]))
+            cache.set(adaptation_key, final_text)
+            generated += 1
+        else:
+            cached += 1
+    return {"generated": generated, "cached": cached, "skipped": False}
+
+
+def run_warmup(items, client, api_provider, models, cache, workers=4, rate_limiter=None, refresh=False, deadline=None):
+    """
+    并发预热所有场景，单个场景失败不影响其他场景
+
+    Returns:
+        dict: 各状态的条目数量
+    """
+    summary = {"generated": 0, "cached": 0, "skipped": 0, "failed": 0}
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = {
+            executor.submit(warm_item, item, client, api_provider, models, cache, rate_limiter, refresh, deadline): item
+            for item in items
+        }
+        for future in as_completed(futures):
+            params = futures[future]["params"]
+            try:
+                result = future.result()
+            except Exception as e:
+                summary["failed"] += 1
+                logging.warning(f"预热失败 ({params['context'][:20]} / {params['difficulty']} / {params['language']}): {e}")
+                continue
+            summary["generated"] += result["generated"]
+            summary["cached"] += result["cached"]
+            summary["skipped"] += int(result["skipped"])
+    return summary
+
+
+def main():
+    parser = argparse.ArgumentParser(description="为常用场景预生成对话并写入响应缓存")
+    parser.add_argument("--library", default="scenario_library.json", help="场景库文件")
+    parser.add_argument("--cache", default="response_cache.db", help="持久化响应缓存路径")
+    parser.add_argument("--profiles", default="model_profiles.db", help="模型性能档案路径")
+    parser.add_argument("--difficulties", nargs="+", help="覆盖场景库中的难度列表")
+    parser.add_argument("--languages", nargs="+", help="覆盖场景库中的语言列表")
+    parser.add_argument("--workers", type=int, default=4, help="并发数")
+    parser.add_argument("--rate-limit", type=float, default=1.0, help="每秒最多发起的 LLM 请求数")
+    parser.add_argument("--api-provider", choices=["openai", "openrouter"], default="openai")
+    parser.add_argument("--model", default="o3-mini", help="Agent 1 和 Agent 2 默认使用的模型")
+    parser.add_argument("--initial-model", help="Agent 1 使用的模型")
+    parser.add_argument("--adaptation-model", help="Agent 2 使用的模型")
+    parser.add_argument("--until", help="截止时间 HH:MM，之后不再开始新的场景（用于限定在低峰时段）")
+    parser.add_argument("--refresh", action="store_true", help="重新生成已在缓存中的条目")
+    parser.add_argument("--ttl", type=float, help="写入的缓存条目的过期时间（秒），默认不过期")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s")
+    load_dotenv()
+
+    client = create_api_client(args.api_provider, os.getenv("OPENROUTER_API_KEY", ""), pool_size=args.workers)
+    if client is None:
+        print("创建API客户端失败，请检查API设置")
+        return 1
+    models = {
+        "initial_dialogue": args.initial_model or args.model,
+        "style_adaptation": args.adaptation_model or args.model,
+    }
+    model_profiles.configure(args.profiles)
+    items = expand_library(load_library(args.library), args.difficulties, args.languages)
+    logging.info(f"共 {len(items)} 个场景组合")
+
+    summary = run_warmup(
+        items, client, args.api_provider, models, ResponseCache(ttl=args.ttl, path=args.cache),
+        workers=args.workers,
+        rate_limiter=RateLimiter(args.rate_limit),
+        refresh=args.refresh,
+        deadline=parse_deadline(args.until) if args.until else None
+    )
+    print(f"新生成: {summary['generated']}，已缓存: {summary['cached']}，"
+          f"超时跳过: {summary['skipped']}，失败: {summary['failed']}")
+    return 0 if summary["failed"] == 0 else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())